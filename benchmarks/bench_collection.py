@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Benchmarks the collection against simulated vCenter Servers of increasing inventory size. For each size,
+it measures the inventory sync, the metric metadata sync, a full read_metric_values cycle, the datapoints
+per second through _parse_query and _build_payload, and the peak RSS. Each size runs in its own process
+so that the peak RSS is its own.
+
+Usage: python benchmarks/bench_collection.py [--sizes 100,1000] [--output results.json]
+                                             [--budgets benchmarks/budgets.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import constants  # noqa: E402
+import datapoints  # noqa: E402
+import inventory  # noqa: E402
+import metric_metadata  # noqa: E402
+import payload  # noqa: E402
+from benchmarks import simulator  # noqa: E402
+
+DEFAULT_SIZES = '100,1000,10000,50000'
+VMS_PER_HOST = 20
+HOSTS_PER_CLUSTER = 16
+CLUSTERS_PER_DATACENTER = 8
+# Results which must not exceed their budget, budgets prefixed with min_ are lower bounds instead
+BUDGETED_RESULTS = ('inventory_sync_seconds', 'metric_sync_seconds', 'cycle_seconds', 'peak_rss_kb',
+                    'parse_datapoints_per_second')
+
+
+def topology_for(entities):
+    """
+    Returns a topology of about the given number of entities (datacenters, clusters, hosts and VMs).
+    :param entities: Number of entities
+    :return: simulator.Topology
+
+    """
+    hosts = max(1, entities // (VMS_PER_HOST + 1))
+    clusters = max(1, hosts // HOSTS_PER_CLUSTER)
+    datacenters = max(1, clusters // CLUSTERS_PER_DATACENTER)
+    return simulator.Topology(datacenters=datacenters, clusters=max(1, clusters // datacenters),
+                              hosts=max(1, hosts // clusters), vms=VMS_PER_HOST)
+
+
+def _config(args):
+    return {
+        'host': 'simulator', 'username': 'user', 'password': 'password', 'Name': 'Simulator',
+        'IngestToken': 'token', 'IngestEndpoint': 'http://localhost', 'IngestTimeout': 10,
+        'MORSyncInterval': 3600, 'MetricSyncInterval': 3600, 'MORSyncTimeout': 3600, 'MetricSyncTimeout': 3600,
+        'MORSyncMode': args.sync_mode, 'QueryBatchSize': args.query_batch_size,
+    }
+
+
+def _timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def _parse_rate(env):
+    """
+    Measures the datapoints per second through _parse_query and _build_payload, on query results
+    fetched beforehand.
+    :param env: SimulatedEnvironment
+    :return: (datapoints, seconds)
+
+    """
+    inv_objs = env._inventory_mgr.current_inventory()
+    monitored_metrics = env._metric_mgr.get_monitored_metrics()
+    perf_manager = env._si.RetrieveServiceContent().perfManager
+    query_specs = env._build_query_specs(inv_objs, monitored_metrics)
+    results = []
+    for batch in env._batch_query_specs(query_specs):
+        targets = dict((item[2].entity._GetMoId(), item) for item in batch)
+        for entity_metric in perf_manager.QueryPerf(querySpec=[item[2] for item in batch]):
+            results.append((targets[entity_metric.entity._GetMoId()], entity_metric))
+    payload_builder = payload.PayloadBuilder(constants.DEFAULT_INGEST_BATCH_SIZE,
+                                             constants.DEFAULT_INGEST_BATCH_BYTES, lambda items: None)
+    start = time.time()
+    count = 0
+    for (inv_obj, metrics, query_spec), entity_metric in results:
+        batch = datapoints.DatapointBatch(int(start) * 1000)
+        env._parse_query(inv_obj, entity_metric, metrics, batch)
+        batch.normalize()
+        env._build_payload(batch, payload_builder)
+        count += len(batch)
+    payload_builder.flush()
+    return count, time.time() - start
+
+
+def run_size(entities, args):
+    """
+    Runs the benchmark for one inventory size in the current process.
+    :param entities: Approximate number of entities
+    :param args: Parsed command line arguments
+    :return: dict of results
+
+    """
+    sim = simulator.Simulator(topology_for(entities))
+    si = sim.service_instance()
+    config = _config(args)
+    inventory_mgr = inventory.InventoryManager(si, 3600, 'Simulator', 'Simulator-bench',
+                                               inventory_conf={'sync_mode': args.sync_mode})
+    inventory_sync_seconds, x = _timed(inventory_mgr.sync_inventory)
+    inv_objs = inventory_mgr.current_inventory()
+    metric_mgr = metric_metadata.MetricManager(si, 3600, {}, 'Simulator', 'Simulator-bench')
+    metric_sync_seconds, x = _timed(metric_mgr._sync_metrics)
+
+    env = simulator.SimulatedEnvironment(config, sim)
+    try:
+        cycle_seconds, x = _timed(env.read_metric_values)
+        parsed, parse_seconds = _parse_rate(env)
+    finally:
+        env.stop_managers()
+    return {
+        'entities': sum(len(objs) for objs in inv_objs.values()),
+        'vms': len(inv_objs['vm']),
+        'inventory_sync_seconds': round(inventory_sync_seconds, 4),
+        'metric_sync_seconds': round(metric_sync_seconds, 4),
+        'cycle_seconds': round(cycle_seconds, 4),
+        'datapoints': env.sent_datapoints(),
+        'parse_datapoints_per_second': int(parsed / parse_seconds) if parse_seconds else 0,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def check_budgets(results, budgets):
+    """
+    Compares the results with the budgets of the closest inventory size at or above their size.
+    :param results: List of results
+    :param budgets: Mapping of inventory size to mapping of result name to budget
+    :return: list of budget violation messages
+
+    """
+    violations = []
+    sizes = sorted(int(size) for size in budgets)
+    for result in results:
+        size = next((size for size in sizes if size >= result['size']), None)
+        if size is None:
+            continue
+        for name, budget in budgets[str(size)].items():
+            minimum = name.startswith('min_')
+            if minimum:
+                name = name[len('min_'):]
+            if name not in BUDGETED_RESULTS or name not in result:
+                continue
+            if (result[name] < budget) if minimum else (result[name] > budget):
+                violations.append("{0} entities: {1} is {2}, budget {3}{4}".format(
+                    result['size'], name, result[name], 'at least ' if minimum else '', budget))
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma separated inventory sizes')
+    parser.add_argument('--sync-mode', default=constants.DEFAULT_MOR_SYNC_MODE, choices=constants.MOR_SYNC_MODES)
+    parser.add_argument('--query-batch-size', type=int, default=constants.DEFAULT_QUERY_BATCH_SIZE)
+    parser.add_argument('--output', help='File to write the results to as JSON')
+    parser.add_argument('--budgets', help='JSON file of budgets per inventory size, exits with 1 when exceeded')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.single:
+        print(json.dumps(run_size(args.single, args)))
+        return
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        command = [sys.executable, os.path.abspath(__file__), '--single', str(size), '--sync-mode', args.sync_mode,
+                   '--query-batch-size', str(args.query_batch_size)]
+        output = subprocess.check_output(command).decode()
+        result = json.loads(output.strip().splitlines()[-1])
+        result['size'] = size
+        results.append(result)
+        print("{size:>6} entities: inventory {inventory_sync_seconds}s, metrics {metric_sync_seconds}s, "
+              "cycle {cycle_seconds}s, {parse_datapoints_per_second} dp/s, "
+              "peak RSS {peak_rss_kb} KB".format(**result))
+
+    report = {'sync_mode': args.sync_mode, 'query_batch_size': args.query_batch_size, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.budgets:
+        with open(args.budgets) as f:
+            violations = check_budgets(results, json.load(f))
+        for violation in violations:
+            print("Over budget: {0}".format(violation))
+        if violations:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
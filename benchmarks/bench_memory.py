@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Measures the memory allocated per datapoint by the collection hot path, comparing the
+previous one-object-per-datapoint representation with DatapointBatch. Each layout is measured
+alone and together with the ingest payload items built from it, which hold one dict per
+datapoint until they are sent.
+
+Usage: python benchmarks/bench_memory.py [datapoints]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import datapoints  # noqa: E402
+import metric_metadata  # noqa: E402
+import payload  # noqa: E402
+
+DEFAULT_DATAPOINTS = 200000
+METRICS_PER_ENTITY = 20
+PAYLOAD_DATAPOINTS = 2000
+
+
+class Datapoint(object):
+    """
+
+    Plain Object to hold metric as a datapoint, as previously used by Environment.
+
+    """
+    def __init__(self, metric_name, metric_type, value, dimension_set, timestamp):
+        self.metric_name = metric_name
+        self.metric_type = metric_type
+        self.value = value
+        self.dimension_set = dimension_set
+        self.timestamp = timestamp
+
+
+def _build_objects(count, metrics, dimension_sets, timestamp):
+    dps = []
+    for x in range(count):
+        metric = metrics[x % METRICS_PER_ENTITY]
+        value = x
+        if metric.units == 'percent':
+            value /= 100.0
+        dps.append(Datapoint(metric.name, metric.metric_type, value,
+                             dimension_sets[x // METRICS_PER_ENTITY], timestamp))
+    return dps
+
+
+def _build_batch(count, metrics, dimension_sets, timestamp):
+    batch = datapoints.DatapointBatch(timestamp)
+    for x in range(count):
+        batch.append(metrics[x % METRICS_PER_ENTITY], x, dimension_sets[x // METRICS_PER_ENTITY])
+    batch.normalize()
+    return batch
+
+
+def _build_objects_payload(count, metrics, dimension_sets, timestamp):
+    dps = _build_objects(count, metrics, dimension_sets, timestamp)
+    items = []
+    payload_builder = payload.PayloadBuilder(PAYLOAD_DATAPOINTS, 0, items.extend)
+    for dp in dps:
+        payload_builder.add(dp.metric_name, dp.metric_type, dp.value, dp.dimension_set, dp.timestamp)
+    payload_builder.flush()
+    return dps, items
+
+
+def _build_batch_payload(count, metrics, dimension_sets, timestamp):
+    batch = _build_batch(count, metrics, dimension_sets, timestamp)
+    items = []
+    payload_builder = payload.PayloadBuilder(PAYLOAD_DATAPOINTS, 0, items.extend)
+    payload_builder.add_batch(batch)
+    payload_builder.flush()
+    return batch, items
+
+
+def _measure(build, count, metrics, dimension_sets):
+    tracemalloc.start()
+    result = build(count, metrics, dimension_sets, 1516696283000)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DATAPOINTS
+    metrics = [metric_metadata.MetricInfo('metric.{0}.average'.format(x), 1, 'gauge',
+                                          'percent' if x % 2 else 'kiloBytes') for x in range(METRICS_PER_ENTITY)]
+    dimension_sets = [payload.DimensionSet({'vm': 'vm-{0}'.format(x), 'metric_source': 'vsphere'})
+                      for x in range(count // METRICS_PER_ENTITY + 1)]
+    print("{0:<16} {1:>14} {2:>14} {3:>10}".format('layout', 'retained(B)', 'peak(B)', 'B/dp'))
+    for name, build in (('objects', _build_objects), ('batch', _build_batch),
+                        ('objects+payload', _build_objects_payload), ('batch+payload', _build_batch_payload)):
+        current, peak = _measure(build, count, metrics, dimension_sets)
+        print("{0:<16} {1:>14} {2:>14} {3:>10.1f}".format(name, current, peak, float(current) / count))
+
+
+if __name__ == '__main__':
+    main()
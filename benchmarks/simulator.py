@@ -0,0 +1,592 @@
+"""
+Module containing an in-process stand-in for a vCenter Server, for testing the collector at scale
+without a network. The simulator is a pyVmomi stub adapter: managed objects bound to it answer
+property accessors and the methods used by the collector with generated pyVmomi data objects.
+"""
+
+import collections
+import datetime
+import threading
+import time
+import zlib
+from pyVmomi import vim, vmodl
+
+import environment
+import vsphere_metrics
+
+ROOT_FOLDER = 'group-d1'
+SAMPLE_INTERVAL = 20
+# Counter groups reporting per instance values in addition to the aggregated value
+INSTANCE_GROUPS = {
+    'cpu': 'cpu{0}',
+    'datastore': 'datastore-{0}',
+    'disk': 'naa.{0:016x}',
+    'net': 'vmnic{0}',
+    'virtualDisk': 'scsi0:{0}',
+}
+
+
+class Topology(object):
+    """
+
+    Shape of the simulated inventory. Counts are per parent object, eg: hosts per cluster.
+
+    """
+    def __init__(self, datacenters=1, clusters=1, hosts=2, standalone_hosts=0, vms=10, powered_off_ratio=0.0,
+                 instances=2):
+        """
+        :param datacenters: Number of datacenters
+        :param clusters: Number of clusters per datacenter
+        :param hosts: Number of hosts per cluster
+        :param standalone_hosts: Number of hosts outside of clusters per datacenter
+        :param vms: Number of virtual machines per host
+        :param powered_off_ratio: Share of the virtual machines which are powered off
+        :param instances: Number of instances reported by the counters of instance groups
+
+        """
+        self.datacenters = datacenters
+        self.clusters = clusters
+        self.hosts = hosts
+        self.standalone_hosts = standalone_hosts
+        self.vms = vms
+        self.powered_off_ratio = powered_off_ratio
+        self.instances = instances
+
+    def __str__(self):
+        return "{0}dc x {1}cl x {2}h x {3}vm".format(self.datacenters, self.clusters, self.hosts, self.vms)
+
+
+class Simulator(object):
+    """
+
+    Simulated vCenter Server. Latency can be injected per method (by WSDL name, eg: QueryPerf) and for
+    property accessors (under 'accessor'), either as seconds per call or as a (seconds per call, seconds
+    per item) tuple, items being query specs or returned objects.
+
+    """
+    def __init__(self, topology=None, latency=None):
+        self.topology = topology or Topology()
+        self._latency = latency or {}
+        self._lock = threading.RLock()
+        self._changes = threading.Condition(self._lock)
+        self.calls = collections.Counter()
+        self._objects = collections.OrderedDict()
+        self._views = {}
+        self._results = {}
+        self._collectors = {}
+        self._log = []
+        self._next_id = collections.Counter()
+        self._authenticated = True
+        self._boot_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+        # Current time of the performance samples, replaceable to make the sampled values predictable
+        self.clock = time.time
+        # moIds of the entities whose performance queries return no result
+        self.no_data = set()
+        self._counters = self._build_counters()
+        self._metric_id_cache = {}
+        self._service_instance = vim.ServiceInstance('ServiceInstance', self)
+        self._content = vim.ServiceInstanceContent(
+            rootFolder=vim.Folder(ROOT_FOLDER, self),
+            propertyCollector=vmodl.query.PropertyCollector('propertyCollector', self),
+            viewManager=vim.view.ViewManager('ViewManager', self),
+            perfManager=vim.PerformanceManager('PerfMgr', self),
+            sessionManager=vim.SessionManager('SessionManager', self),
+            about=vim.AboutInfo(name='VMware vCenter Server (simulated)', apiVersion='6.7.3', version='6.7.0',
+                                build='14367737', apiType='VirtualCenter', fullName='VMware vCenter Server 6.7.0')
+        )
+        self._build_inventory()
+
+    def service_instance(self):
+        """
+        Returns the service instance of the simulator, as returned by SmartConnectNoSSL.
+        :return: vim.ServiceInstance
+
+        """
+        return self._service_instance
+
+    def _new_id(self, prefix):
+        with self._lock:
+            self._next_id[prefix] += 1
+            return "{0}-{1}".format(prefix, self._next_id[prefix])
+
+    def _add(self, mor, props):
+        self._objects[mor._GetMoId()] = (mor, props)
+        parent = props.get('parent')
+        if isinstance(parent, vim.Folder):
+            self._objects[parent._GetMoId()][1]['childEntity'].append(mor)
+        return mor
+
+    def _build_counters(self):
+        """
+        Builds a performance counter for each metric monitored by the application.
+        :return: dict of {counter name: vim.PerformanceManager.CounterInfo}
+
+        """
+        names = sorted(set(name for type_metrics in vsphere_metrics.metrics.values() for name in type_metrics))
+        counters = collections.OrderedDict()
+        for key, full_name in enumerate(names, 1):
+            group, name, rollup = full_name.split('.')
+            if name in ('usage', 'utilization') and group in ('cpu', 'mem'):
+                units = 'percent'
+            elif rollup == 'summation' or 'Latency' in name or 'latency' in name:
+                units = 'millisecond'
+            else:
+                units = 'kiloBytes'
+            counters[full_name] = vim.PerformanceManager.CounterInfo(
+                key=key, level=1, rollupType=rollup, statsType='delta' if rollup == 'summation' else 'rate',
+                nameInfo=vim.ElementDescription(key=name, label=name, summary=name),
+                groupInfo=vim.ElementDescription(key=group, label=group, summary=group),
+                unitInfo=vim.ElementDescription(key=units, label=units, summary=units)
+            )
+        return counters
+
+    def _build_inventory(self):
+        """
+        Generates the inventory described by the topology.
+        :return: null
+
+        """
+        topology = self.topology
+        root = vim.Folder(ROOT_FOLDER, self)
+        self._objects[ROOT_FOLDER] = (root, {'name': 'Datacenters', 'parent': None, 'childEntity': []})
+        for dc_index in range(topology.datacenters):
+            datacenter = vim.Datacenter(self._new_id('datacenter'), self)
+            host_folder = vim.Folder(self._new_id('group-h'), self)
+            vm_folder = vim.Folder(self._new_id('group-v'), self)
+            self._add(datacenter, {'name': 'Datacenter{0}'.format(dc_index), 'parent': root,
+                                   'hostFolder': host_folder, 'vmFolder': vm_folder})
+            self._add(host_folder, {'name': 'host', 'parent': datacenter, 'childEntity': []})
+            self._add(vm_folder, {'name': 'vm', 'parent': datacenter, 'childEntity': []})
+            for cl_index in range(topology.clusters):
+                cluster = vim.ClusterComputeResource(self._new_id('domain-c'), self)
+                self._add(cluster, {'name': 'Cluster{0}-{1}'.format(dc_index, cl_index), 'parent': host_folder,
+                                    'host': []})
+                for x in range(topology.hosts):
+                    self._add_host(cluster, vm_folder)
+            for x in range(topology.standalone_hosts):
+                compute = vim.ComputeResource(self._new_id('domain-s'), self)
+                self._add(compute, {'name': 'Standalone{0}'.format(x), 'parent': host_folder, 'host': []})
+                self._add_host(compute, vm_folder)
+
+    def _add_host(self, compute, vm_folder):
+        host = vim.HostSystem(self._new_id('host'), self)
+        host_count = self._next_id['host']
+        name = '10.{0}.{1}.{2}'.format(host_count // 65536 % 256, host_count // 256 % 256, host_count % 256)
+        self._add(host, {'name': name, 'parent': compute, 'vm': [], 'runtime.bootTime': self._boot_time})
+        self._objects[compute._GetMoId()][1]['host'].append(host)
+        for x in range(self.topology.vms):
+            self._add_vm(host, vm_folder)
+
+    def _add_vm(self, host, vm_folder):
+        vm = vim.VirtualMachine(self._new_id('vm'), self)
+        ratio = self.topology.powered_off_ratio
+        vm_count = self._next_id['vm']
+        powered_off = ratio > 0 and int(vm_count * ratio) != int((vm_count - 1) * ratio)
+        self._add(vm, {'name': 'vm{0}'.format(vm_count), 'parent': vm_folder, 'runtime.host': host,
+                       'runtime.powerState': 'poweredOff' if powered_off else 'poweredOn',
+                       'config.guestFullName': 'Ubuntu Linux (64-bit)', 'config.changeVersion': '1'})
+        self._objects[host._GetMoId()][1]['vm'].append(vm)
+        return vm
+
+    def ids(self, mor_type):
+        """
+        Returns the moIds of the simulated managed objects of a type.
+        :param mor_type: Managed object type, eg: vim.VirtualMachine
+        :return: list
+
+        """
+        with self._lock:
+            return [mo_id for mo_id, (mor, props) in self._objects.items() if isinstance(mor, mor_type)]
+
+    def _record(self, mo_id, kind, paths=()):
+        self._log.append((mo_id, kind, tuple(paths)))
+        self._changes.notify_all()
+
+    def set_property(self, mo_id, path, value):
+        """
+        Changes a property of a managed object, reported to the property collectors as a modify update.
+        :param mo_id: moId of the managed object
+        :param path: Property path, eg: runtime.powerState
+        :param value: New value
+        :return: null
+
+        """
+        with self._lock:
+            self._objects[mo_id][1][path] = value
+            self._record(mo_id, 'modify', [path])
+
+    def add_vm(self, host_id):
+        """
+        Creates a powered on virtual machine on a host, reported to the property collectors as an enter update.
+        :param host_id: moId of the host
+        :return: moId of the virtual machine
+
+        """
+        with self._lock:
+            host = self._objects[host_id][0]
+            datacenter = host
+            while not isinstance(datacenter, vim.Datacenter):
+                datacenter = self._objects[datacenter._GetMoId()][1]['parent']
+            vm = self._add_vm(host, self._objects[datacenter._GetMoId()][1]['vmFolder'])
+            self._objects[vm._GetMoId()][1]['runtime.powerState'] = 'poweredOn'
+            self._record(vm._GetMoId(), 'enter')
+            return vm._GetMoId()
+
+    def remove_vm(self, vm_id):
+        """
+        Deletes a virtual machine, reported to the property collectors as a leave update.
+        :param vm_id: moId of the virtual machine
+        :return: null
+
+        """
+        with self._lock:
+            vm, props = self._objects.pop(vm_id)
+            self._objects[props['runtime.host']._GetMoId()][1]['vm'].remove(vm)
+            self._objects[props['parent']._GetMoId()][1]['childEntity'].remove(vm)
+            self._record(vm_id, 'leave')
+
+    def expire_sessions(self):
+        """
+        Expires the sessions: all calls fail with NotAuthenticated until the next login.
+        :return: null
+
+        """
+        self._authenticated = False
+
+    def _delay(self, name, items=0):
+        latency = self._latency.get(name)
+        if not latency:
+            return
+        if isinstance(latency, tuple):
+            latency = latency[0] + latency[1] * items
+        time.sleep(latency)
+
+    def InvokeAccessor(self, mo, info):
+        """
+        Returns a property of a simulated managed object. Called by pyVmomi.
+        """
+        self.calls['accessor'] += 1
+        self._delay('accessor')
+        mo_id = mo._GetMoId()
+        if mo_id == 'ServiceInstance' and info.name == 'content':
+            return self._content
+        if mo_id == 'PerfMgr' and info.name == 'perfCounter':
+            return list(self._counters.values())
+        with self._lock:
+            if mo_id not in self._objects:
+                raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+            props = self._objects[mo_id][1]
+            if info.name == 'runtime' and isinstance(mo, vim.VirtualMachine):
+                return vim.vm.RuntimeInfo(host=props['runtime.host'], powerState=props['runtime.powerState'])
+            if info.name == 'runtime' and isinstance(mo, vim.HostSystem):
+                return vim.host.RuntimeInfo(bootTime=props['runtime.bootTime'])
+            if info.name == 'config' and isinstance(mo, vim.VirtualMachine):
+                return vim.vm.ConfigInfo(guestFullName=props['config.guestFullName'],
+                                         changeVersion=props['config.changeVersion'])
+            if info.name in props:
+                value = props[info.name]
+                return list(value) if isinstance(value, list) else value
+        if info.type is not None and issubclass(info.type, list):
+            return []
+        return None
+
+    def InvokeMethod(self, mo, info, args):
+        """
+        Runs a method of a simulated managed object. Called by pyVmomi.
+        """
+        name = info.wsdlName
+        self.calls[name] += 1
+        if not self._authenticated and name not in ('RetrieveServiceContent', 'Login'):
+            raise vim.fault.NotAuthenticated()
+        handler = getattr(self, '_' + name, None)
+        if handler is None:
+            raise vmodl.fault.NotSupported()
+        return handler(mo, *args)
+
+    def _RetrieveServiceContent(self, mo):
+        self._delay('RetrieveServiceContent')
+        return self._content
+
+    def _Login(self, mo, user_name, password, locale):
+        self._delay('Login')
+        self._authenticated = True
+        return vim.UserSession(userName=user_name, key=self._new_id('session'))
+
+    def _Logout(self, mo):
+        pass
+
+    def _CurrentTime(self, mo):
+        self._delay('CurrentTime')
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def _CreateContainerView(self, mo, container, types, recursive):
+        self._delay('CreateContainerView')
+        types = tuple(getattr(vim, mor_type) if isinstance(mor_type, str) else mor_type for mor_type in types)
+        view = vim.view.ContainerView(self._new_id('session[sim]view'), self)
+        with self._lock:
+            self._views[view._GetMoId()] = types
+        return view
+
+    def _DestroyView(self, mo):
+        with self._lock:
+            self._views.pop(mo._GetMoId(), None)
+
+    def _CreatePropertyCollector(self, mo):
+        collector = vmodl.query.PropertyCollector(self._new_id('session[sim]collector'), self)
+        with self._lock:
+            self._collectors[collector._GetMoId()] = {'spec': None, 'pending': collections.deque(),
+                                                      'log_pos': 0, 'version': 0}
+        return collector
+
+    def _DestroyPropertyCollector(self, mo):
+        with self._lock:
+            self._collectors.pop(mo._GetMoId(), None)
+
+    def _CreateFilter(self, mo, spec, partial_updates):
+        with self._lock:
+            self._collectors[mo._GetMoId()]['spec'] = spec
+        return vmodl.query.PropertyCollector.Filter(self._new_id('session[sim]filter'), self)
+
+    def _selected_objects(self, spec):
+        """
+        Returns the objects selected by a filter spec over a container view, with their requested properties.
+        :param spec: vmodl.query.PropertyCollector.FilterSpec
+        :return: list of (Managed Object Reference, list of property paths)
+
+        """
+        types = self._views[spec.objectSet[0].obj._GetMoId()]
+        selected = []
+        for mo_id, (mor, props) in self._objects.items():
+            if mo_id == ROOT_FOLDER or not isinstance(mor, types):
+                continue
+            paths = []
+            for prop_spec in spec.propSet:
+                if isinstance(mor, prop_spec.type):
+                    paths.extend(prop_spec.pathSet or [])
+            selected.append((mor, paths))
+        return selected
+
+    def _object_content(self, mor, paths):
+        props = self._objects[mor._GetMoId()][1]
+        prop_set = [vmodl.DynamicProperty(name=path, val=props[path])
+                    for path in paths if props.get(path) is not None]
+        return vmodl.query.PropertyCollector.ObjectContent(obj=mor, propSet=prop_set)
+
+    def _RetrievePropertiesEx(self, mo, spec_set, options):
+        with self._lock:
+            contents = [self._object_content(mor, paths) for spec in spec_set
+                        for mor, paths in self._selected_objects(spec)]
+        token = self._new_id('token')
+        with self._lock:
+            self._results[token] = (contents, (options and options.maxObjects) or len(contents) or 1)
+        return self._ContinueRetrievePropertiesEx(mo, token)
+
+    def _ContinueRetrievePropertiesEx(self, mo, token):
+        with self._lock:
+            contents, page_size = self._results.pop(token)
+            page, rest = contents[:page_size], contents[page_size:]
+            if rest:
+                self._results[token] = (rest, page_size)
+        self._delay('RetrievePropertiesEx', len(page))
+        return vmodl.query.PropertyCollector.RetrieveResult(objects=page, token=token if rest else None)
+
+    def _object_update(self, spec, mo_id, kind, paths=None):
+        mor = self._objects[mo_id][0]
+        for selected, selected_paths in self._selected_objects(spec):
+            if selected._GetMoId() == mo_id:
+                if paths is None:
+                    paths = selected_paths
+                else:
+                    paths = [path for path in paths if path in selected_paths]
+                break
+        else:
+            return None
+        props = self._objects[mo_id][1]
+        change_set = [vmodl.query.PropertyCollector.Change(name=path, op='assign', val=props.get(path))
+                      for path in paths]
+        return vmodl.query.PropertyCollector.ObjectUpdate(kind=kind, obj=mor, changeSet=change_set)
+
+    def _pending_updates(self, collector):
+        spec = collector['spec']
+        for mo_id, kind, paths in self._log[collector['log_pos']:]:
+            if kind == 'leave':
+                update = vmodl.query.PropertyCollector.ObjectUpdate(
+                    kind='leave', obj=vim.VirtualMachine(mo_id, self))
+            elif mo_id in self._objects:
+                update = self._object_update(spec, mo_id, kind, paths or None)
+            else:
+                update = None
+            if update is not None:
+                collector['pending'].append(update)
+        collector['log_pos'] = len(self._log)
+
+    def _WaitForUpdatesEx(self, mo, version, options):
+        max_wait = options.maxWaitSeconds if options is not None else None
+        page_size = (options and options.maxObjectUpdates) or None
+        deadline = time.time() + max_wait if max_wait is not None else None
+        with self._lock:
+            collector = self._collectors.get(mo._GetMoId())
+            if collector is None:
+                raise vmodl.fault.ManagedObjectNotFound(obj=mo)
+            if not version:
+                collector['pending'].clear()
+                collector['log_pos'] = len(self._log)
+                for mor, paths in self._selected_objects(collector['spec']):
+                    collector['pending'].append(self._object_update(collector['spec'], mor._GetMoId(), 'enter'))
+            while not collector['pending']:
+                self._pending_updates(collector)
+                if collector['pending']:
+                    break
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._changes.wait(remaining)
+            count = min(page_size or len(collector['pending']), len(collector['pending']))
+            updates = [collector['pending'].popleft() for x in range(count)]
+            collector['version'] += 1
+            truncated = bool(collector['pending'])
+        self._delay('WaitForUpdatesEx', len(updates))
+        filter_update = vmodl.query.PropertyCollector.FilterUpdate(objectSet=updates)
+        return vmodl.query.PropertyCollector.UpdateSet(version=str(collector['version']), filterSet=[filter_update],
+                                                       truncated=truncated)
+
+    def _metric_ids(self, mor):
+        """
+        Returns the metric ids available for a managed object, built once per object type since
+        constructing pyVmomi data objects dominates the cost of the simulator.
+        :param mor: Managed Object Reference
+        :return: list of vim.PerformanceManager.MetricId
+
+        """
+        for mor_type, key in ((vim.VirtualMachine, 'vm'), (vim.HostSystem, 'host'),
+                              (vim.ClusterComputeResource, 'cluster'), (vim.Datacenter, 'datacenter')):
+            if isinstance(mor, mor_type):
+                break
+        else:
+            return []
+        metric_ids = self._metric_id_cache.get(key)
+        if metric_ids is None:
+            metric_ids = []
+            for name in vsphere_metrics.metrics.get(key, []):
+                counter = self._counters[name]
+                metric_ids.append(vim.PerformanceManager.MetricId(counterId=counter.key, instance=''))
+                instance_format = INSTANCE_GROUPS.get(counter.groupInfo.key)
+                if instance_format is not None:
+                    for x in range(self.topology.instances):
+                        metric_ids.append(vim.PerformanceManager.MetricId(counterId=counter.key,
+                                                                          instance=instance_format.format(x)))
+            self._metric_id_cache[key] = metric_ids
+        return metric_ids
+
+    def _QueryAvailablePerfMetric(self, mo, entity, begin_time, end_time, interval_id):
+        self._delay('QueryAvailablePerfMetric')
+        with self._lock:
+            if entity._GetMoId() not in self._objects:
+                raise vmodl.fault.ManagedObjectNotFound(obj=entity)
+        return list(self._metric_ids(entity))
+
+    def _sample_times(self, query_spec):
+        """
+        Returns the timestamps of the samples matching a query spec, oldest first.
+        :param query_spec: vim.PerformanceManager.QuerySpec
+        :return: list of datetime
+
+        """
+        interval = query_spec.intervalId or SAMPLE_INTERVAL
+        now = int(self.clock()) // interval * interval
+        end = now
+        if query_spec.endTime is not None:
+            end = min(now, int(query_spec.endTime.timestamp()) // interval * interval)
+        start = end - interval * (query_spec.maxSample or 1)
+        if query_spec.startTime is not None:
+            start = int(query_spec.startTime.timestamp())
+        times = list(range(end, start, -interval))[:query_spec.maxSample or None]
+        return [datetime.datetime.fromtimestamp(ts, datetime.timezone.utc) for ts in reversed(times)]
+
+    def _expand_instances(self, entity, metric_ids):
+        """
+        Replaces the metric ids of all the instances of a counter, instance '*', with the available ones.
+        :param entity: Managed Object Reference queried
+        :param metric_ids: Metric ids of the query spec
+        :return: list of vim.PerformanceManager.MetricId
+
+        """
+        if not any(metric_id.instance == '*' for metric_id in metric_ids):
+            return metric_ids
+        expanded = []
+        for metric_id in metric_ids:
+            if metric_id.instance != '*':
+                expanded.append(metric_id)
+                continue
+            expanded.extend(available for available in self._metric_ids(entity)
+                            if available.counterId == metric_id.counterId)
+        return expanded
+
+    def _QueryPerf(self, mo, query_specs):
+        self._delay('QueryPerf', len(query_specs))
+        results = []
+        for query_spec in query_specs:
+            if query_spec.entity._GetMoId() in self.no_data:
+                continue
+            times = self._sample_times(query_spec)
+            metric_ids = query_spec.metricId
+            if metric_ids is None:
+                metric_ids = self._metric_ids(query_spec.entity)
+            seed = hash(query_spec.entity._GetMoId())
+            values = []
+            for metric_id in self._expand_instances(query_spec.entity, metric_ids):
+                series = [(seed + metric_id.counterId * 31 + zlib.crc32(metric_id.instance.encode('utf-8')) +
+                           int(sample_time.timestamp())) % 10000 for sample_time in times]
+                values.append(vim.PerformanceManager.IntSeries(id=metric_id, value=series))
+            sample_info = [vim.PerformanceManager.SampleInfo(timestamp=sample_time, interval=SAMPLE_INTERVAL)
+                           for sample_time in times]
+            results.append(vim.PerformanceManager.EntityMetric(entity=query_spec.entity, sampleInfo=sample_info,
+                                                               value=values))
+        return results
+
+
+class RecordingIngest(object):
+    """
+
+    Ingest client keeping the count of the datapoints it was sent instead of posting them.
+
+    """
+    def __init__(self):
+        self.datapoints = 0
+
+    def send(self, gauges=None, counters=None):
+        self.datapoints += len(gauges or []) + len(counters or [])
+
+    def stop(self):
+        pass
+
+    def reset_error_counters(self):
+        return {}
+
+
+class SimulatedEnvironment(environment.Environment):
+    """
+
+    Environment collecting from a simulator and sending to RecordingIngest clients.
+
+    """
+    def __init__(self, config, simulator):
+        self.simulator = simulator
+        self.ingests = []
+        environment.Environment.__init__(self, config)
+
+    def _connect(self):
+        return self.simulator.service_instance()
+
+    def _create_signalfx_ingest(self):
+        ingest = RecordingIngest()
+        self.ingests.append(ingest)
+        return ingest
+
+    def sent_datapoints(self):
+        """
+        Returns the number of datapoints sent by the ingest clients.
+        :return: int
+
+        """
+        return sum(ingest.datapoints for ingest in self.ingests)
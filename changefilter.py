@@ -0,0 +1,67 @@
+"""
+Module containing a class for leaving out the datapoints whose value did not change since
+it was last sent, with periodic heartbeats.
+"""
+
+
+class ChangeFilter(object):
+    """
+
+    Last sent value of each series of the inventory objects. A datapoint equal to the last sent value of its
+    series is left out, unless the series was left out for heartbeat - 1 collections in a row, so that every
+    series is still sent at least once every heartbeat collections.
+
+    """
+    def __init__(self, heartbeat):
+        """
+        :param heartbeat: Number of collections of a series after which its value is sent even when unchanged
+
+        """
+        self._heartbeat = heartbeat
+        # Mapping of moId to (inventory object, mapping of (counter key, instance) to (last value, times left out))
+        self._entities = {}
+
+    def __len__(self):
+        return len(self._entities)
+
+    def series(self, inv_obj):
+        """
+        Returns the last sent values of the series of an inventory object. They are forgotten when the
+        inventory object is replaced by a sync, as its dimensions may have changed.
+        :param inv_obj: Inventory Object
+        :return: dict of (counter key, instance) to (last value, times left out)
+
+        """
+        mo_id = inv_obj.mor._GetMoId()
+        entry = self._entities.get(mo_id)
+        if entry is None or entry[0] is not inv_obj:
+            entry = (inv_obj, {})
+            self._entities[mo_id] = entry
+        return entry[1]
+
+    def is_changed(self, last_values, metric_id, value):
+        """
+        Determines whether a datapoint is sent, and records it as the last sent value of its series when it is.
+        :param last_values: Last sent values of the inventory object, returned by series
+        :param metric_id: MetricId of the series
+        :param value: Value of the datapoint
+        :return: Boolean
+
+        """
+        key = (metric_id.counterId, metric_id.instance)
+        last = last_values.get(key)
+        if last is not None and last[0] == value and last[1] < self._heartbeat - 1:
+            last_values[key] = (value, last[1] + 1)
+            return False
+        last_values[key] = (value, 0)
+        return True
+
+    def prune(self, inv_objs):
+        """
+        Forgets the series of the inventory objects which are no longer in the inventory.
+        :param inv_objs: Inventory objects mapped by inventory type
+        :return: null
+
+        """
+        mo_ids = set(inv_obj.mor._GetMoId() for objs in inv_objs.values() for inv_obj in objs)
+        self._entities = dict((mo_id, entry) for mo_id, entry in self._entities.items() if mo_id in mo_ids)
@@ -0,0 +1,117 @@
+"""
+Module containing a class for periodically collecting the metrics of an environment
+on its own thread, so that a slow vCenter does not delay the others.
+"""
+
+import logging
+import threading
+import time
+
+import constants
+import errors
+import scheduler
+
+
+class CollectionWorker(threading.Thread):
+    def __init__(self, env, interval, deadline=None, offset=0, overrun_policy='skip', *args, env_factory=None,
+                 instance_id=None, startup_retry=constants.DEFAULT_STARTUP_RETRY_INTERVAL, **kwargs):
+        """
+        :param env: Environment to collect, None when it is created by env_factory on the thread of the worker
+        :param env_factory: Callable creating the environment, retried until it succeeds, so that environments
+                            start concurrently and each collects as soon as it is ready
+        :param instance_id: Instance id for logging, when env is None
+        :param startup_retry: Time to wait before retrying to create the environment
+
+        """
+        self.env = env
+        self._env_factory = env_factory
+        self._interval = interval
+        self._deadline = deadline if deadline is not None else interval
+        self._offset = offset
+        self._overrun_policy = overrun_policy
+        self._startup_retry = startup_retry
+        self._scheduler = scheduler.TickScheduler(interval, offset, overrun_policy)
+        self._logger = logging.getLogger("{0}-CW".format(env.get_instance_id() if env is not None else instance_id))
+        threading.Thread.__init__(self, *args, **kwargs)
+        self.daemon = True
+        self._stop_signal = threading.Event()
+        self.cycles = 0
+        self.overruns = 0
+        self.last_duration = 0.0
+        # Time it took to create the environment in seconds, None until it is created
+        self.startup_duration = None
+
+    @property
+    def missed_ticks(self):
+        return self._scheduler.missed_ticks
+
+    @property
+    def late_ticks(self):
+        return self._scheduler.late_ticks
+
+    def _collect(self, tick):
+        """
+        Executes reading and sending of metrics for the environment once.
+        :param tick: Tick of the cycle, telling whether lower priority work should be left out to catch up
+                     with the schedule and how far behind it the cycle is
+        :return: null
+
+        """
+        try:
+            self.env.read_metric_values(shed=tick.shed, missed_ticks=tick.missed, late=tick.late)
+            self._logger.info("Sent metrics for env : {0}".format(self.env.get_instance_id()))
+        except Exception:
+            self._logger.exception("Failed to send metrics for env {0}".format(self.env.get_instance_id()))
+
+    def _start_env(self):
+        """
+        Creates the environment, retrying until it succeeds, its settings are found invalid or the worker is stopped.
+        :return: Boolean, whether the environment was created
+
+        """
+        start_time = time.monotonic()
+        while not self._stop_signal.is_set():
+            try:
+                env = self._env_factory()
+            except errors.ConfigError as e:
+                # An invalid configuration does not get any better by retrying
+                self._logger.error("Invalid settings for the environment, not retrying: {0}".format(e))
+                return False
+            except Exception as e:
+                self._logger.error("An error occured while setting up an environment, retrying in {0} seconds: "
+                                   "{1}".format(self._startup_retry, e))
+                self._stop_signal.wait(self._startup_retry)
+                continue
+            self.env = env
+            self.startup_duration = time.monotonic() - start_time
+            self._logger.info("Environment {0} ready in {1:.3f} seconds".format(env.get_instance_id(),
+                                                                                self.startup_duration))
+            return True
+        return False
+
+    def run(self):
+        if self.env is None:
+            if not self._start_env():
+                return
+            # The ticks which passed while the environment was created are not missed
+            self._scheduler = scheduler.TickScheduler(self._interval, self._offset, self._overrun_policy)
+        while not self._stop_signal.is_set():
+            tick = self._scheduler.wait(self._stop_signal)
+            if tick is None:
+                break
+            if tick.late:
+                self._logger.warning("Collection is late by {0:.3f} seconds ({1} missed and {2} late ticks)".format(
+                    time.monotonic() - tick.scheduled, self.missed_ticks, self.late_ticks))
+            start_time = time.monotonic()
+            self._collect(tick)
+            duration = time.monotonic() - start_time
+            self.cycles += 1
+            self.last_duration = duration
+            if duration > self._deadline:
+                self.overruns += 1
+                self._logger.warning("Collection took {0:.3f} seconds, exceeding the deadline of {1} seconds "
+                                     "({2} overruns in {3} cycles)".format(duration, self._deadline,
+                                                                           self.overruns, self.cycles))
+
+    def stop(self):
+        self._stop_signal.set()
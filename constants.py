@@ -8,18 +8,100 @@ DEFAULT_MOR_SYNC_TIMEOUT = 5 * 60  # 5 minutes
 
 DEFAULT_METRIC_SYNC_TIMEOUT = 5 * 60  # 5 minutes
 
+MOR_SYNC_MODES = ('walk', 'collector', 'incremental')
+
+DEFAULT_MOR_SYNC_MODE = 'walk'
+
+DEFAULT_MOR_SYNC_PAGE_SIZE = 1000  # objects per property collector page
+
+DEFAULT_MOR_FULL_SYNC_INTERVAL = 60 * 60  # 1 hour
+
+DEFAULT_MOR_UPDATE_WAIT = 10  # 10 seconds
+
+DEFAULT_AVAILABLE_METRICS_CACHE_TTL = 60 * 60  # 1 hour, 0 disables the cache
+
+DEFAULT_AVAILABLE_METRICS_CACHE_SIZE = 100000  # entries
+
+DEFAULT_WARM_START_MAX_AGE = 24 * 60 * 60  # 1 day, age after which a warm start cache is ignored
+
+DEFAULT_WARM_START_SAVE_INTERVAL = 5 * 60  # 5 minutes, minimum time between saves of the warm start cache
+
+DEFAULT_COUNTER_CATALOG_TTL = 24 * 60 * 60  # 1 day, age after which a shared counter catalog is rebuilt
+
+DEFAULT_SHARD_COUNT = 1  # collector processes splitting the inventory of a vCenter
+
+DEFAULT_SHARD_INDEX = 0  # shard of the inventory collected by this process
+
 DEFAULT_TIMEOUT = 60  # 1 minute
 
+DEFAULT_STARTUP_RETRY_INTERVAL = 60  # 1 minute, between attempts to set up an environment
+
 DEFAULT_COLLECTION_INTERVAL = 20  # 20 seconds
 
+DEFAULT_COLLECTION_OFFSET = 5  # seconds after each interval boundary, when the realtime sample is available
+
+DEFAULT_COLLECTION_OVERRUN_POLICY = 'skip'
+
+SHED_INVENTORY_TYPES = ('datacenter', 'cluster')  # left out by cycles catching up after an overrun
+
 INVENTORY_SYNC_TIMEOUT = 60  # 1 minute
 
 DEFAULT_INGEST_ENDPOINT = 'https://ingest.signalfx.com'
 
 DEFAULT_INGEST_TIMEOUT = 10
 
+DEFAULT_INGEST_BATCH_SIZE = 2000  # datapoints per ingest request
+
+DEFAULT_INGEST_BATCH_BYTES = 1024 * 1024  # approximate encoded bytes per ingest request, 0 means no limit
+
+DEFAULT_INGEST_QUEUE_SIZE = 1000  # payloads
+
+DEFAULT_INGEST_WORKERS = 2
+
+DEFAULT_INGEST_QUEUE_POLICY = 'drop'
+
+DEFAULT_INGEST_RETRIES = 2
+
+DEFAULT_INGEST_RETRY_BACKOFF = 1  # seconds, multiplied by the attempt number
+
+DEFAULT_SPOOL_MAX_BYTES = 256 * 1024 * 1024  # 256 MiB, oldest spooled payloads are dropped beyond it
+
+DEFAULT_SPOOL_MAX_AGE = 60 * 60  # 1 hour, age after which spooled payloads are dropped
+
+DEFAULT_SPOOL_SEGMENT_BYTES = 4 * 1024 * 1024  # 4 MiB, size of each spool file
+
+DEFAULT_SPOOL_REPLAY_RATE = 10  # spooled payloads replayed per second
+
+DEFAULT_CATCH_UP_SAMPLES = False  # query every sample since the previous one instead of the latest only
+
+DEFAULT_CATCH_UP_WINDOW = 10 * 60  # 10 minutes, oldest samples queried when catching up
+
+DEFAULT_QUERY_SESSIONS = 1  # vCenter sessions, and concurrent QueryPerf calls, per vCenter
+
+DEFAULT_SESSION_CHECK_IDLE = 10 * 60  # 10 minutes, idle time after which a session is checked before use
+
+DEFAULT_SESSION_RETRY_BACKOFF = 1  # seconds, doubled after each failed login
+
+DEFAULT_SESSION_MAX_BACKOFF = 5 * 60  # 5 minutes
+
+DEFAULT_QUERY_LATENCY_TARGET = 5  # seconds, QueryPerf latency above which fewer queries run concurrently
+
+DEFAULT_QUERY_LIMIT_DECREASE = 0.5  # factor applied to the concurrent queries when vCenter slows down
+
+DEFAULT_QUERY_BATCH_SIZE = 1  # entities per QueryPerf call
+
+DEFAULT_QUERY_METRIC_BATCH_SIZE = 0  # metricIds per QueryPerf call, 0 means no limit
+
 METRIC_SOURCE = "vsphere"
 
+DEFAULT_SUPPRESS_UNCHANGED = False  # leave out the datapoints equal to the last value sent for their series
+
+DEFAULT_HEARTBEAT_CYCLES = 15  # collections after which an unchanged value is sent again
+
+DEFAULT_SELF_METRICS = True  # report the measurements of the collector itself
+
+SELF_METRICS_PREFIX = 'vsphere.collector.'
+
 LOG_FILE = '/var/log/vsphere.log'
 
 CONFIG_FILE = '/etc/vsphere/config.yaml'
@@ -0,0 +1,113 @@
+"""
+Module containing a compact, column oriented representation of the datapoints
+collected in a collection cycle.
+"""
+
+from array import array
+from itertools import repeat
+
+
+class DatapointBatch(object):
+    """
+
+    Columns of datapoints sharing a timestamp. Each row references the MetricInfo and
+    DimensionSet of the datapoint instead of copying their contents, and the integer values
+    reported by vCenter are kept in a typed array, so they are sent as integers. A float column,
+    flagging the rows it holds, is only added once a row has a value which is not an integer,
+    and a timestamp column once a row has its own timestamp.
+
+    """
+    __slots__ = ('timestamp', 'metrics', 'values', 'dimension_sets', 'timestamps', 'float_values', 'float_rows',
+                 '_normalized')
+
+    def __init__(self, timestamp):
+        """
+        :param timestamp: Timestamp of the datapoints in milliseconds
+
+        """
+        self.timestamp = timestamp
+        self.metrics = []
+        self.values = array('q')
+        self.dimension_sets = []
+        self.timestamps = None
+        self.float_values = None
+        # 1 for the rows whose value is in the float column
+        self.float_rows = None
+        self._normalized = False
+
+    def __len__(self):
+        return len(self.values)
+
+    def _timestamp_column(self):
+        if self.timestamps is None:
+            self.timestamps = array('q', [self.timestamp]) * len(self.values)
+        return self.timestamps
+
+    def _float_columns(self):
+        if self.float_values is None:
+            self.float_values = array('d', [0.0]) * len(self.values)
+            self.float_rows = bytearray(len(self.values))
+        return self.float_values, self.float_rows
+
+    def append(self, metric, value, dimension_set, timestamp=None):
+        """
+        Adds a datapoint with its raw value as returned by the performance query.
+        :param metric: MetricInfo of the datapoint
+        :param value: Raw value of the datapoint
+        :param dimension_set: DimensionSet of the datapoint
+        :param timestamp: Timestamp of the datapoint in milliseconds, None for the timestamp of the batch
+        :return: null
+
+        """
+        if timestamp is not None:
+            self._timestamp_column()
+        if self.timestamps is not None:
+            self.timestamps.append(self.timestamp if timestamp is None else timestamp)
+        if isinstance(value, int):
+            self.values.append(value)
+            if self.float_values is not None:
+                self.float_values.append(0.0)
+                self.float_rows.append(0)
+        else:
+            float_values, float_rows = self._float_columns()
+            self.values.append(0)
+            float_values.append(value)
+            float_rows.append(1)
+        self.metrics.append(metric)
+        self.dimension_sets.append(dimension_set)
+
+    def normalize(self):
+        """
+        Applies the unit transforms to the values of the batch in one pass, once. vCenter reports
+        percentages in hundredths of a percent, their rows are moved to the float column.
+        :return: null
+
+        """
+        if self._normalized:
+            return
+        self._normalized = True
+        values = self.values
+        float_values = float_rows = None
+        for row, metric in enumerate(self.metrics):
+            if metric.units != 'percent':
+                continue
+            if float_values is None:
+                float_values, float_rows = self._float_columns()
+            if float_rows[row]:
+                float_values[row] /= 100.0
+            else:
+                float_values[row] = values[row] / 100.0
+                float_rows[row] = 1
+
+    def rows(self):
+        """
+        Iterates over the datapoints of the batch.
+        :return: generator of (metric info, value, dimension set, timestamp) tuples
+
+        """
+        timestamps = self.timestamps if self.timestamps is not None else repeat(self.timestamp)
+        values = self.values
+        if self.float_values is not None:
+            values = (float_value if is_float else value
+                      for value, float_value, is_float in zip(values, self.float_values, self.float_rows))
+        return zip(self.metrics, values, self.dimension_sets, timestamps)
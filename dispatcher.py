@@ -0,0 +1,279 @@
+"""
+Module containing a class for sending datapoints to SignalFx ingest from background
+sender threads, decoupled from the metric collection, and replaying the payloads which
+were spooled during ingest outages.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+import signalfx.ingest
+
+import errors
+
+
+def _raise_for_status(response, *args, **kwargs):
+    response.raise_for_status()
+
+
+class _StatusCheckingIngest(object):
+    """
+    Fails the posts of a SignalFx ingest client which are answered with an HTTP error status. The client only
+    logs these responses, the raised error is counted by the client and returned by reset_error_counters.
+    """
+
+    def _reconnect(self):
+        super(_StatusCheckingIngest, self)._reconnect()
+        self._session.hooks['response'].append(_raise_for_status)
+
+
+class ProtoBufIngestClient(_StatusCheckingIngest, signalfx.ingest.ProtoBufSignalFxIngestClient):
+    pass
+
+
+class JsonIngestClient(_StatusCheckingIngest, signalfx.ingest.JsonSignalFxIngestClient):
+    pass
+
+
+class IngestDispatcher(object):
+    _STOP = object()
+
+    def __init__(self, ingest_factory, instance_id, dispatcher_conf, send_latency=None, spool=None):
+        """
+        Creates the bounded payload queue and one ingest client per sender thread.
+        :param ingest_factory: Callable returning a new SignalFx ingest client, or None when it cannot be created.
+        :param instance_id: Instance id for logging.
+        :param dispatcher_conf: Queue size, number of sender threads, queue full policy, send retries and
+                                spool replay rate.
+        :param send_latency: Histogram recording the duration of each send attempt, optional.
+        :param spool: Spool keeping the payloads which could not be sent, replayed by a background thread, optional.
+
+        """
+        self._send_latency = send_latency
+        self._spool = spool
+        self._logger = logging.getLogger("{0}-ID".format(instance_id))
+        self._policy = dispatcher_conf['policy']
+        if self._policy not in ('drop', 'block'):
+            raise errors.ConfigError("Unknown ingest queue policy : {0}".format(self._policy))
+        self._retries = dispatcher_conf['retries']
+        self._retry_backoff = dispatcher_conf['retry_backoff']
+        self._queue = queue.Queue(maxsize=dispatcher_conf['queue_size'])
+        self._stop_signal = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            'queued': 0,
+            'sent': 0,
+            'dropped': 0,
+            'retried': 0,
+            'spooled': 0,
+            'replayed': 0,
+        }
+        self._workers = []
+        for index in range(dispatcher_conf['workers']):
+            ingest = ingest_factory()
+            if ingest is None:
+                raise ValueError("Unable to create ingest client")
+            worker = threading.Thread(target=self._send_loop, args=(ingest,),
+                                      name="{0}-ingest-{1}".format(instance_id, index))
+            worker.daemon = True
+            self._workers.append(worker)
+        self._replayer = None
+        if spool is not None:
+            self._replay_rate = dispatcher_conf['replay_rate']
+            ingest = ingest_factory()
+            if ingest is None:
+                raise ValueError("Unable to create ingest client")
+            self._replayer = threading.Thread(target=self._replay_loop, args=(ingest,),
+                                              name="{0}-replay".format(instance_id))
+            self._replayer.daemon = True
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        if self._replayer is not None:
+            self._replayer.start()
+
+    def _count(self, stat, value=1):
+        with self._lock:
+            self._stats[stat] += value
+
+    def get_stats(self):
+        """
+        Returns the number of datapoints queued, sent, dropped, spooled and replayed, and the number of retried
+        sends. Datapoints dropped by the limits of the spool are counted as dropped.
+        :return: dict
+
+        """
+        with self._lock:
+            stats = self._stats.copy()
+        stats['queue_depth'] = self._queue.qsize()
+        if self._spool is not None:
+            stats['dropped'] += self._spool.dropped
+            stats['spool_bytes'] = self._spool.bytes
+            stats['replay_lag'] = self._spool.replay_lag()
+        return stats
+
+    def _spool_item(self, item, dp_count):
+        """
+        Spools a payload item which could not be sent.
+        :param item: dict with the 'gauges' and 'counters' of the payload
+        :param dp_count: Number of datapoints of the item
+        :return: Boolean, False when there is no spool or the item could not be spooled
+
+        """
+        if self._spool is None:
+            return False
+        try:
+            self._spool.append(item)
+        except Exception as e:
+            self._logger.error("Unable to spool {0} datapoints : {1}".format(dp_count, e))
+            return False
+        self._count('spooled', dp_count)
+        return True
+
+    def enqueue(self, item):
+        """
+        Queues a payload item for sending. When the queue is full, the item is dropped or the caller
+        blocks until there is room, depending on the queue policy.
+        :param item: dict with the 'gauges' and 'counters' of the payload
+        :return: Boolean, False when the item was dropped
+
+        """
+        dp_count = len(item['gauges']) + len(item['counters'])
+        if self._policy == 'block':
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if self._spool_item(item, dp_count):
+                    self._logger.warning("Ingest queue is full, spooled {0} datapoints".format(dp_count))
+                    return True
+                self._count('dropped', dp_count)
+                self._logger.warning("Ingest queue is full, dropped {0} datapoints".format(dp_count))
+                return False
+        self._count('queued', dp_count)
+        return True
+
+    def _post(self, ingest, item):
+        """
+        Sends a payload item once and waits until the ingest client has posted it.
+        :param ingest: SignalFx ingest client owned by the calling thread
+        :param item: dict with the 'gauges' and 'counters' of the payload
+        :return: dict of error counts, empty when the item was sent
+
+        """
+        start_time = time.time()
+        try:
+            ingest.send(gauges=item['gauges'], counters=item['counters'])
+            # The client posts from its own thread, stopping it flushes the queued datapoints.
+            ingest.stop()
+            errors = ingest.reset_error_counters()
+        except Exception as e:
+            errors = {e.__class__.__name__: 1}
+        if self._send_latency is not None:
+            self._send_latency.update(time.time() - start_time)
+        return errors
+
+    def _send(self, ingest, item):
+        """
+        Sends a payload item, retrying failed posts. An item which still fails is spooled when there is a spool.
+        :param ingest: SignalFx ingest client owned by the sender thread
+        :param item: dict with the 'gauges' and 'counters' of the payload
+        :return: Boolean, True when the item was sent
+
+        """
+        dp_count = len(item['gauges']) + len(item['counters'])
+        for attempt in range(self._retries + 1):
+            if attempt > 0:
+                self._count('retried')
+                self._stop_signal.wait(self._retry_backoff * attempt)
+            errors = self._post(ingest, item)
+            if not errors:
+                self._count('sent', dp_count)
+                return True
+            self._logger.warning("Exception while sending payload to ingest : {0}".format(dict(errors)))
+        if self._spool_item(item, dp_count):
+            self._logger.warning("Spooled {0} datapoints after {1} retries".format(dp_count, self._retries))
+            return False
+        self._count('dropped', dp_count)
+        self._logger.error("Dropped {0} datapoints after {1} retries".format(dp_count, self._retries))
+        return False
+
+    def _send_loop(self, ingest):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._STOP:
+                    break
+                self._send(ingest, item)
+            finally:
+                self._queue.task_done()
+
+    def _replay_segment(self, ingest, segment, items):
+        """
+        Replays the payload items of a spool segment, at most replay rate items per second. An item which fails
+        is retried after the retry backoff until ingest recovers, or until the segment is older than the age
+        limit of the spool so that an item which cannot be sent does not hold back the newer segments.
+        :param ingest: SignalFx ingest client owned by the replay thread
+        :param segment: Segment returned by the spool
+        :param items: Payload items of the segment
+        :return: Number of datapoints which were not replayed, None when the dispatcher is stopped
+
+        """
+        backoff = max(self._retry_backoff, 1)
+        for index, item in enumerate(items):
+            if index > 0 and self._stop_signal.wait(1.0 / self._replay_rate):
+                return None
+            while self._post(ingest, item):
+                if self._spool.expired(segment):
+                    return sum(len(item['gauges']) + len(item['counters']) for item in items[index:])
+                if self._stop_signal.wait(backoff):
+                    return None
+            self._count('replayed', len(item['gauges']) + len(item['counters']))
+        return 0
+
+    def _replay_loop(self, ingest):
+        """
+        Replays the spooled payload items, oldest segment first.
+        :param ingest: SignalFx ingest client owned by the replay thread
+        :return: null
+
+        """
+        backoff = max(self._retry_backoff, 1)
+        while not self._stop_signal.is_set():
+            oldest = self._spool.oldest()
+            if oldest is None:
+                self._stop_signal.wait(backoff)
+                continue
+            segment, items = oldest
+            dropped = self._replay_segment(ingest, segment, items)
+            if dropped is None:
+                return
+            self._spool.remove(segment, dropped)
+            if dropped:
+                self._logger.warning("Dropped {0} unsent datapoints of expired spool segment {1}".format(
+                    dropped, segment.path))
+            else:
+                self._logger.info("Replayed spool segment {0}".format(segment.path))
+
+    def stop(self, timeout=None):
+        """
+        Sends the queued payload items and stops the sender threads.
+        :param timeout: Maximum time to wait for each sender thread
+        :return: null
+
+        """
+        self._stop_signal.set()
+        for worker in self._workers:
+            if worker.is_alive():
+                self._queue.put(self._STOP)
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.join(timeout=timeout)
+        if self._replayer is not None and self._replayer.is_alive():
+            self._replayer.join(timeout=timeout)
+        if self._spool is not None:
+            self._spool.close()
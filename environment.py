@@ -1,14 +1,29 @@
 #!/usr/bin/env python
 
+import changefilter
+import collections
+import datetime
 import logging
-import signalfx
+import os
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pyVim.connect import SmartConnectNoSSL
-from pyVmomi import vim
 
 import constants
+import datapoints
+import dispatcher
+import instrumentation
 import inventory
+import limiter
 import metric_metadata
+import payload
+import queryplan
+import scheduler
+import session
+import spool
+import warmstart
 
 
 class Environment(object):
@@ -19,6 +34,7 @@ class Environment(object):
         :param config: Configuration for the environment.
 
         """
+        start_time = time.time()
         self._host = config['host']
         self._username = config['username']
         self._password = config['password']
@@ -26,29 +42,138 @@ class Environment(object):
         self._ingest_token = config['IngestToken']
         self._ingest_endpoint = config['IngestEndpoint']
         self._ingest_timeout = config['IngestTimeout']
+        self._ingest_batch_size = config.get('IngestBatchSize', constants.DEFAULT_INGEST_BATCH_SIZE)
+        self._ingest_batch_bytes = config.get('IngestBatchBytes', constants.DEFAULT_INGEST_BATCH_BYTES)
         self._logger = logging.getLogger(self.get_instance_id())
-        self._si = None
-        self._connect()
-        if self._si is None:
-            raise ValueError("Unable to connect to host")
-        self._ingest = self._create_signalfx_ingest()
-        if self._ingest is None:
-            raise ValueError("Unable to create ingest client")
-        self._additional_dims = config.get('dimensions', None)
+        # The settings are parsed and validated before connecting, so that an invalid configuration
+        # opens no vCenter session
+        self._session_check_idle = config.get('SessionCheckIdle', constants.DEFAULT_SESSION_CHECK_IDLE)
         if 'MORSyncInterval' not in config:
             config['MORSyncInterval'] = constants.DEFAULT_MOR_SYNC_INTERVAL
-        self._mor_sync_timeout = config.get('MORSyncTimeout', constants.DEFAULT_MOR_SYNC_TIMEOUT)
-        self._metric_sync_timeout = config.get('MetricSyncTimeout', constants.DEFAULT_METRIC_SYNC_TIMEOUT)
-        self._inventory_mgr = inventory.InventoryManager(self._si, config['MORSyncInterval'],
-                                                         config['Name'], self.get_instance_id())
-        self._inventory_mgr.start()
         if 'MetricSyncInterval' not in config:
             config['MetricSyncInterval'] = constants.DEFAULT_METRIC_SYNC_INTERVAL
+        self._mor_sync_timeout = config.get('MORSyncTimeout', constants.DEFAULT_MOR_SYNC_TIMEOUT)
+        self._metric_sync_timeout = config.get('MetricSyncTimeout', constants.DEFAULT_METRIC_SYNC_TIMEOUT)
+        self._query_batch_size = config.get('QueryBatchSize', constants.DEFAULT_QUERY_BATCH_SIZE)
+        self._query_metric_batch_size = config.get('QueryMetricBatchSize', constants.DEFAULT_QUERY_METRIC_BATCH_SIZE)
+        self._catch_up = config.get('CatchUpSamples', constants.DEFAULT_CATCH_UP_SAMPLES)
+        self._catch_up_window = datetime.timedelta(seconds=config.get('CatchUpWindow',
+                                                                      constants.DEFAULT_CATCH_UP_WINDOW))
+        # Timestamp of the last sample collected for each inventory object, by moId
+        self._watermarks = {}
+        self._query_planner = queryplan.QueryPlanner(
+            self._query_metric_batch_size, latest_sample=not self._catch_up,
+            instance_policies=queryplan.parse_instance_policies(config.get('InstancePolicies')))
+        self._change_filter = None
+        if config.get('SuppressUnchanged', constants.DEFAULT_SUPPRESS_UNCHANGED):
+            self._change_filter = changefilter.ChangeFilter(
+                config.get('HeartbeatCycles', constants.DEFAULT_HEARTBEAT_CYCLES))
+        self._cadence = scheduler.TypeCadence(self._get_collection_intervals(config))
+        inventory_conf = self._get_inventory_config(config)
+        inventory.check_inventory_config(inventory_conf)
         self._metric_conf = self._get_metric_config(config)
-        self._metric_mgr = metric_metadata.MetricManager(self._si, config['MetricSyncInterval'],
-                                                         self._metric_conf, config['Name'], self.get_instance_id())
-        self._metric_mgr.start()
-        self._wait_for_sync()
+        self._self_metrics = None
+        send_latency = None
+        if config.get('SelfMetrics', constants.DEFAULT_SELF_METRICS):
+            self_dims = {'vc_name': self._vc_name, 'metric_source': constants.METRIC_SOURCE}
+            if config.get('ShardCount', constants.DEFAULT_SHARD_COUNT) > 1:
+                self_dims['shard'] = str(config.get('ShardIndex', constants.DEFAULT_SHARD_INDEX))
+            self._self_metrics = instrumentation.SelfMetrics(self_dims)
+            send_latency = self._self_metrics.histogram('ingest.latency')
+        # Totals at the previous self metrics report
+        self._reported_stats = {}
+        # Created but not started, it validates the ingest settings
+        self._dispatcher = dispatcher.IngestDispatcher(self._create_signalfx_ingest, self.get_instance_id(),
+                                                       self._get_dispatcher_config(config), send_latency,
+                                                       self._create_spool(config))
+        self._session_pool = session.SessionPool(
+            self._connect, self._login, config.get('QuerySessions', constants.DEFAULT_QUERY_SESSIONS),
+            self.get_instance_id(), constants.DEFAULT_SESSION_RETRY_BACKOFF, constants.DEFAULT_SESSION_MAX_BACKOFF)
+        try:
+            self._session_pool.start()
+        except Exception as e:
+            self._logger.error("Unable to connect to host {0} : {1}".format(self._host, e))
+        self._si = self._session_pool.primary
+        if self._si is None:
+            self._session_pool.close()
+            self._dispatcher.stop()
+            raise ConnectionError("Unable to connect to host")
+        self._query_executor = None
+        self._inventory_mgr = None
+        self._metric_mgr = None
+        self._warm_start = None
+        # Everything set up from here on is released when the setup fails
+        try:
+            self._query_limiter = limiter.AdaptiveLimiter(
+                len(self._session_pool), config.get('QueryLatencyTarget', constants.DEFAULT_QUERY_LATENCY_TARGET),
+                decrease=config.get('QueryLimitDecrease', constants.DEFAULT_QUERY_LIMIT_DECREASE))
+            if len(self._session_pool) > 1:
+                self._query_executor = ThreadPoolExecutor(max_workers=len(self._session_pool))
+            self._dispatcher.start()
+            self._inventory_mgr = inventory.InventoryManager(self._si, config['MORSyncInterval'],
+                                                             config['Name'], self.get_instance_id(),
+                                                             inventory_conf=inventory_conf)
+            self._metric_mgr = metric_metadata.MetricManager(self._si, config['MetricSyncInterval'],
+                                                             self._metric_conf, config['Name'], self.get_instance_id())
+            if config.get('WarmStartCacheDir'):
+                self._start_warm(config)
+            self._inventory_mgr.start()
+            self._metric_mgr.start()
+            self._wait_for_sync()
+        except BaseException:
+            self.stop_managers()
+            raise
+        # Time it took to connect and sync, or restore, the inventory and metric metadata, in seconds
+        self.startup_duration = time.time() - start_time
+        if self._self_metrics is not None:
+            self._self_metrics.set_gauge('startup.duration', self.startup_duration)
+
+    def _start_warm(self, config):
+        """
+        Restores the inventory and metric metadata saved by a previous run, so that collection starts before
+        the first syncs complete, and saves them again after the syncs.
+        :param config: Configuration for the environment
+        :return: null
+
+        """
+        name = config['Name']
+        shard_count = config.get('ShardCount', constants.DEFAULT_SHARD_COUNT)
+        if shard_count > 1:
+            # A shard holds other objects once the number of shards changes
+            name = "{0}-{1}of{2}".format(name, config.get('ShardIndex', constants.DEFAULT_SHARD_INDEX), shard_count)
+        self._warm_start = warmstart.WarmStartCache(config['WarmStartCacheDir'], name, self.get_instance_id(),
+                                                    constants.DEFAULT_WARM_START_MAX_AGE)
+        self._warm_start_lock = threading.Lock()
+        self._warm_start_saved = 0
+        state = self._warm_start.load()
+        if state is not None:
+            try:
+                self._inventory_mgr.restore(state['inventory'])
+                self._metric_mgr.restore(state['metrics'])
+                self._logger.info("Restored inventory and metric metadata from {0}".format(self._warm_start.path))
+            except Exception as e:
+                self._logger.warning("Unable to restore warm start cache {0} : {1}".format(self._warm_start.path, e))
+        self._inventory_mgr.on_sync = self._save_warm_start
+        self._metric_mgr.on_sync = self._save_warm_start
+
+    def _save_warm_start(self, force=False):
+        """
+        Saves the inventory and metric metadata for the next run, at most once per save interval unless forced.
+        :param force: Whether to save even when the last save is recent
+        :return: null
+
+        """
+        with self._warm_start_lock:
+            if not force and time.time() < self._warm_start_saved + constants.DEFAULT_WARM_START_SAVE_INTERVAL:
+                return
+            if not (self._inventory_mgr.block_until_inventory(0) and self._metric_mgr.block_until_has_metrics(0)):
+                return
+            try:
+                self._warm_start.save({'inventory': self._inventory_mgr.snapshot(),
+                                       'metrics': self._metric_mgr.snapshot()})
+                self._warm_start_saved = time.time()
+            except Exception as e:
+                self._logger.warning("Unable to save warm start cache {0} : {1}".format(self._warm_start.path, e))
 
     def _wait_for_sync(self):
         """
@@ -65,15 +190,20 @@ class Environment(object):
 
     def _connect(self):
         """
-        Connect to the vCenter.
+        Connects to the vCenter with a new session.
+        :return: vim.ServiceInstance
+
+        """
+        return SmartConnectNoSSL(host=self._host, user=self._username, pwd=self._password)
+
+    def _login(self, si):
+        """
+        Logs an expired session back in on its existing connection, so that its ServiceInstance stays valid.
+        :param si: vim.ServiceInstance of the session
         :return: null
 
         """
-        try:
-            self._si = SmartConnectNoSSL(host=self._host, user=self._username, pwd=self._password)
-        except Exception as e:
-            self._logger.error("Unable to connect to host {0} : {1}".format(self._host, e))
-            self._si = None
+        si.RetrieveServiceContent().sessionManager.Login(userName=self._username, password=self._password)
 
     def get_instance_id(self):
         """
@@ -83,6 +213,59 @@ class Environment(object):
         """
         return "{0}-{1}".format(self._vc_name, self._host)
 
+    def _get_inventory_config(self, config):
+        """
+        Gets the inventory sync preferences from Configuration.
+        :param config:
+        :return: dict
+
+        """
+        inventory_config = dict()
+        inventory_config['dimensions'] = config.get('dimensions', None)
+        inventory_config['sync_mode'] = config.get('MORSyncMode', constants.DEFAULT_MOR_SYNC_MODE)
+        inventory_config['page_size'] = config.get('MORSyncPageSize', constants.DEFAULT_MOR_SYNC_PAGE_SIZE)
+        inventory_config['full_sync_interval'] = config.get('MORFullSyncInterval',
+                                                            constants.DEFAULT_MOR_FULL_SYNC_INTERVAL)
+        inventory_config['metric_cache_ttl'] = config.get('AvailableMetricsCacheTTL',
+                                                          constants.DEFAULT_AVAILABLE_METRICS_CACHE_TTL)
+        inventory_config['metric_cache_size'] = config.get('AvailableMetricsCacheSize',
+                                                           constants.DEFAULT_AVAILABLE_METRICS_CACHE_SIZE)
+        inventory_config['shard_count'] = config.get('ShardCount', constants.DEFAULT_SHARD_COUNT)
+        inventory_config['shard_index'] = config.get('ShardIndex', constants.DEFAULT_SHARD_INDEX)
+        return inventory_config
+
+    def _get_collection_intervals(self, config):
+        """
+        Gets the collection interval of each inventory type, by default the interval of its samples.
+        :param config:
+        :return: dict
+
+        """
+        intervals = {
+            'datacenter': inventory.Datacenter.INSTANT_INTERVAL,
+            'cluster': inventory.Cluster.INSTANT_INTERVAL,
+            'host': inventory.Host.INSTANT_INTERVAL,
+            'vm': inventory.VirtualMachine.INSTANT_INTERVAL,
+        }
+        intervals.update(config.get('CollectionIntervals') or {})
+        return intervals
+
+    def _get_dispatcher_config(self, config):
+        """
+        Gets the ingest send pipeline preferences from Configuration.
+        :param config:
+        :return: dict
+
+        """
+        dispatcher_config = dict()
+        dispatcher_config['queue_size'] = config.get('IngestQueueSize', constants.DEFAULT_INGEST_QUEUE_SIZE)
+        dispatcher_config['workers'] = config.get('IngestWorkers', constants.DEFAULT_INGEST_WORKERS)
+        dispatcher_config['policy'] = config.get('IngestQueuePolicy', constants.DEFAULT_INGEST_QUEUE_POLICY)
+        dispatcher_config['retries'] = config.get('IngestRetries', constants.DEFAULT_INGEST_RETRIES)
+        dispatcher_config['retry_backoff'] = constants.DEFAULT_INGEST_RETRY_BACKOFF
+        dispatcher_config['replay_rate'] = config.get('SpoolReplayRate', constants.DEFAULT_SPOOL_REPLAY_RATE)
+        return dispatcher_config
+
     def _get_metric_config(self, config):
         """
         Gets the required metric preferences from Configuration.
@@ -95,6 +278,20 @@ class Environment(object):
         metric_config['exclude_metrics'] = config.get('exclude_metrics', {})
         return metric_config
 
+    def _create_spool(self, config):
+        """
+        Creates the spool of the payloads which could not be sent, in a directory of its own per vCenter.
+        :param config: Configuration for the environment
+        :return: spool.Spool, None when spooling is disabled
+
+        """
+        if not config.get('SpoolDir'):
+            return None
+        directory = os.path.join(config['SpoolDir'], re.sub(r'[^\w.-]', '_', self.get_instance_id()))
+        return spool.Spool(directory, config.get('SpoolMaxBytes', constants.DEFAULT_SPOOL_MAX_BYTES),
+                           config.get('SpoolMaxAge', constants.DEFAULT_SPOOL_MAX_AGE),
+                           constants.DEFAULT_SPOOL_SEGMENT_BYTES, self.get_instance_id())
+
     def _create_signalfx_ingest(self):
         """
         Creates and returns the SignalFX ingest client.
@@ -103,165 +300,338 @@ class Environment(object):
         """
         ingest = None
         try:
-            client = signalfx.SignalFx()
-            ingest = client.ingest(self._ingest_token, endpoint=self._ingest_endpoint,
-                                   timeout=self._ingest_timeout)
+            try:
+                ingest = dispatcher.ProtoBufIngestClient(
+                    self._ingest_token, endpoint=self._ingest_endpoint,
+                    timeout=self._ingest_timeout, batch_size=self._ingest_batch_size)
+            except AssertionError:
+                # Protocol Buffers are not installed, fall back to JSON.
+                ingest = dispatcher.JsonIngestClient(
+                    self._ingest_token, endpoint=self._ingest_endpoint,
+                    timeout=self._ingest_timeout, batch_size=self._ingest_batch_size)
         except Exception as e:
             self._logger.error("An error occured when creating the ingest client: {0}".format(e))
 
         return ingest
 
-    def _get_dimensions(self, inv_obj, metric_value):
-        """
-        Returns the dimensions of inventory object.
-        :param inv_obj: Inventory Object. eg: host, vm etc
-        :param metric_value: Value of inventory object metric.
-        :return: dict
-
+    def _parse_query(self, inv_obj, entity_metric, monitored_metrics, batch):
         """
-        dimensions = {}
-        if self._additional_dims is not None:
-            dimensions.update(self._additional_dims)
-        dimensions.update(inv_obj.sf_metadata_dims)
-        if metric_value.id.instance != '':
-            instance = str(metric_value.id.instance).replace(':', '_'). \
-                replace('.', '_')
-            dimensions['instance'] = instance
-        return dimensions
-
-    def _parse_query(self, inv_obj, query_results, monitored_metrics):
-        """
-        Parses the query results, builds and returns datapoints.
+        Parses the query result of an inventory object and appends its datapoints to the batch, leaving out
+        the unchanged values when the change filter is on.
         :param inv_obj: Inventory Object
-        :param query_results: Query results from QueryPerf().
+        :param entity_metric: Query result(EntityMetric) of the inventory object from QueryPerf().
         :param monitored_metrics: Metrics which will be monitored by the application for inventory object.
-        :return: list
+        :param batch: DatapointBatch of the query
+        :return: int, number of datapoints left out by the change filter
 
         """
-        datapoints = []
-        timestamp = int(time.time()) * 1000
+        suppressed = 0
+        change_filter = self._change_filter
+        last_values = change_filter.series(inv_obj) if change_filter is not None else None
         try:
-            result = query_results[0]
-            for metric in result.value:
-                key = metric.id.counterId
-                metric_name = monitored_metrics[key].name
-                metric_type = monitored_metrics[key].metric_type
-                dimensions = self._get_dimensions(inv_obj, metric)
-                value = metric.value[0]
-                if monitored_metrics[key].units == 'percent':
-                    value /= 100.0
-                dp = self.Datapoint(metric_name, metric_type, value, dimensions, timestamp)
-                datapoints.append(dp)
+            series = self._query_planner.select_top_instances(entity_metric.value, monitored_metrics)
+            if self._catch_up:
+                # No sample was added since the last collected one
+                if not entity_metric.sampleInfo:
+                    return suppressed
+                timestamps = [int(sample.timestamp.timestamp()) * 1000 for sample in entity_metric.sampleInfo]
+                for metric in series:
+                    dimension_set = inv_obj.get_dimension_set(metric.id.instance)
+                    metric_info = monitored_metrics[metric.id.counterId]
+                    for timestamp, value in zip(timestamps, metric.value):
+                        if last_values is not None and not change_filter.is_changed(last_values, metric.id, value):
+                            suppressed += 1
+                            continue
+                        batch.append(metric_info, value, dimension_set, timestamp)
+                return suppressed
+            for metric in series:
+                if last_values is not None and not change_filter.is_changed(last_values, metric.id, metric.value[0]):
+                    suppressed += 1
+                    continue
+                dimension_set = inv_obj.get_dimension_set(metric.id.instance)
+                batch.append(monitored_metrics[metric.id.counterId], metric.value[0], dimension_set)
         except Exception as e:
-            self._logger.error("Error while parsing query results: {0} : {1}".format(query_results, e))
-
-        return datapoints
+            self._logger.error("Error while parsing query results: {0} : {1}".format(entity_metric, e))
+        return suppressed
 
-    def _build_payload(self, dps):
+    def _build_payload(self, batch, payload_builder):
         """
-        Builds a ingest client payload from the datapoints.
-        :param dps: datapoints
-        :return: dict
+        Adds the datapoints to the ingest payload of the collection cycle.
+        :param batch: DatapointBatch
+        :param payload_builder: PayloadBuilder aggregating the datapoints of the collection cycle
+        :return: null
 
         """
-        dp_count = len(dps)
-        payload = []
-        start = 0
-        delta = 100
-        end = delta if dp_count > delta else dp_count
         try:
-            for x in range(0, int(dp_count / delta) + 1):
-                gauges = []
-                counters = []
-                for dp in dps[start: end]:
-                    dp.dimensions['metric_source'] = constants.METRIC_SOURCE
-                    payload_obj = {
-                        'metric': dp.metric_name,
-                        'value': dp.value,
-                        'dimensions': dp.dimensions,
-                        'timestamp': dp.timestamp
-                    }
-                    if dp.metric_type == 'gauge':
-                        gauges.append(payload_obj)
-                    elif dp.metric_type == 'counter':
-                        counters.append(payload_obj)
-                payload.append({
-                    'gauges': gauges,
-                    'counters': counters
-                })
-                start = end
-                end = end + delta
-                if end > dp_count:
-                    end = dp_count
+            payload_builder.add_batch(batch)
         except Exception as e:
             self._logger.error("Exception while building payload : {0}".format(e))
 
-        return payload
-
     def _dispatch_metrics(self, payload):
         """
-        Dispatches metrics to signalfx client.
+        Queues metrics for the background sender threads of the ingest dispatcher.
         :param payload: Ingest client payload(contains the datapoints)
         :return: null
 
         """
         for item in payload:
-            try:
-                self._ingest.send(gauges=item['gauges'], counters=item['counters'])
-            except Exception as e:
-                self._logger.error("Exception while sending payload to ingest : {0}".format(e))
+            self._dispatcher.enqueue(item)
 
-    def read_metric_values(self):
+    def _set_sample_range(self, query_spec, inv_obj, oldest):
+        """
+        Sets the samples of an inventory object to collect when catching up: all the samples since the last
+        collected one, the latest one when none was collected yet.
+        :param query_spec: Query spec of the inventory object
+        :param inv_obj: Inventory Object
+        :param oldest: Oldest sample time to query
+        :return: null
+
+        """
+        watermark = self._watermarks.get(inv_obj.mor._GetMoId())
+        if watermark is None:
+            query_spec.maxSample = 1
+            query_spec.startTime = None
+        else:
+            query_spec.maxSample = None
+            query_spec.startTime = max(watermark, oldest)
+
+    def _build_query_specs(self, inv_objs, monitored_metrics):
+        """
+        Returns the performance query specs for all inventory objects, from the query plans compiled when the
+        inventory or the metric metadata last changed. The metric ids of an inventory object are split across
+        several query specs when they exceed the metric batch size.
+        :param inv_objs: Inventory objects mapped by inventory type.
+        :param monitored_metrics: Metrics which will be monitored by the application for each inventory type.
+        :return: list of (inventory object, monitored metrics, query spec) tuples
+
+        """
+        query_specs = []
+        for mor in inv_objs.keys():
+            query_specs.extend(self._query_planner.plan(mor, inv_objs[mor], monitored_metrics[mor]))
+        if self._catch_up:
+            oldest = datetime.datetime.now(datetime.timezone.utc) - self._catch_up_window
+            for inv_obj, metrics, query_spec in query_specs:
+                self._set_sample_range(query_spec, inv_obj, oldest)
+        return query_specs
+
+    def _batch_query_specs(self, query_specs):
+        """
+        Groups the query specs into batches bounded by the number of entities and metric ids per QueryPerf call.
+        :param query_specs: list of (inventory object, monitored metrics, query spec) tuples
+        :return: generator of lists of query spec tuples
+
+        """
+        batch = []
+        metric_count = 0
+        for item in query_specs:
+            spec_metric_count = len(item[2].metricId)
+            if batch and (len(batch) >= self._query_batch_size or
+                          (self._query_metric_batch_size and
+                           metric_count + spec_metric_count > self._query_metric_batch_size)):
+                yield batch
+                batch = []
+                metric_count = 0
+            batch.append(item)
+            metric_count += spec_metric_count
+        if batch:
+            yield batch
+
+    def _query_perf(self, query_session, query_specs):
+        """
+        Makes a performance query with a session of the session pool.
+        :param query_session: session.Session
+        :param query_specs: list of vim.PerformanceManager.QuerySpec
+        :return: list of vim.PerformanceManager.EntityMetric
+
+        """
+        return query_session.content.perfManager.QueryPerf(querySpec=query_specs)
+
+    def _query_batch(self, batch):
+        """
+        Makes a single performance query for a batch of query specs and parses the datapoints
+        of each returned entity metric.
+        :param batch: list of (inventory object, monitored metrics, query spec) tuples
+        :return: DatapointBatch
+
+        """
+        targets = {}
+        for inv_obj, metrics, query_spec in batch:
+            targets[inv_obj.mor._GetMoId()] = (inv_obj, metrics)
+        dps = datapoints.DatapointBatch(int(time.time()) * 1000)
+        start_time = time.time()
+        try:
+            results = self._session_pool.run(self._query_perf, [item[2] for item in batch])
+        except Exception as e:
+            self._logger.error("Exception while making performance query : {0}".format(e))
+            self._query_limiter.record(time.time() - start_time, failed=True)
+            if self._self_metrics is not None:
+                self._self_metrics.increment('queryperf.errors')
+            return dps
+        latency = time.time() - start_time
+        self._query_limiter.record(latency)
+        if self._self_metrics is not None:
+            self._self_metrics.histogram('queryperf.latency').update(latency)
+        if not results:
+            self._logger.warning("Empty result from query for entities : {0}".format(
+                [item[2].entity for item in batch]))
+            return dps
+        for entity_metric in results:
+            mo_id = entity_metric.entity._GetMoId()
+            target = targets.get(mo_id)
+            if target is None:
+                self._logger.warning("Unexpected entity in query result : {0}".format(entity_metric.entity))
+                continue
+            if self._catch_up and entity_metric.sampleInfo:
+                self._watermarks[mo_id] = entity_metric.sampleInfo[-1].timestamp
+            dp_count = len(dps)
+            suppressed = self._parse_query(target[0], entity_metric, target[1], dps)
+            if self._self_metrics is not None:
+                object_type = target[0].sf_metadata_dims.get('object_type')
+                self._self_metrics.increment('entities.queried', object_type=object_type)
+                self._self_metrics.increment('datapoints.produced', len(dps) - dp_count, object_type)
+                if suppressed:
+                    self._self_metrics.increment('datapoints.suppressed', suppressed, object_type)
+        dps.normalize()
+        return dps
+
+    def _query_batches(self, batches):
+        """
+        Queries the batches of query specs, in parallel across the sessions of the session pool when there
+        are several. The number of queries in flight is bounded by the adaptive limit, and at most two
+        batches per session are queried ahead of the caller.
+        :param batches: generator of lists of query spec tuples
+        :return: generator of DatapointBatch, in the order of the batches
+
+        """
+        if self._query_executor is None:
+            for batch in batches:
+                yield self._query_batch(batch)
+            return
+        pending = collections.deque()
+        max_pending = 2 * len(self._session_pool)
+        for batch in batches:
+            while pending and (len(pending) >= max_pending or
+                               sum(1 for future in pending if not future.done()) >= self._query_limiter.limit):
+                yield pending.popleft().result()
+            pending.append(self._query_executor.submit(self._query_batch, batch))
+        while pending:
+            yield pending.popleft().result()
+
+    def read_metric_values(self, shed=False, missed_ticks=0, late=False):
         """
         Collects the required metrics for all inventory objects from vCenter and dispatches them to Ingest client.
+        :param shed: Whether to leave out the lower priority inventory types to catch up after an overrun
+        :param missed_ticks: Number of scheduled cycles missed since the previous one, reported as a self metric
+        :param late: Whether the cycle runs after its scheduled time, reported as a self metric
         :return: null
 
         """
+        start_time = time.time()
         inv_objs = self._inventory_mgr.current_inventory()
+        inv_obj_count = sum(len(objs) for objs in inv_objs.values())
+        if len(self._watermarks) > inv_obj_count:
+            self._prune_watermarks(inv_objs)
+        if len(self._query_planner) > inv_obj_count:
+            self._query_planner.prune(inv_objs)
+        if self._change_filter is not None and len(self._change_filter) > inv_obj_count:
+            self._change_filter.prune(inv_objs)
+        due_types = self._cadence.due(inv_objs.keys(), start_time)
+        if self._self_metrics is not None:
+            self._self_metrics.increment('ticks.missed', missed_ticks)
+            self._self_metrics.increment('ticks.late', 1 if late else 0)
+        if shed:
+            due_types = [mor for mor in due_types if mor not in constants.SHED_INVENTORY_TYPES]
+            if self._self_metrics is not None:
+                self._self_metrics.increment('cycles.shed')
+        self._cadence.collected(due_types, start_time)
+        inv_objs = dict((mor, inv_objs[mor]) for mor in due_types)
         monitored_metrics = self._metric_mgr.get_monitored_metrics()
-        perf_manager = self._si.RetrieveServiceContent().perfManager
-        for mor in inv_objs.keys():
-            for inv_obj in inv_objs[mor]:
-                inv_obj_metrics = inv_obj.metric_id_map
-                desired_keys = list(set(inv_obj_metrics.keys()) & set(monitored_metrics[mor].keys()))
-                if not len(desired_keys) == 0:
-                    metric_id_objs = [inv_obj_metrics[key] for key in desired_keys]
-                    query_spec = vim.PerformanceManager.QuerySpec(
-                        entity=inv_obj.mor, metricId=metric_id_objs,
-                        intervalId=inv_obj.INSTANT_INTERVAL,
-                        maxSample=1, format='normal'
-                    )
-                    try:
-                        results = perf_manager.QueryPerf(querySpec=[query_spec])
-                    except Exception as e:
-                        self._logger.error("Exception while making performance query : {0}".format(e))
-                    if results:
-                        dps = self._parse_query(inv_obj, results, monitored_metrics[mor])
-                        payload = self._build_payload(dps)
-                        self._dispatch_metrics(payload)
-                    else:
-                        self._logger.warning("Empty result from query : {0}".format(query_spec))
-
-    def stop_managers(self):
+        self._session_pool.check(self._session_check_idle)
+        query_specs = self._build_query_specs(inv_objs, monitored_metrics)
+        payload_builder = payload.PayloadBuilder(self._ingest_batch_size, self._ingest_batch_bytes,
+                                                 self._dispatch_metrics)
+        for dps in self._query_batches(self._batch_query_specs(query_specs)):
+            self._build_payload(dps, payload_builder)
+        if self._self_metrics is not None:
+            self._self_metrics.set_gauge('cycle.duration', time.time() - start_time)
+            self._report_self_metrics(payload_builder)
+        payload_builder.flush()
+
+    def _prune_watermarks(self, inv_objs):
         """
-        Stops inventory manager and metric manager threads.
+        Forgets the last sample times of the inventory objects which are no longer in the inventory.
+        :param inv_objs: Inventory objects mapped by inventory type.
         :return: null
 
         """
-        self._inventory_mgr.stop()
-        self._metric_mgr.stop()
-        self._inventory_mgr.join(timeout=constants.DEFAULT_TIMEOUT)
-        self._metric_mgr.join(timeout=constants.DEFAULT_TIMEOUT)
+        mo_ids = set(inv_obj.mor._GetMoId() for objs in inv_objs.values() for inv_obj in objs)
+        self._watermarks = dict((mo_id, watermark) for mo_id, watermark in self._watermarks.items()
+                                if mo_id in mo_ids)
+
+    def _delta(self, name, total):
+        """
+        Returns the increase of a total since the previous self metrics report.
+        :param name: Name of the total
+        :param total: Current value of the total
+        :return: number
+
+        """
+        previous = self._reported_stats.get(name, 0)
+        self._reported_stats[name] = total
+        return total - previous
 
-    class Datapoint(object):
+    def _report_self_metrics(self, payload_builder):
         """
+        Adds the measurements of the collector to the payload of the collection cycle.
+        :param payload_builder: PayloadBuilder aggregating the datapoints of the collection cycle
+        :return: null
+
+        """
+        self_metrics = self._self_metrics
+        stats = self._dispatcher.get_stats()
+        self_metrics.increment('datapoints.sent', self._delta('sent', stats['sent']))
+        self_metrics.increment('datapoints.dropped', self._delta('dropped', stats['dropped']))
+        self_metrics.increment('ingest.retries', self._delta('retried', stats['retried']))
+        self_metrics.set_gauge('ingest.queue_depth', stats['queue_depth'])
+        if 'spool_bytes' in stats:
+            self_metrics.increment('datapoints.spooled', self._delta('spooled', stats['spooled']))
+            self_metrics.increment('datapoints.replayed', self._delta('replayed', stats['replayed']))
+            self_metrics.set_gauge('spool.bytes', stats['spool_bytes'])
+            self_metrics.set_gauge('spool.replay_lag', stats['replay_lag'])
+        self_metrics.set_gauge('query.concurrency_limit', self._query_limiter.limit)
+        if self._query_limiter.latency is not None:
+            self_metrics.set_gauge('query.latency_smoothed', self._query_limiter.latency)
+        self_metrics.increment('payload.bytes', payload_builder.bytes)
+        self_metrics.increment('query_plans.compiled', self._delta('plans_compiled', self._query_planner.compiled))
+        if self._inventory_mgr.last_sync_duration is not None:
+            self_metrics.set_gauge('inventory.sync_duration', self._inventory_mgr.last_sync_duration)
+        if self._metric_mgr.last_sync_duration is not None:
+            self_metrics.set_gauge('metrics.sync_duration', self._metric_mgr.last_sync_duration)
+        metric_cache = self._inventory_mgr.get_metric_cache()
+        if metric_cache is not None:
+            hits = self._delta('cache_hits', metric_cache.hits)
+            lookups = hits + self._delta('cache_misses', metric_cache.misses)
+            if lookups:
+                self_metrics.set_gauge('metric_cache.hit_rate', float(hits) / lookups)
+            self_metrics.set_gauge('metric_cache.size', len(metric_cache))
+        self_metrics.report(payload_builder, int(time.time()) * 1000)
 
-        Plain Object to hold metric as a datapoint.
+    def stop_managers(self):
+        """
+        Stops inventory manager and metric manager threads, flushes the ingest dispatcher and logs out the
+        vCenter sessions. Also releases what a failed setup had created.
+        :return: null
 
         """
-        def __init__(self, metric_name, metric_type, value, dimensions, timestamp):
-            self.metric_name = metric_name
-            self.metric_type = metric_type
-            self.value = value
-            self.dimensions = dimensions
-            self.timestamp = timestamp
+        managers = [manager for manager in (self._inventory_mgr, self._metric_mgr) if manager is not None]
+        for manager in managers:
+            manager.stop()
+        for manager in managers:
+            if manager.is_alive():
+                manager.join(timeout=constants.DEFAULT_TIMEOUT)
+        if self._warm_start is not None:
+            self._save_warm_start(force=True)
+        self._dispatcher.stop(timeout=constants.DEFAULT_TIMEOUT)
+        if self._query_executor is not None:
+            self._query_executor.shutdown()
+        self._session_pool.close()
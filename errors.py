@@ -0,0 +1,11 @@
+"""
+Module containing the exceptions shared by the modules of the plugin.
+"""
+
+
+class ConfigError(ValueError):
+    """
+
+    Raised for invalid settings, which retrying with the same settings does not fix.
+
+    """
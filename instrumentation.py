@@ -0,0 +1,143 @@
+"""
+Module containing classes for measuring the collector itself and reporting the measurements
+as datapoints alongside the vCenter metrics.
+"""
+
+import threading
+
+import constants
+import payload
+
+
+class Histogram(object):
+    """
+
+    Thread safe distribution of the values recorded since it was last reset.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = []
+
+    def update(self, value):
+        with self._lock:
+            self._values.append(value)
+
+    def snapshot(self):
+        """
+        Returns the statistics of the recorded values and resets the histogram.
+        :return: dict of count, min, mean, p50, p99 and max, None when no value was recorded
+
+        """
+        with self._lock:
+            values, self._values = self._values, []
+        if not values:
+            return None
+        values.sort()
+        count = len(values)
+        return {
+            'count': count,
+            'min': values[0],
+            'mean': sum(values) / count,
+            'p50': values[(count - 1) // 2],
+            'p99': values[int((count - 1) * 0.99)],
+            'max': values[-1],
+        }
+
+
+class SelfMetrics(object):
+    """
+
+    Registry of the measurements of the collector for a vCenter. Counters are reported as the
+    increase since the previous report, gauges as their last value and histograms as the statistics
+    of the values recorded since the previous report.
+
+    """
+    HISTOGRAM_STATS = ('min', 'mean', 'p50', 'p99', 'max')
+
+    def __init__(self, dimensions):
+        """
+        :param dimensions: Dimensions of all the datapoints, eg: vc_name
+
+        """
+        self._lock = threading.Lock()
+        self._dimensions = dimensions
+        self._dimension_sets = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def increment(self, name, value=1, object_type=None):
+        """
+        Increments a counter.
+        :param name: Name of the metric, without the prefix
+        :param value: Increment
+        :param object_type: Type of the inventory objects measured, eg: vm
+        :return: null
+
+        """
+        key = (name, object_type)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, object_type=None):
+        """
+        Sets the value of a gauge.
+        :param name: Name of the metric, without the prefix
+        :param value: Value
+        :param object_type: Type of the inventory objects measured, eg: vm
+        :return: null
+
+        """
+        with self._lock:
+            self._gauges[(name, object_type)] = value
+
+    def histogram(self, name, object_type=None):
+        """
+        Returns a histogram, creating it on first use.
+        :param name: Name of the metric, without the prefix
+        :param object_type: Type of the inventory objects measured, eg: vm
+        :return: Histogram
+
+        """
+        key = (name, object_type)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            return histogram
+
+    def _get_dimension_set(self, object_type):
+        dimension_set = self._dimension_sets.get(object_type)
+        if dimension_set is None:
+            dimensions = dict(self._dimensions)
+            if object_type is not None:
+                dimensions['object_type'] = object_type
+            dimension_set = self._dimension_sets[object_type] = payload.DimensionSet(dimensions)
+        return dimension_set
+
+    def report(self, payload_builder, timestamp):
+        """
+        Adds the measurements to a payload and resets the counters and histograms.
+        :param payload_builder: PayloadBuilder of the collection cycle
+        :param timestamp: Timestamp of the datapoints in milliseconds
+        :return: null
+
+        """
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            gauges = dict(self._gauges)
+            histograms = dict(self._histograms)
+        prefix = constants.SELF_METRICS_PREFIX
+        for (name, object_type), value in counters.items():
+            payload_builder.add(prefix + name, 'counter', value, self._get_dimension_set(object_type), timestamp)
+        for (name, object_type), value in gauges.items():
+            payload_builder.add(prefix + name, 'gauge', value, self._get_dimension_set(object_type), timestamp)
+        for (name, object_type), histogram in histograms.items():
+            stats = histogram.snapshot()
+            if stats is None:
+                continue
+            dimension_set = self._get_dimension_set(object_type)
+            payload_builder.add(prefix + name + '.count', 'counter', stats['count'], dimension_set, timestamp)
+            for stat in self.HISTOGRAM_STATS:
+                payload_builder.add(prefix + name + '.' + stat, 'gauge', stats[stat], dimension_set, timestamp)
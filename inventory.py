@@ -3,17 +3,84 @@ Module containing classes for getting the inventory for a vCenter Server,
 caching relevant information, and periodically updating it.
 """
 
+import collections
+import hashlib
 import logging
 import threading
 import time
-from pyVmomi import vim
+from pyVmomi import vim, vmodl
+
+import constants
+import errors
+import payload
+
+
+def shard_of(mo_id, shard_count):
+    """
+    Returns the shard of an inventory object with jump consistent hashing of its moId. The shard is the same
+    in every collector process, and when the shard count changes only the objects of the added or removed
+    shards move.
+    :param mo_id: moId of the inventory object
+    :param shard_count: Number of shards
+    :return: int
+
+    """
+    key = int.from_bytes(hashlib.md5(mo_id.encode('utf-8')).digest()[:8], 'big')
+    shard = -1
+    candidate = 0
+    while candidate < shard_count:
+        shard = candidate
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        candidate = int((shard + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return shard
+
+
+def check_inventory_config(inventory_conf):
+    """
+    Validates the inventory settings, without connecting to vCenter.
+    :param inventory_conf: Inventory settings, as passed to InventoryManager
+    :return: null
+
+    """
+    sync_mode = inventory_conf.get('sync_mode', constants.DEFAULT_MOR_SYNC_MODE)
+    if sync_mode not in constants.MOR_SYNC_MODES:
+        raise errors.ConfigError("Unknown inventory sync mode : {0}".format(sync_mode))
+    shard_count = inventory_conf.get('shard_count', constants.DEFAULT_SHARD_COUNT)
+    shard_index = inventory_conf.get('shard_index', constants.DEFAULT_SHARD_INDEX)
+    if not 0 <= shard_index < shard_count:
+        raise errors.ConfigError("Shard index {0} is not within the {1} shards".format(shard_index, shard_count))
 
 
 class InventoryManager(threading.Thread):
-    def __init__(self, si, refresh_interval, vc_name, instance_id, *args, **kwargs):
+    # Properties fetched for each managed object type when syncing through the property collector
+    COLLECTOR_PROPERTIES = {
+        vim.Folder: ['parent'],
+        vim.Datacenter: ['name', 'parent'],
+        vim.ComputeResource: ['name', 'parent'],
+        vim.HostSystem: ['name', 'parent', 'runtime.bootTime'],
+        vim.VirtualMachine: ['name', 'runtime.host', 'runtime.powerState', 'config.guestFullName',
+                             'config.changeVersion'],
+    }
+
+    def __init__(self, si, refresh_interval, vc_name, instance_id, *args, inventory_conf=None, **kwargs):
         self._si = si
         self._refresh_interval = refresh_interval
         self.vc_name = vc_name
+        inventory_conf = inventory_conf or {}
+        check_inventory_config(inventory_conf)
+        self._sync_mode = inventory_conf.get('sync_mode', constants.DEFAULT_MOR_SYNC_MODE)
+        self._page_size = inventory_conf.get('page_size', constants.DEFAULT_MOR_SYNC_PAGE_SIZE)
+        self._full_sync_interval = inventory_conf.get('full_sync_interval', constants.DEFAULT_MOR_FULL_SYNC_INTERVAL)
+        self._update_wait = inventory_conf.get('update_wait', constants.DEFAULT_MOR_UPDATE_WAIT)
+        self._shard_count = inventory_conf.get('shard_count', constants.DEFAULT_SHARD_COUNT)
+        self._shard_index = inventory_conf.get('shard_index', constants.DEFAULT_SHARD_INDEX)
+        # Dimensions added to the datapoints of every inventory object
+        self._static_dims = inventory_conf.get('dimensions') or {}
+        self._metric_cache = None
+        metric_cache_ttl = inventory_conf.get('metric_cache_ttl', constants.DEFAULT_AVAILABLE_METRICS_CACHE_TTL)
+        if metric_cache_ttl > 0:
+            metric_cache_size = inventory_conf.get('metric_cache_size', constants.DEFAULT_AVAILABLE_METRICS_CACHE_SIZE)
+            self._metric_cache = AvailableMetricsCache(metric_cache_ttl, metric_cache_size)
         self._logger = logging.getLogger("{0}-IM".format(instance_id))
         self._perf_manager = self._si.RetrieveServiceContent().perfManager
         threading.Thread.__init__(self, *args, **kwargs)
@@ -22,6 +89,16 @@ class InventoryManager(threading.Thread):
         self._stop_signal = threading.Event()
         self._has_inventory = threading.Event()
         self._cache = self._new_cache()
+        # State of the incremental sync mode
+        self._collector = None
+        self._view = None
+        self._version = ''
+        self._objects = {}
+        self._inv_objs = {}
+        # Duration of the last full inventory sync in seconds
+        self.last_sync_duration = None
+        # Called after each sync which changed the inventory cache
+        self.on_sync = None
 
     def _new_cache(self):
         """
@@ -37,6 +114,42 @@ class InventoryManager(threading.Thread):
         }
         return cache
 
+    def _new_inventory_object(self, cls, mor, meta_dims=None, props=None):
+        """
+        Creates an inventory object of the given type.
+        :param cls: InventoryObject subclass
+        :param mor: Managed Object Reference
+        :param meta_dims: Meta dimensions inherited from the parent
+        :param props: Properties prefetched by the property collector
+        :return: InventoryObject, without its available metrics when it is outside the shard of this collector
+
+        """
+        return cls(mor, self._perf_manager, self.vc_name, meta_dims, props=props,
+                   metric_cache=self._metric_cache, static_dims=self._static_dims,
+                   metrics=self._in_shard(mor._GetMoId()))
+
+    def _in_shard(self, mo_id):
+        """
+        Determines whether an inventory object is collected by this collector.
+        :param mo_id: moId of the inventory object
+        :return: Boolean
+
+        """
+        return self._shard_count <= 1 or shard_of(mo_id, self._shard_count) == self._shard_index
+
+    def _add_to_cache(self, cache, inventory_type, inv_obj):
+        """
+        Adds an inventory object to the inventory cache when it is in the shard of this collector. The
+        objects outside the shard are only built for the dimensions their children inherit.
+        :param cache: Inventory cache
+        :param inventory_type: Inventory type, eg: vm
+        :param inv_obj: Inventory Object
+        :return: null
+
+        """
+        if inv_obj.has_metrics:
+            cache[inventory_type].append(inv_obj)
+
     def _sync(self, mor, cache, meta_dims=None):
         """
         Recursively walk the tree of inventory objects and update the cache
@@ -53,14 +166,14 @@ class InventoryManager(threading.Thread):
                     self._sync(item, cache, meta_dims)
 
             elif isinstance(mor, vim.Datacenter):
-                datacenter = Datacenter(mor, self._perf_manager, self.vc_name)
-                cache['datacenter'].append(datacenter)
+                datacenter = self._new_inventory_object(Datacenter, mor)
+                self._add_to_cache(cache, 'datacenter', datacenter)
                 for item in mor.hostFolder.childEntity:
                     self._sync(item, cache, datacenter.mor_dimensions)
 
             elif isinstance(mor, vim.ClusterComputeResource):
-                cluster = Cluster(mor, self._perf_manager, self.vc_name, meta_dims)
-                cache['cluster'].append(cluster)
+                cluster = self._new_inventory_object(Cluster, mor, meta_dims)
+                self._add_to_cache(cache, 'cluster', cluster)
                 for host in mor.host:
                     if hasattr(host, 'vm'):
                         self._sync(host, cache, cluster.mor_dimensions)
@@ -71,23 +184,296 @@ class InventoryManager(threading.Thread):
                         self._sync(host, cache, meta_dims)
 
             elif isinstance(mor, vim.HostSystem):
-                host = Host(mor, self._perf_manager, self.vc_name, meta_dims)
-                cache['host'].append(host)
+                host = self._new_inventory_object(Host, mor, meta_dims)
+                self._add_to_cache(cache, 'host', host)
                 for vm in mor.vm:
                     if vm.runtime.powerState == 'poweredOn':
                         self._sync(vm, cache, host.mor_dimensions)
 
             elif isinstance(mor, vim.VirtualMachine):
-                cache['vm'].append(VirtualMachine(mor, self._perf_manager, self.vc_name, meta_dims))
+                if self._in_shard(mor._GetMoId()):
+                    cache['vm'].append(self._new_inventory_object(VirtualMachine, mor, meta_dims))
 
             else:
                 self._logger.error("Unhandled managed object: {0}".format(mor))
         except Exception as e:
             self._logger.error("An error occured while syncing the inventory for {0} : {1}".format(mor, e))
 
+    def _property_filter_spec(self, view):
+        """
+        Creates the property collector filter spec which traverses the container view and selects
+        the needed properties of each managed object type.
+        :param view: Container view of the inventory
+        :return: vmodl.query.PropertyCollector.FilterSpec
+
+        """
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+            name='traverseView', path='view', skip=False, type=vim.view.ContainerView
+        )
+        object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal_spec])
+        prop_specs = [vmodl.query.PropertyCollector.PropertySpec(type=mor_type, pathSet=paths, all=False)
+                      for mor_type, paths in self.COLLECTOR_PROPERTIES.items()]
+        return vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=prop_specs)
+
+    def _retrieve_properties(self):
+        """
+        Retrieves the needed properties of the whole inventory with the property collector,
+        paging through the results with continuation tokens.
+        :return: dict of {moId: (Managed Object Reference, dict of properties)}
+
+        """
+        content = self._si.RetrieveServiceContent()
+        view = content.viewManager.CreateContainerView(content.rootFolder,
+                                                       list(self.COLLECTOR_PROPERTIES.keys()), True)
+        objects = {}
+        try:
+            collector = content.propertyCollector
+            options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=self._page_size)
+            result = collector.RetrievePropertiesEx(specSet=[self._property_filter_spec(view)], options=options)
+            while result is not None:
+                for obj_content in result.objects:
+                    props = dict((prop.name, prop.val) for prop in obj_content.propSet or [])
+                    objects[obj_content.obj._GetMoId()] = (obj_content.obj, props)
+                if not result.token:
+                    break
+                result = collector.ContinueRetrievePropertiesEx(token=result.token)
+        finally:
+            view.Destroy()
+        return objects
+
+    def _find_ancestor(self, objects, props, mor_type):
+        """
+        Follows the parent references of a managed object until an ancestor of the given type is found.
+        :param objects: Retrieved objects, mapping of moId to (Managed Object Reference, properties)
+        :param props: Properties of the managed object
+        :param mor_type: Type of the ancestor
+        :return: moId of the ancestor or None
+
+        """
+        parent = props.get('parent')
+        while parent is not None:
+            if isinstance(parent, mor_type):
+                return parent._GetMoId()
+            item = objects.get(parent._GetMoId())
+            if item is None:
+                return None
+            parent = item[1].get('parent')
+        return None
+
+    def _build_cache(self, objects, cache, previous=None, changed=()):
+        """
+        Builds the inventory cache from the properties retrieved with the property collector.
+        Inventory objects from a previous build are reused when neither their properties nor
+        the dimensions inherited from their parents have changed. An object which cannot be built,
+        eg: deleted since its properties were retrieved, is skipped with its children.
+        :param objects: Retrieved objects, mapping of moId to (Managed Object Reference, properties)
+        :param cache:
+        :param previous: Inventory objects of the previous build, mapping of moId to InventoryObject
+        :param changed: moIds whose properties changed since the previous build
+        :return: dict of {moId: InventoryObject}
+
+        """
+        previous = previous or {}
+        inv_objs = {}
+
+        def get_inv_obj(cls, mo_id, mor, meta_dims, props):
+            inv_obj = previous.get(mo_id)
+            if inv_obj is None or mo_id in changed or type(inv_obj) is not cls or inv_obj.meta_dims != meta_dims:
+                try:
+                    inv_obj = self._new_inventory_object(cls, mor, meta_dims, props)
+                except Exception as e:
+                    self._logger.error("An error occured while syncing the inventory for {0} : {1}".format(mor, e))
+                    return None
+            inv_objs[mo_id] = inv_obj
+            return inv_obj
+
+        datacenters = {}
+        compute_dims = {}
+        hosts = {}
+        for mo_id, (mor, props) in objects.items():
+            if isinstance(mor, vim.Datacenter):
+                datacenter = get_inv_obj(Datacenter, mo_id, mor, None, props)
+                if datacenter is not None:
+                    self._add_to_cache(cache, 'datacenter', datacenter)
+                    datacenters[mo_id] = datacenter
+
+        for mo_id, (mor, props) in objects.items():
+            if isinstance(mor, vim.ComputeResource):
+                datacenter_id = self._find_ancestor(objects, props, vim.Datacenter)
+                if datacenter_id is not None and datacenter_id not in datacenters:
+                    continue
+                datacenter = datacenters.get(datacenter_id)
+                meta_dims = datacenter.mor_dimensions if datacenter is not None else None
+                if isinstance(mor, vim.ClusterComputeResource):
+                    cluster = get_inv_obj(Cluster, mo_id, mor, meta_dims, props)
+                    if cluster is None:
+                        continue
+                    self._add_to_cache(cache, 'cluster', cluster)
+                    meta_dims = cluster.mor_dimensions
+                compute_dims[mo_id] = meta_dims
+
+        for mo_id, (mor, props) in objects.items():
+            if isinstance(mor, vim.HostSystem):
+                parent = props.get('parent')
+                if parent is None or parent._GetMoId() not in compute_dims:
+                    continue
+                host = get_inv_obj(Host, mo_id, mor, compute_dims[parent._GetMoId()], props)
+                if host is None:
+                    continue
+                self._add_to_cache(cache, 'host', host)
+                hosts[mo_id] = host
+
+        for mo_id, (mor, props) in objects.items():
+            if isinstance(mor, vim.VirtualMachine):
+                host_mor = props.get('runtime.host')
+                if props.get('runtime.powerState') != 'poweredOn' or host_mor is None or not self._in_shard(mo_id):
+                    continue
+                host = hosts.get(host_mor._GetMoId())
+                if host is None:
+                    continue
+                vm = get_inv_obj(VirtualMachine, mo_id, mor, host.mor_dimensions, props)
+                if vm is not None:
+                    cache['vm'].append(vm)
+        return inv_objs
+
+    def _start_updates(self):
+        """
+        Creates a private property collector with a filter over the whole inventory. The first
+        WaitForUpdatesEx call on it returns the complete inventory.
+        :return: null
+
+        """
+        content = self._si.RetrieveServiceContent()
+        self._view = content.viewManager.CreateContainerView(content.rootFolder,
+                                                             list(self.COLLECTOR_PROPERTIES.keys()), True)
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._collector.CreateFilter(self._property_filter_spec(self._view), partialUpdates=False)
+        self._version = ''
+        self._objects = {}
+        self._inv_objs = {}
+
+    def _stop_updates(self):
+        """
+        Destroys the private property collector, its filter and the container view.
+        :return: null
+
+        """
+        for managed_obj in (self._collector, self._view):
+            if managed_obj is None:
+                continue
+            try:
+                managed_obj.Destroy()
+            except Exception as e:
+                self._logger.warning("Unable to destroy {0} : {1}".format(managed_obj, e))
+        self._collector = None
+        self._view = None
+
+    def _apply_object_update(self, obj_update, changed):
+        """
+        Applies an enter, modify or leave update of a single managed object to the local property store.
+        :param obj_update: vmodl.query.PropertyCollector.ObjectUpdate
+        :param changed: set of changed moIds, updated in place
+        :return: null
+
+        """
+        mo_id = obj_update.obj._GetMoId()
+        changed.add(mo_id)
+        if obj_update.kind == 'leave':
+            self._objects.pop(mo_id, None)
+            return
+        props = {}
+        if obj_update.kind != 'enter' and mo_id in self._objects:
+            props = dict(self._objects[mo_id][1])
+        for change in obj_update.changeSet or []:
+            if change.op in ('remove', 'indirectRemove'):
+                props.pop(change.name, None)
+            else:
+                props[change.name] = change.val
+        self._objects[mo_id] = (obj_update.obj, props)
+
+    def _wait_for_updates(self, timeout):
+        """
+        Waits for inventory changes and applies them to the local property store.
+        :param timeout: Maximum time to wait for changes, in seconds
+        :return: set of changed moIds
+
+        """
+        changed = set()
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=timeout,
+                                                            maxObjectUpdates=self._page_size)
+        while True:
+            update_set = self._collector.WaitForUpdatesEx(self._version, options)
+            if update_set is None:
+                break
+            for filter_update in update_set.filterSet or []:
+                for obj_update in filter_update.objectSet or []:
+                    self._apply_object_update(obj_update, changed)
+            self._version = update_set.version
+            if not update_set.truncated:
+                break
+            options.maxWaitSeconds = 0
+        return changed
+
+    def _update_inventory(self, changed):
+        """
+        Rebuilds the inventory cache after changes, reusing the unchanged inventory objects.
+        :param changed: set of changed moIds
+        :return: null
+
+        """
+        cache = self._new_cache()
+        self._inv_objs = self._build_cache(self._objects, cache, self._inv_objs, changed)
+        with self.update_lock:
+            self._cache = cache
+        self._has_inventory.set()
+        if self.on_sync is not None:
+            self.on_sync()
+
     def sync_inventory(self):
+        start_time = time.time()
         cache = self._new_cache()
-        self._sync(self._si.RetrieveServiceContent().rootFolder, cache)
+        if self._sync_mode in ('collector', 'incremental'):
+            self._build_cache(self._retrieve_properties(), cache)
+        else:
+            self._sync(self._si.RetrieveServiceContent().rootFolder, cache)
+        with self.update_lock:
+            self._cache = cache
+        self.last_sync_duration = time.time() - start_time
+        self._has_inventory.set()
+        if self.on_sync is not None:
+            self.on_sync()
+
+    def snapshot(self):
+        """
+        Returns the inventory cache as plain data, to restore it in another process.
+        :return: dict of inventory type to list of dict
+
+        """
+        cache = self.current_inventory()
+        return dict((inventory_type, [inv_obj.snapshot() for inv_obj in inv_objs])
+                    for inventory_type, inv_objs in cache.items())
+
+    def restore(self, snapshot):
+        """
+        Restores the inventory cache from a snapshot without querying vCenter, until the next sync replaces it.
+        The available metrics of the restored objects are added to the available metrics cache, so the next
+        sync only queries the objects which changed in the meantime.
+        :param snapshot: Snapshot returned by snapshot
+        :return: null
+
+        """
+        cache = self._new_cache()
+        stub = self._si._stub
+        for inventory_type, states in snapshot.items():
+            cls = INVENTORY_CLASSES[inventory_type]
+            for state in states:
+                mor = getattr(vim, state['mor_type'])(state['mo_id'], stub)
+                inv_obj = cls(mor, self._perf_manager, self.vc_name, state['meta_dims'],
+                              metric_cache=self._metric_cache, static_dims=self._static_dims, state=state)
+                if self._metric_cache is not None:
+                    self._metric_cache.put(state['mo_id'], (inv_obj.metric_id_map, inv_obj.available_instances),
+                                           state['version'])
+                cache[inventory_type].append(inv_obj)
         with self.update_lock:
             self._cache = cache
         self._has_inventory.set()
@@ -110,7 +496,43 @@ class InventoryManager(threading.Thread):
         with self.update_lock:
             return self._cache
 
+    def _run_incremental(self):
+        """
+        Keeps the inventory cache up to date by applying the changes reported by the property collector.
+        A full resync is done every full sync interval and after errors, as a consistency fallback.
+        :return: null
+
+        """
+        next_full_sync = 0
+        full_sync_start = None
+        while not self._stop_signal.is_set():
+            try:
+                if self._collector is None or time.time() >= next_full_sync:
+                    full_sync_start = time.time()
+                    self._stop_updates()
+                    self._start_updates()
+                    next_full_sync = time.time() + self._full_sync_interval
+                    self._logger.info("Started vCenter inventory full sync")
+                changed = self._wait_for_updates(self._update_wait)
+                if changed:
+                    self._update_inventory(changed)
+                    if full_sync_start is not None:
+                        self.last_sync_duration = time.time() - full_sync_start
+                        full_sync_start = None
+                    self._logger.info("Applied {0} vCenter inventory updates".format(len(changed)))
+            except Exception as e:
+                self._logger.warning("Exception when waiting for vCenter inventory updates, "
+                                     "resyncing: {0}".format(e))
+                self._stop_updates()
+                self._stop_signal.wait(self._update_wait)
+            except KeyboardInterrupt:
+                break
+        self._stop_updates()
+
     def run(self):
+        if self._sync_mode == 'incremental':
+            self._run_incremental()
+            return
         while not self._stop_signal.is_set():
             next_interval = time.time() + self._refresh_interval
             try:
@@ -128,38 +550,207 @@ class InventoryManager(threading.Thread):
             while (not self._stop_signal.is_set() and time.time() < next_interval):
                 time.sleep(1)
 
+    def get_metric_cache(self):
+        """
+        Returns the available metrics cache shared by the inventory objects, None when it is disabled.
+        :return: AvailableMetricsCache
+        """
+        return self._metric_cache
+
     def stop(self):
         self._stop_signal.set()
 
 
+class AvailableMetricsCache(object):
+    """
+
+    LRU cache of the available metrics of managed objects, keyed by moId. Entries expire after a TTL
+    and are invalidated when the version of their managed object changes.
+
+    """
+    def __init__(self, ttl, max_size):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mo_id, version=None):
+        """
+        Returns the cached available metrics of a managed object.
+        :param mo_id: moId of the managed object
+        :param version: Current version of the managed object, None when unknown
+        :return: (metric id map, available instances) or None when there is no valid entry
+
+        """
+        with self._lock:
+            entry = self._entries.get(mo_id)
+            if entry is not None:
+                metric_id_map, entry_version, expiry = entry
+                if expiry > time.time() and entry_version == version:
+                    self._entries.move_to_end(mo_id)
+                    self.hits += 1
+                    return metric_id_map
+                del self._entries[mo_id]
+            self.misses += 1
+            return None
+
+    def put(self, mo_id, available_metrics, version=None):
+        """
+        Caches the available metrics of a managed object, evicting the least recently used entries when full.
+        :param mo_id: moId of the managed object
+        :param available_metrics: (metric id map, available instances) of the managed object
+        :param version: Current version of the managed object, None when unknown
+        :return: null
+
+        """
+        with self._lock:
+            self._entries[mo_id] = (available_metrics, version, time.time() + self._ttl)
+            self._entries.move_to_end(mo_id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
 class InventoryObject(object):
     INSTANT_INTERVAL = 20
+    # Property whose change invalidates the cached available metrics, None when only the TTL applies
+    VERSION_PROPERTY = None
 
-    def __init__(self, mor, perf_mgr, vc_name, meta_dims=None):
+    def __init__(self, mor, perf_mgr, vc_name, meta_dims=None, props=None, metric_cache=None, static_dims=None,
+                 state=None, metrics=True):
         self.mor = mor
         self._perf_mgr = perf_mgr
+        self._metric_cache = metric_cache
         self.vc_name = vc_name
-        # Mapping of integer counter key to its corresponding MetricId object
-        self.metric_id_map = self._mor_metrics()
-        self.dimensions = self._get_dimensions()
+        self.meta_dims = meta_dims
+        # Properties prefetched by the property collector, None when they are read from the managed object
+        self._props = props
+        # Whether the metrics of the object are collected, otherwise it only provides the dimensions of its children
+        self.has_metrics = metrics
+        # A snapshot of the inventory object is restored instead of reading its metrics and properties
+        if state is None:
+            self.version = self._get_version()
+            # Mapping of integer counter key to its corresponding MetricId object, and to the names of its instances
+            self.metric_id_map, self.available_instances = self._mor_metrics() if metrics else ({}, {})
+            self.dimensions = self._get_dimensions()
+            self.sf_metadata_dims = self._get_sf_metadata_dims()
+            if meta_dims is not None:
+                self.sf_metadata_dims.update(meta_dims)
+        else:
+            self.version = state['version']
+            self.metric_id_map = dict((counter_id, vim.PerformanceManager.MetricId(counterId=counter_id,
+                                                                                   instance=instance))
+                                      for counter_id, instance in state['metric_ids'])
+            self.available_instances = dict((counter_id, instances) for counter_id, instances in state['instances'])
+            self.dimensions = state['dimensions']
+            self.sf_metadata_dims = state['sf_metadata_dims']
         self.properties = self._get_properties()
-        self.sf_metadata_dims = self._get_sf_metadata_dims()
-        if meta_dims is not None:
-            self.sf_metadata_dims.update(meta_dims)
         self.mor_dimensions = self._get_mor_dimensions()
+        self.dimension_set = self._get_dimension_set(static_dims)
+        # Mapping of instance to the DimensionSet of its datapoints
+        self._instance_dimension_sets = {}
 
-    def _mor_metrics(self):
+    def _get_dimension_set(self, static_dims):
+        """
+        Builds the dimensions shared by all datapoints of the inventory object.
+        :param static_dims: Dimensions added to the datapoints of every inventory object
+        :return: payload.DimensionSet
+
+        """
+        dimensions = {}
+        if static_dims is not None:
+            dimensions.update(static_dims)
+        dimensions.update(self.sf_metadata_dims)
+        dimensions['metric_source'] = constants.METRIC_SOURCE
+        return payload.DimensionSet(dimensions)
+
+    def get_dimension_set(self, instance):
         """
-        Determines the metrics being published by a given managed object.
+        Returns the dimensions of the datapoints of a metric instance. Dimension sets are shared
+        by all the datapoints of the same instance and must not be modified.
+        :param instance: Instance of the metric, eg: vmnic0. Empty for the aggregated value.
+        :return: payload.DimensionSet
 
+        """
+        if instance == '':
+            return self.dimension_set
+        dimension_set = self._instance_dimension_sets.get(instance)
+        if dimension_set is None:
+            dimensions = self.dimension_set.dimensions.copy()
+            dimensions['instance'] = str(instance).replace(':', '_').replace('.', '_')
+            dimension_set = payload.DimensionSet(dimensions)
+            self._instance_dimension_sets[instance] = dimension_set
+        return dimension_set
+
+    def snapshot(self):
+        """
+        Returns the state of the inventory object as plain data, which can be saved as JSON.
         :return: dict
 
         """
+        return {
+            'mor_type': type(self.mor)._wsdlName,
+            'mo_id': self.mor._GetMoId(),
+            'version': self.version,
+            'meta_dims': self.meta_dims,
+            'dimensions': self.dimensions,
+            'sf_metadata_dims': self.sf_metadata_dims,
+            'metric_ids': [(metric_id.counterId, metric_id.instance) for metric_id in self.metric_id_map.values()],
+            'instances': list(self.available_instances.items()),
+        }
+
+    def _get_version(self):
+        """
+        Returns the version of the managed object, which invalidates its cached available metrics when it changes.
+        :return: Value of the version property, None when unknown
+
+        """
+        if self._props is not None and self.VERSION_PROPERTY is not None:
+            return self._props.get(self.VERSION_PROPERTY)
+        return None
+
+    def _mor_metrics(self):
+        """
+        Determines the metrics being published by a given managed object, with one MetricId per counter
+        queried when no instance policy applies, and the instances vCenter has for each counter,
+        '' being the aggregated instance.
+
+        :return: (dict of counter key to MetricId, dict of counter key to list of instance names)
+
+        """
+        version = self.version
+        if self._metric_cache is not None:
+            available = self._metric_cache.get(self.mor._GetMoId(), version)
+            if available is not None:
+                return available
         metrics = self._perf_mgr.QueryAvailablePerfMetric(self.mor, None, None, self.INSTANT_INTERVAL)
         metric_map = {}
+        instances = {}
         for metric_id_obj in metrics:
             metric_map[metric_id_obj.counterId] = metric_id_obj
-        return metric_map
+            instances.setdefault(metric_id_obj.counterId, []).append(metric_id_obj.instance)
+        if self._metric_cache is not None:
+            self._metric_cache.put(self.mor._GetMoId(), (metric_map, instances), version)
+        return metric_map, instances
+
+    def _get_property(self, path):
+        """
+        Returns a property of the managed object, from the prefetched properties when available.
+        :param path: Property path, eg: config.guestFullName
+        :return: Property value
+
+        """
+        if self._props is not None:
+            return self._props.get(path)
+        value = self.mor
+        for name in path.split('.'):
+            value = getattr(value, name)
+        return value
 
     def _get_dimensions(self):
         dimensions = {
@@ -187,7 +778,7 @@ class Datacenter(InventoryObject):
     def _get_dimensions(self):
         dimensions = InventoryObject._get_dimensions(self).copy()
         additional_dims = {
-            'datacenter': self.mor.name,
+            'datacenter': self._get_property('name'),
             'object_type': 'datacenter',
         }
         dimensions.update(additional_dims)
@@ -200,7 +791,7 @@ class Cluster(InventoryObject):
     def _get_dimensions(self):
         dimensions = InventoryObject._get_dimensions(self).copy()
         additional_dims = {
-            'cluster': self.mor.name,
+            'cluster': self._get_property('name'),
             'object_type': 'cluster',
         }
         dimensions.update(additional_dims)
@@ -208,11 +799,14 @@ class Cluster(InventoryObject):
 
 
 class Host(InventoryObject):
+    VERSION_PROPERTY = 'runtime.bootTime'
+
     def _get_dimensions(self):
         dimensions = InventoryObject._get_dimensions(self).copy()
+        name = self._get_property('name')
         additional_dims = {
-            'esx_host': self.mor.name,
-            'host': self.mor.name,
+            'esx_host': name,
+            'host': name,
             'object_type': 'host',
         }
         dimensions.update(additional_dims)
@@ -220,10 +814,12 @@ class Host(InventoryObject):
 
 
 class VirtualMachine(InventoryObject):
+    VERSION_PROPERTY = 'config.changeVersion'
+
     def _get_dimensions(self):
         dimensions = InventoryObject._get_dimensions(self).copy()
         additional_dims = {
-            'vm': self.mor.name,
+            'vm': self._get_property('name'),
             'object_type': 'vm',
         }
         dimensions.update(additional_dims)
@@ -232,7 +828,16 @@ class VirtualMachine(InventoryObject):
     def _get_sf_metadata_dims(self):
         dimensions = self._get_dimensions().copy()
         metadata_dims = {
-            'guest_os': self.mor.config.guestFullName,
+            'guest_os': self._get_property('config.guestFullName'),
         }
         dimensions.update(metadata_dims)
         return dimensions
+
+
+# Inventory object class of each inventory type
+INVENTORY_CLASSES = {
+    'datacenter': Datacenter,
+    'cluster': Cluster,
+    'host': Host,
+    'vm': VirtualMachine,
+}
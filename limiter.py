@@ -0,0 +1,68 @@
+"""
+Module containing a class for adapting the number of concurrent performance queries to the
+latency vCenter responds with.
+"""
+
+import threading
+
+
+class AdaptiveLimiter(object):
+    """
+
+    Additive increase, multiplicative decrease limit on the number of concurrent queries. The limit
+    grows by one per window of limit queries answered under the target latency, and is multiplied by
+    the decrease factor when the smoothed latency exceeds the target or a query fails. The limit is
+    decreased at most once per window, so the queries in flight when vCenter slowed down count once.
+
+    """
+    def __init__(self, max_limit, target_latency, min_limit=1, decrease=0.5, smoothing=0.2):
+        """
+        :param max_limit: Highest limit, eg: the number of vCenter sessions
+        :param target_latency: Latency above which the limit is decreased, in seconds
+        :param min_limit: Lowest limit
+        :param decrease: Factor applied to the limit when it is decreased
+        :param smoothing: Weight of each new latency in the smoothed latency
+
+        """
+        self._lock = threading.Lock()
+        self._max_limit = max(min_limit, max_limit)
+        self._min_limit = min_limit
+        self._target_latency = target_latency
+        self._decrease = decrease
+        self._smoothing = smoothing
+        self._limit = float(min_limit)
+        self._since_decrease = 0
+        self.latency = None
+        self.decreases = 0
+
+    @property
+    def limit(self):
+        """
+        Returns the current number of queries allowed in flight.
+        :return: int
+
+        """
+        return int(self._limit)
+
+    def record(self, latency, failed=False):
+        """
+        Records the outcome of a query and adapts the limit.
+        :param latency: Time the query took in seconds, ignored when it failed
+        :param failed: Whether the query failed
+        :return: null
+
+        """
+        with self._lock:
+            if not failed:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += self._smoothing * (latency - self.latency)
+            self._since_decrease += 1
+            if failed or self.latency > self._target_latency:
+                if self._since_decrease >= self._limit:
+                    self._limit = max(self._min_limit, self._limit * self._decrease)
+                    self._since_decrease = 0
+                    self.decreases += 1
+            elif self._limit < self._max_limit:
+                self._limit = min(self._max_limit, self._limit + 1.0 / int(self._limit))
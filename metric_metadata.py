@@ -1,6 +1,7 @@
 """
 Module containing a class for periodically syncing vCenter's latest metric
-metadata with a local cache.
+metadata with a local cache, and a catalog of the performance counters shared
+by the vCenters of the same build.
 """
 
 import logging
@@ -8,6 +9,8 @@ import threading
 import time
 import vsphere_metrics
 
+import constants
+
 
 class MetricManager(threading.Thread):
     def __init__(self, si, refresh_interval, metric_conf, vc_name, instance_id, *args, **kwargs):
@@ -16,13 +19,44 @@ class MetricManager(threading.Thread):
         self._required_metrics = vsphere_metrics.get_metrics(metric_conf)
         self._vc_name = vc_name
         self._logger = logging.getLogger("{0}-MM".format(instance_id))
-        self._perf_manager = self._si.RetrieveServiceContent().perfManager
+        content = self._si.RetrieveServiceContent()
+        self._perf_manager = content.perfManager
+        # Build of vCenter, which identifies its counter catalog
+        self._build = None
+        if content.about is not None and content.about.apiVersion and content.about.build:
+            self._build = (content.about.apiVersion, content.about.build)
         threading.Thread.__init__(self, *args, **kwargs)
         self.daemon = True
         self.update_lock = threading.Lock()
         self._stop_signal = threading.Event()
         self._has_metrics = threading.Event()
         self._monitored_metrics = {}
+        self.last_sync_duration = None
+        # Called after each sync of the metric metadata
+        self.on_sync = None
+
+    def _build_catalog(self):
+        """
+        Builds the counter catalog from the performance counters of vCenter.
+        :return: CounterCatalog
+
+        """
+        entries = []
+        for counter in self._perf_manager.perfCounter:
+            metric_full_name = self._format_metric_full_name(counter)
+            entries.append((counter.key, self._get_metric_info(counter, metric_full_name)))
+        return CounterCatalog(entries)
+
+    def _get_catalog(self):
+        """
+        Returns the counter catalog of the build of vCenter, building it only when no environment did for
+        the same build within the catalog TTL.
+        :return: CounterCatalog
+
+        """
+        if self._build is None:
+            return self._build_catalog()
+        return CounterCatalog.shared(self._build, self._build_catalog)
 
     def _sync_metrics(self):
         """
@@ -30,21 +64,45 @@ class MetricManager(threading.Thread):
         :return: null
 
         """
+        start_time = time.time()
+        catalog = self._get_catalog()
+        previous = self.get_monitored_metrics()
         monitored_metrics = {}
-        available_metrics = {}
-        for counter in self._perf_manager.perfCounter:
-            metric_full_name = self._format_metric_full_name(counter)
-            available_metrics[metric_full_name] = counter
         for mor in self._required_metrics.keys():
-            mor_metrics = {}
-            for metric in self._required_metrics[mor]:
-                if metric in available_metrics.keys():
-                    counter = available_metrics[metric]
-                    if counter.key not in mor_metrics.keys():
-                        mor_metrics[counter.key] = self._get_metric_info(counter, metric)
+            mor_metrics = catalog.metric_table(self._required_metrics[mor])
+            # Unchanged tables are kept, so that the query plans compiled for them stay valid
+            if previous.get(mor) == mor_metrics:
+                mor_metrics = previous[mor]
             monitored_metrics[mor] = mor_metrics
         with self.update_lock:
             self._monitored_metrics = monitored_metrics
+        self.last_sync_duration = time.time() - start_time
+        self._has_metrics.set()
+        if self.on_sync is not None:
+            self.on_sync()
+
+    def snapshot(self):
+        """
+        Returns the monitored metrics as plain data, to restore them in another process. Counter keys are
+        listed with their metric instead of keying a dict, so the snapshot can be saved as JSON.
+        :return: dict of inventory type to list of (counter key, name, level, metric type, units)
+
+        """
+        return dict((mor, [(key, metric.name, metric.level, metric.metric_type, metric.units)
+                           for key, metric in mor_metrics.items()])
+                    for mor, mor_metrics in self.get_monitored_metrics().items())
+
+    def restore(self, snapshot):
+        """
+        Restores the monitored metrics from a snapshot, until the next sync replaces them.
+        :param snapshot: Snapshot returned by snapshot
+        :return: null
+
+        """
+        monitored_metrics = dict((mor, dict((metric[0], MetricInfo(*metric[1:])) for metric in mor_metrics))
+                                 for mor, mor_metrics in snapshot.items())
+        with self.update_lock:
+            self._monitored_metrics = monitored_metrics
         self._has_metrics.set()
 
     def _get_metric_info(self, counter, metric_name):
@@ -151,3 +209,84 @@ class MetricInfo(object):
                 .format(self.name, self.level, self.metric_type, self.units))
 
     __repr__ = __str__
+
+
+class CounterCatalog(object):
+    """
+
+    Index of the performance counters of a vCenter build, from full metric name to counter key and back,
+    with the MetricInfo of each counter. Catalogs are immutable and shared by the environments of the
+    vCenters of the same build, as vCenter assigns the same counter keys in the same build.
+
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, entries):
+        """
+        :param entries: Iterable of (counter key, MetricInfo) tuples
+
+        """
+        self.created = time.time()
+        self._by_name = {}
+        self._by_key = {}
+        for key, metric in entries:
+            self._by_name[metric.name] = (key, metric)
+            self._by_key[key] = metric
+
+    @classmethod
+    def shared(cls, build, build_catalog, ttl=constants.DEFAULT_COUNTER_CATALOG_TTL):
+        """
+        Returns the catalog shared for a vCenter build, building it when there is none or it is older than the TTL,
+        so that counters added to vCenter are eventually found.
+        :param build: Build of vCenter, eg: (apiVersion, build)
+        :param build_catalog: Callable building the catalog
+        :param ttl: Age in seconds after which the catalog is built again
+        :return: CounterCatalog
+
+        """
+        with cls._shared_lock:
+            catalog = cls._shared.get(build)
+        if catalog is None or time.time() - catalog.created > ttl:
+            catalog = build_catalog()
+            with cls._shared_lock:
+                cls._shared[build] = catalog
+        return catalog
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def key(self, name):
+        """
+        Returns the counter key of a full metric name, eg: cpu.usage.average.
+        :param name: Full metric name
+        :return: int, None when the counter does not exist
+
+        """
+        entry = self._by_name.get(name)
+        return entry[0] if entry is not None else None
+
+    def name(self, key):
+        """
+        Returns the full metric name of a counter key.
+        :param key: Counter key
+        :return: string, None when the counter does not exist
+
+        """
+        metric = self._by_key.get(key)
+        return metric.name if metric is not None else None
+
+    def metric_table(self, names):
+        """
+        Returns the MetricInfo of the counters of the given metrics, by counter key, for the collection of an
+        inventory type. Metrics missing from the catalog are left out.
+        :param names: Full metric names
+        :return: dict of counter key to MetricInfo
+
+        """
+        table = {}
+        for name in names:
+            entry = self._by_name.get(name)
+            if entry is not None and entry[0] not in table:
+                table[entry[0]] = entry[1]
+        return table
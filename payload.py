@@ -0,0 +1,101 @@
+"""
+Module containing classes for aggregating the datapoints of a collection cycle into
+ingest payloads bounded by datapoint count and encoded size.
+"""
+
+# Approximate encoded size of a datapoint without its metric name and dimensions
+DATAPOINT_OVERHEAD = 48
+# Approximate encoded size of a dimension without its key and value
+DIMENSION_OVERHEAD = 8
+
+
+class DimensionSet(object):
+    """
+
+    Dimensions shared by many datapoints, with their precomputed encoded size.
+
+    """
+    __slots__ = ('dimensions', 'encoded_size')
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.encoded_size = sum(DIMENSION_OVERHEAD + len(key) + len(str(value))
+                                for key, value in dimensions.items())
+
+
+class PayloadBuilder(object):
+
+    def __init__(self, max_datapoints, max_bytes, dispatch):
+        """
+        :param max_datapoints: Maximum number of datapoints in a payload item
+        :param max_bytes: Maximum approximate encoded size of a payload item, 0 means no limit
+        :param dispatch: Callable receiving the list of full payload items
+
+        """
+        self._max_datapoints = max_datapoints
+        self._max_bytes = max_bytes
+        self._dispatch = dispatch
+        # Approximate encoded size of all the datapoints added
+        self.bytes = 0
+        self._reset()
+
+    def _reset(self):
+        self._gauges = []
+        self._counters = []
+        self._size = 0
+
+    def add(self, metric_name, metric_type, value, dimension_set, timestamp):
+        """
+        Adds a datapoint to the current payload item, flushing the item first when the datapoint
+        would exceed its datapoint count or size.
+        :param metric_name: Name of the metric
+        :param metric_type: gauge or counter
+        :param value: Value of the datapoint
+        :param dimension_set: DimensionSet of the datapoint
+        :param timestamp: Timestamp of the datapoint in milliseconds
+        :return: null
+
+        """
+        size = DATAPOINT_OVERHEAD + len(metric_name) + dimension_set.encoded_size
+        dp_count = len(self._gauges) + len(self._counters)
+        if dp_count > 0 and (dp_count >= self._max_datapoints or
+                             (self._max_bytes and self._size + size > self._max_bytes)):
+            self.flush()
+        payload_obj = {
+            'metric': metric_name,
+            'value': value,
+            'dimensions': dimension_set.dimensions,
+            'timestamp': timestamp
+        }
+        if metric_type == 'gauge':
+            self._gauges.append(payload_obj)
+        elif metric_type == 'counter':
+            self._counters.append(payload_obj)
+        else:
+            return
+        self._size += size
+        self.bytes += size
+
+    def add_batch(self, batch):
+        """
+        Adds all datapoints of a DatapointBatch, reading its columns directly.
+        :param batch: DatapointBatch
+        :return: null
+
+        """
+        for metric, value, dimension_set, timestamp in batch.rows():
+            self.add(metric.name, metric.metric_type, value, dimension_set, timestamp)
+
+    def flush(self):
+        """
+        Dispatches the current payload item, if it has any datapoints.
+        :return: null
+
+        """
+        if self._gauges or self._counters:
+            item = {
+                'gauges': self._gauges,
+                'counters': self._counters
+            }
+            self._reset()
+            self._dispatch([item])
@@ -0,0 +1,210 @@
+"""
+Module containing a class for compiling the performance query specs of the inventory objects
+once, and reusing them in every collection cycle until the inventory or metric metadata changes,
+and the instance policies selecting the instances queried for per device metrics.
+"""
+
+import re
+from pyVmomi import vim
+
+import errors
+
+
+class InstancePolicy(object):
+    """
+
+    Selection of the instances of a metric (each vNIC, disk, CPU core, datastore...) queried for an entity.
+    The aggregated instance '' is always queried when vCenter has it.
+
+    """
+    def __init__(self, aggregate=False, include=None, exclude=None, top=None):
+        """
+        :param aggregate: Whether only the aggregated instance is queried
+        :param include: Regex the names of the queried instances match, None for all
+        :param exclude: Regex the names of the queried instances do not match, None for none
+        :param top: Number of instances with the highest values sent per entity, None for all
+
+        """
+        self.aggregate = aggregate
+        self._include = re.compile(include) if include is not None else None
+        self._exclude = re.compile(exclude) if exclude is not None else None
+        self.top = top
+
+    def _is_selected(self, instance):
+        if self._include is not None and not self._include.search(instance):
+            return False
+        if self._exclude is not None and self._exclude.search(instance):
+            return False
+        return True
+
+    def metric_ids(self, counter_id, instances):
+        """
+        Returns the metric ids to query for a counter of an entity. The highest instances of a top policy
+        are only known once queried, so all the instances are queried unless a regex selects them.
+        :param counter_id: Counter key
+        :param instances: Names of the instances vCenter has for the counter of the entity
+        :return: list of vim.PerformanceManager.MetricId
+
+        """
+        selected = [instance for instance in instances if instance == '' or
+                    (not self.aggregate and self._is_selected(instance))]
+        if self.top is not None and self._include is None and self._exclude is None and len(selected) > 1:
+            selected = ['*']
+        return [vim.PerformanceManager.MetricId(counterId=counter_id, instance=instance) for instance in selected]
+
+
+def parse_instance_policies(conf):
+    """
+    Parses the instance policies of the metrics, eg: {'net.usage.average': {'include': '^vmnic[01]$'},
+    'disk.read.average': {'top': 5}, 'cpu.usage.average': 'aggregate'}.
+    :param conf: Mapping of full metric name to policy, None for no policies
+    :return: dict of full metric name to InstancePolicy
+
+    """
+    policies = {}
+    for name, policy_conf in (conf or {}).items():
+        if policy_conf == 'aggregate':
+            policies[name] = InstancePolicy(aggregate=True)
+            continue
+        if not isinstance(policy_conf, dict) or not policy_conf or \
+                set(policy_conf) - set(['include', 'exclude', 'top']):
+            raise errors.ConfigError("Invalid instance policy of {0} : {1}".format(name, policy_conf))
+        top = policy_conf.get('top')
+        if top is not None and (not isinstance(top, int) or top < 1):
+            raise errors.ConfigError("Invalid top instances of {0} : {1}".format(name, top))
+        try:
+            policies[name] = InstancePolicy(include=policy_conf.get('include'), exclude=policy_conf.get('exclude'),
+                                            top=top)
+        except re.error as e:
+            raise errors.ConfigError("Invalid instance regex of {0} : {1}".format(name, e))
+    return policies
+
+
+class QueryPlanner(object):
+    """
+
+    Cache of the query plans of the inventory objects. The plan of an inventory object is the list of its
+    query specs, with the metrics decoding their results, and is compiled again only when the inventory
+    object or the monitored metrics of its inventory type are replaced by a sync. The plans of a whole
+    inventory type are reused as is while neither its inventory objects nor its monitored metrics change.
+
+    """
+    def __init__(self, metric_batch_size, latest_sample=True, instance_policies=None):
+        """
+        :param metric_batch_size: Maximum number of metric ids per query spec, 0 means no limit
+        :param latest_sample: Whether the specs query the latest sample, otherwise the sample range is set
+                              on the specs before each query
+        :param instance_policies: Mapping of full metric name to InstancePolicy, the metrics without a policy
+                                  are queried with the single metric id kept by the inventory object
+
+        """
+        self._metric_batch_size = metric_batch_size
+        self._latest_sample = latest_sample
+        self._instance_policies = instance_policies or {}
+        # Top instance counts by full metric name
+        self._top = dict((name, policy.top) for name, policy in self._instance_policies.items()
+                         if policy.top is not None)
+        # Mapping of inventory type to (inventory objects, monitored metrics, query spec tuples)
+        self._type_plans = {}
+        # Mapping of moId to (inventory object, monitored metrics, query spec tuples)
+        self._plans = {}
+        # Number of inventory object plans compiled
+        self.compiled = 0
+
+    def __len__(self):
+        return len(self._plans)
+
+    def _compile(self, inv_obj, monitored_metrics):
+        """
+        Compiles the query specs of an inventory object for the monitored metrics of its inventory type.
+        :param inv_obj: Inventory Object
+        :param monitored_metrics: Mapping of counter key to MetricInfo
+        :return: list of (inventory object, monitored metrics, query spec) tuples
+
+        """
+        metric_id_map = inv_obj.metric_id_map
+        metric_id_objs = []
+        for key in metric_id_map:
+            if key not in monitored_metrics:
+                continue
+            policy = self._instance_policies.get(monitored_metrics[key].name)
+            instances = inv_obj.available_instances.get(key)
+            if policy is None or instances is None:
+                metric_id_objs.append(metric_id_map[key])
+            else:
+                metric_id_objs.extend(policy.metric_ids(key, instances))
+        if not metric_id_objs:
+            return []
+        sample_range = {'maxSample': 1} if self._latest_sample else {}
+        step = self._metric_batch_size or len(metric_id_objs)
+        plan = []
+        for start in range(0, len(metric_id_objs), step):
+            query_spec = vim.PerformanceManager.QuerySpec(
+                entity=inv_obj.mor, metricId=metric_id_objs[start:start + step],
+                intervalId=inv_obj.INSTANT_INTERVAL, format='normal', **sample_range
+            )
+            plan.append((inv_obj, monitored_metrics, query_spec))
+        self.compiled += 1
+        return plan
+
+    def _entity_plan(self, inv_obj, monitored_metrics):
+        mo_id = inv_obj.mor._GetMoId()
+        cached = self._plans.get(mo_id)
+        if cached is not None and cached[0] is inv_obj and cached[1] is monitored_metrics:
+            return cached[2]
+        plan = self._compile(inv_obj, monitored_metrics)
+        self._plans[mo_id] = (inv_obj, monitored_metrics, plan)
+        return plan
+
+    def plan(self, inventory_type, inv_objs, monitored_metrics):
+        """
+        Returns the query specs of the inventory objects of a type, compiling the plans which are out of date.
+        :param inventory_type: Inventory type, eg: vm
+        :param inv_objs: List of the inventory objects of the type, from the inventory cache
+        :param monitored_metrics: Mapping of counter key to MetricInfo of the type
+        :return: list of (inventory object, monitored metrics, query spec) tuples
+
+        """
+        cached = self._type_plans.get(inventory_type)
+        if cached is not None and cached[0] is inv_objs and cached[1] is monitored_metrics:
+            return cached[2]
+        query_specs = []
+        for inv_obj in inv_objs:
+            query_specs.extend(self._entity_plan(inv_obj, monitored_metrics))
+        self._type_plans[inventory_type] = (inv_objs, monitored_metrics, query_specs)
+        return query_specs
+
+    def prune(self, inv_objs):
+        """
+        Forgets the plans of the inventory objects which are no longer in the inventory.
+        :param inv_objs: Inventory objects mapped by inventory type
+        :return: null
+
+        """
+        mo_ids = set(inv_obj.mor._GetMoId() for objs in inv_objs.values() for inv_obj in objs)
+        self._plans = dict((mo_id, cached) for mo_id, cached in self._plans.items() if mo_id in mo_ids)
+
+    def select_top_instances(self, series, monitored_metrics):
+        """
+        Leaves out the instances of the metrics with a top policy beyond the ones with the highest latest values.
+        :param series: Metric series of an entity from QueryPerf()
+        :param monitored_metrics: Mapping of counter key to MetricInfo
+        :return: list of metric series
+
+        """
+        if not self._top:
+            return series
+        ranked = {}
+        for metric in series:
+            metric_info = monitored_metrics.get(metric.id.counterId)
+            if metric.id.instance and metric_info is not None and metric_info.name in self._top:
+                ranked.setdefault(metric.id.counterId, []).append(metric)
+        dropped = set()
+        for counter_id, metrics in ranked.items():
+            top = self._top[monitored_metrics[counter_id].name]
+            if len(metrics) > top:
+                metrics.sort(key=lambda metric: metric.value[-1] if metric.value else float('-inf'), reverse=True)
+                dropped.update(id(metric) for metric in metrics[top:])
+        if not dropped:
+            return series
+        return [metric for metric in series if id(metric) not in dropped]
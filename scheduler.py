@@ -0,0 +1,142 @@
+"""
+Module containing classes for scheduling collection cycles on a monotonic clock, at
+fixed offsets from the wall clock boundaries of the collection interval, and for
+collecting each inventory type at its own interval.
+"""
+
+import time
+
+import errors
+
+OVERRUN_POLICIES = ('skip', 'immediate', 'shed')
+
+
+class Tick(object):
+    """
+
+    A collection cycle to run, with the number of ticks missed since the previous one. When shed is
+    set the cycle should leave out lower priority work to catch up with its schedule.
+
+    """
+    __slots__ = ('scheduled', 'late', 'shed', 'missed')
+
+    def __init__(self, scheduled, late=False, shed=False, missed=0):
+        self.scheduled = scheduled
+        self.late = late
+        self.shed = shed
+        self.missed = missed
+
+
+class TickScheduler(object):
+    def __init__(self, interval, offset=0, overrun_policy='skip', clock=time.monotonic, wall_clock=time.time):
+        """
+        Schedules ticks every interval on the monotonic clock, starting at the next wall clock time which
+        is a multiple of the interval plus the offset, so that ticks do not drift and fall at the same
+        time within vCenter's sample intervals.
+        :param interval: Time between ticks in seconds
+        :param offset: Time after each wall clock boundary at which the tick is scheduled, in seconds
+        :param overrun_policy: What to do with the ticks missed while a cycle overran: skip them and wait
+                               for the next tick, run one immediately, or run one immediately and shed work
+        :param clock: Monotonic clock
+        :param wall_clock: Wall clock used only to align the first tick
+
+        """
+        if overrun_policy not in OVERRUN_POLICIES:
+            raise errors.ConfigError("Unknown overrun policy : {0}".format(overrun_policy))
+        self._interval = interval
+        self._overrun_policy = overrun_policy
+        self._clock = clock
+        now = clock()
+        wall_now = wall_clock()
+        self._next = now + (offset - wall_now) % interval
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.late_ticks = 0
+
+    def next_tick(self):
+        """
+        Returns the next tick and the time to wait for it. Ticks which passed while the previous cycle
+        was running are handled according to the overrun policy.
+        :return: (Tick, seconds to wait)
+
+        """
+        now = self._clock()
+        if now < self._next:
+            tick = Tick(self._next)
+            self._next += self._interval
+            self.ticks += 1
+            return tick, self._next - self._interval - now
+        passed = int((now - self._next) // self._interval) + 1
+        last = self._next + (passed - 1) * self._interval
+        self._next = last + self._interval
+        if self._overrun_policy == 'skip':
+            self.missed_ticks += passed
+            self.ticks += 1
+            tick = Tick(self._next, missed=passed)
+            self._next += self._interval
+            return tick, tick.scheduled - now
+        # The latest passed tick runs now, the older ones are missed
+        self.missed_ticks += passed - 1
+        self.late_ticks += 1
+        self.ticks += 1
+        return Tick(last, late=True, shed=self._overrun_policy == 'shed', missed=passed - 1), 0
+
+    def wait(self, stop_signal):
+        """
+        Waits for the next tick.
+        :param stop_signal: threading.Event interrupting the wait
+        :return: Tick, None when stopped
+
+        """
+        tick, delay = self.next_tick()
+        if delay > 0:
+            stop_signal.wait(delay)
+        if stop_signal.is_set():
+            return None
+        return tick
+
+
+class TypeCadence(object):
+    """
+
+    Tracks which inventory types are due for collection. A type is collected once per
+    wall clock period of its collection interval, when a new sample of that interval can exist.
+
+    """
+    def __init__(self, intervals):
+        """
+        :param intervals: Mapping of inventory type to its collection interval in seconds, types without
+                          an interval are collected on every cycle
+
+        """
+        self._intervals = intervals
+        self._collected = {}
+
+    def _period(self, inventory_type, now):
+        interval = self._intervals.get(inventory_type)
+        if not interval:
+            return None
+        return int(now // interval)
+
+    def due(self, inventory_types, now):
+        """
+        Returns the inventory types which were not collected yet in the current period of their interval.
+        :param inventory_types: Inventory types, eg: vm
+        :param now: Wall clock time of the collection cycle
+        :return: list
+
+        """
+        return [inventory_type for inventory_type in inventory_types
+                if self._period(inventory_type, now) is None or
+                self._collected.get(inventory_type) != self._period(inventory_type, now)]
+
+    def collected(self, inventory_types, now):
+        """
+        Records that inventory types are collected in the current period of their interval.
+        :param inventory_types: Inventory types, eg: vm
+        :param now: Wall clock time of the collection cycle
+        :return: null
+
+        """
+        for inventory_type in inventory_types:
+            self._collected[inventory_type] = self._period(inventory_type, now)
@@ -0,0 +1,177 @@
+"""
+Module containing a class for keeping a pool of authenticated vCenter sessions, which logs
+sessions back in when they expire and lends them to the threads querying vCenter.
+"""
+
+import logging
+import queue
+import threading
+import time
+from pyVmomi import vim
+
+
+class SessionUnavailable(Exception):
+    pass
+
+
+class Session(object):
+    """
+
+    An authenticated connection to vCenter.
+
+    """
+    def __init__(self, index, si):
+        self.index = index
+        self.si = si
+        self.lock = threading.Lock()
+        # Incremented on each login, so that concurrent failures log in only once
+        self.generation = 0
+        self.last_used = time.time()
+        self.retry_at = 0
+        self.failures = 0
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.si.RetrieveServiceContent()
+        return self._content
+
+
+class SessionPool(object):
+    def __init__(self, connect, login, size, instance_id, backoff=1, max_backoff=60):
+        """
+        :param connect: Callable returning a new authenticated ServiceInstance, raising when it cannot connect
+        :param login: Callable logging a ServiceInstance back in on the same connection
+        :param size: Number of sessions, which bounds the number of concurrent queries
+        :param instance_id: Instance id for logging
+        :param backoff: Time to wait before retrying a failed login, doubled after each failure
+        :param max_backoff: Maximum time to wait before retrying a failed login
+
+        """
+        self._connect = connect
+        self._login = login
+        self._size = max(1, size)
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._logger = logging.getLogger("{0}-SP".format(instance_id))
+        self._sessions = []
+        self._idle = queue.Queue()
+
+    def start(self):
+        """
+        Connects the sessions of the pool. Only the first session is required, the pool runs with
+        fewer sessions when the others cannot be connected.
+        :return: null
+
+        """
+        for index in range(self._size):
+            try:
+                session = Session(index, self._connect())
+            except Exception as e:
+                if index == 0:
+                    raise
+                self._logger.warning("Unable to open vCenter session {0}, continuing with {1} sessions : {2}".format(
+                    index, index, e))
+                break
+            self._sessions.append(session)
+            self._idle.put(session)
+
+    @property
+    def primary(self):
+        """
+        Returns the ServiceInstance of the first session, shared with the inventory and metric managers.
+        :return: vim.ServiceInstance
+
+        """
+        return self._sessions[0].si if self._sessions else None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _relogin(self, session, generation):
+        """
+        Logs a session back in, unless it was logged in again since it failed or a retry is not due yet.
+        :param session: Session
+        :param generation: Generation of the session when it failed
+        :return: null
+
+        """
+        with session.lock:
+            if session.generation != generation:
+                return
+            if time.time() < session.retry_at:
+                raise SessionUnavailable("vCenter session {0} is waiting to log in again".format(session.index))
+            try:
+                self._login(session.si)
+            except Exception as e:
+                session.failures += 1
+                delay = min(self._backoff * 2 ** (session.failures - 1), self._max_backoff)
+                session.retry_at = time.time() + delay
+                self._logger.error("Unable to log in vCenter session {0}, retrying in {1} seconds : {2}".format(
+                    session.index, delay, e))
+                raise SessionUnavailable("Unable to log in vCenter session {0}".format(session.index))
+            session.failures = 0
+            session.retry_at = 0
+            session.generation += 1
+            self._logger.info("Logged in vCenter session {0} again".format(session.index))
+
+    def _call(self, session, func, *args):
+        """
+        Calls func with a session, logging the session back in and calling func again once when
+        the session is no longer authenticated.
+        """
+        for attempt in range(2):
+            generation = session.generation
+            try:
+                return func(session, *args)
+            except vim.fault.NotAuthenticated:
+                if attempt > 0:
+                    raise
+                self._logger.warning("vCenter session {0} is no longer authenticated".format(session.index))
+                self._relogin(session, generation)
+            finally:
+                session.last_used = time.time()
+
+    def run(self, func, *args):
+        """
+        Calls func with an idle session and the given arguments, waiting for a session to be idle.
+        :param func: Callable taking a Session and the arguments
+        :return: Result of func
+
+        """
+        session = self._idle.get()
+        try:
+            return self._call(session, func, *args)
+        finally:
+            self._idle.put(session)
+
+    def check(self, max_idle):
+        """
+        Checks the sessions idle for longer than max_idle and logs them back in when they expired.
+        :param max_idle: Idle time in seconds after which a session is checked
+        :return: Number of healthy sessions
+
+        """
+        healthy = 0
+        for session in list(self._sessions):
+            try:
+                if time.time() - session.last_used > max_idle or session.retry_at:
+                    self._call(session, lambda checked: checked.si.CurrentTime())
+                healthy += 1
+            except Exception as e:
+                self._logger.warning("vCenter session {0} is unhealthy : {1}".format(session.index, e))
+        return healthy
+
+    def close(self):
+        """
+        Logs out the sessions of the pool.
+        :return: null
+
+        """
+        for session in self._sessions:
+            try:
+                session.content.sessionManager.Logout()
+            except Exception as e:
+                self._logger.debug("Unable to log out vCenter session {0} : {1}".format(session.index, e))
+        self._sessions = []
@@ -0,0 +1,215 @@
+"""
+Module containing a class for keeping the payloads which could not be sent to ingest in
+append-only segment files on disk, until they are replayed.
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Segment(object):
+    """
+
+    A segment file of the spool, holding payload items as JSON lines in the order they were spooled.
+
+    """
+    __slots__ = ('path', 'created', 'size', 'datapoints')
+
+    def __init__(self, path, created, size=0, datapoints=0):
+        self.path = path
+        self.created = created
+        self.size = size
+        self.datapoints = datapoints
+
+
+class Spool(object):
+    SUFFIX = '.spool'
+
+    def __init__(self, directory, max_bytes, max_age, segment_bytes, instance_id):
+        """
+        Opens the spool in a directory, keeping the segments left by a previous run.
+        :param directory: Directory of the segment files
+        :param max_bytes: Maximum size of the spool, the oldest segments are dropped beyond it
+        :param max_age: Age in seconds after which a segment is dropped
+        :param segment_bytes: Size after which a new segment is started
+        :param instance_id: Instance id for logging
+
+        """
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._segment_bytes = segment_bytes
+        self._logger = logging.getLogger("{0}-SP".format(instance_id))
+        self._lock = threading.Lock()
+        self._segments = collections.deque()
+        self._active = None
+        self._active_file = None
+        # Segment returned by oldest, which the replay is reading until it is removed
+        self._replaying = None
+        self._sequence = 0
+        # Total size of the segments in bytes
+        self.bytes = 0
+        # Number of datapoints dropped because of the size and age limits
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(self.SUFFIX):
+                self._segments.append(self._load_segment(os.path.join(directory, name)))
+                self.bytes += self._segments[-1].size
+
+    def _read_items(self, path):
+        """
+        Reads the payload items of a segment file, skipping a line left incomplete by a crash.
+        :param path: Path of the segment file
+        :return: list of payload items
+
+        """
+        items = []
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    items.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    self._logger.warning("Skipping an invalid payload in spool segment {0}".format(path))
+        return items
+
+    def _load_segment(self, path):
+        datapoints = sum(self._count_datapoints(item) for item in self._read_items(path))
+        return Segment(path, os.path.getmtime(path), os.path.getsize(path), datapoints)
+
+    @staticmethod
+    def _count_datapoints(item):
+        return len(item['gauges']) + len(item['counters'])
+
+    def __len__(self):
+        """
+        Returns the number of datapoints in the spool.
+        :return: int
+
+        """
+        with self._lock:
+            return sum(segment.datapoints for segment in self._segments)
+
+    def _close_active(self):
+        if self._active_file is not None:
+            self._active_file.close()
+        self._active = None
+        self._active_file = None
+
+    def _start_segment(self):
+        self._close_active()
+        now = time.time()
+        # Names sort in the order the segments are started
+        self._sequence += 1
+        path = os.path.join(self._directory, "{0:020d}-{1:06d}{2}".format(int(now * 1000000), self._sequence,
+                                                                          self.SUFFIX))
+        self._active_file = open(path, 'ab')
+        self._active = Segment(path, now)
+        self._segments.append(self._active)
+
+    def _drop(self, segment):
+        if segment is self._active:
+            self._close_active()
+        self._segments.remove(segment)
+        self.bytes -= segment.size
+        try:
+            os.unlink(segment.path)
+        except OSError as e:
+            self._logger.warning("Unable to remove spool segment {0} : {1}".format(segment.path, e))
+
+    def _enforce_limits(self):
+        """
+        Drops the oldest segments beyond the size and age limits, except the one being replayed, whose
+        payloads would otherwise be counted as both dropped and replayed.
+        :return: null
+
+        """
+        expiry = time.time() - self._max_age
+        for segment in list(self._segments):
+            if segment is self._replaying:
+                continue
+            if self.bytes <= self._max_bytes and segment.created >= expiry:
+                break
+            self._drop(segment)
+            self.dropped += segment.datapoints
+            self._logger.warning("Dropped spool segment {0} of {1} datapoints".format(
+                segment.path, segment.datapoints))
+
+    def append(self, item):
+        """
+        Appends a payload item to the newest segment, dropping the oldest segments beyond the size and age limits.
+        :param item: dict with the 'gauges' and 'counters' of the payload
+        :return: null
+
+        """
+        line = (json.dumps(item, separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock:
+            if self._active is None or self._active.size >= self._segment_bytes:
+                self._start_segment()
+            self._active_file.write(line)
+            self._active_file.flush()
+            self._active.size += len(line)
+            self._active.datapoints += self._count_datapoints(item)
+            self.bytes += len(line)
+            self._enforce_limits()
+
+    def oldest(self):
+        """
+        Returns the oldest segment and its payload items. The newest segment is closed first when it is
+        the only one, so that new items go to a new segment. The segment is not dropped by the limits
+        until it is removed.
+        :return: (Segment, list of payload items), None when the spool is empty
+
+        """
+        with self._lock:
+            self._enforce_limits()
+            if not self._segments:
+                return None
+            segment = self._segments[0]
+            if segment is self._active:
+                self._close_active()
+            self._replaying = segment
+        return segment, self._read_items(segment.path)
+
+    def expired(self, segment):
+        """
+        Returns whether a segment is older than the age limit.
+        :param segment: Segment returned by oldest
+        :return: Boolean
+
+        """
+        return segment.created < time.time() - self._max_age
+
+    def remove(self, segment, dropped=0):
+        """
+        Removes a replayed segment.
+        :param segment: Segment returned by oldest
+        :param dropped: Number of datapoints of the segment which were not replayed, counted as dropped
+        :return: null
+
+        """
+        with self._lock:
+            if segment is self._replaying:
+                self._replaying = None
+            if segment in self._segments:
+                self._drop(segment)
+                self.dropped += dropped
+
+    def replay_lag(self):
+        """
+        Returns the age of the oldest segment, how far behind the replay is.
+        :return: seconds
+
+        """
+        with self._lock:
+            if not self._segments:
+                return 0
+            return time.time() - self._segments[0].created
+
+    def close(self):
+        with self._lock:
+            self._close_active()
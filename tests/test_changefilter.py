@@ -0,0 +1,41 @@
+import unittest
+
+import sys
+sys.path.append('../')
+from pyVmomi import vim
+import changefilter
+
+
+class FakeInventoryObject(object):
+    def __init__(self, mo_id):
+        self.mor = vim.VirtualMachine(mo_id)
+
+
+def _metric_id(counter_id, instance=''):
+    return vim.PerformanceManager.MetricId(counterId=counter_id, instance=instance)
+
+
+class ChangeFilterTests(unittest.TestCase):
+
+    def test_unchanged_values_with_heartbeat(self):
+        change_filter = changefilter.ChangeFilter(heartbeat=3)
+        vm = FakeInventoryObject('vm-1')
+        sent = []
+        for value in (5, 5, 5, 5, 6, 6, 5):
+            last_values = change_filter.series(vm)
+            sent.append(change_filter.is_changed(last_values, _metric_id(1), value))
+        self.assertEqual([True, False, False, True, True, False, True], sent)
+        # Instances are separate series
+        self.assertTrue(change_filter.is_changed(change_filter.series(vm), _metric_id(1, 'vmnic0'), 5))
+
+    def test_replaced_and_removed_objects(self):
+        change_filter = changefilter.ChangeFilter(heartbeat=10)
+        vms = [FakeInventoryObject('vm-1'), FakeInventoryObject('vm-2')]
+        for vm in vms:
+            change_filter.is_changed(change_filter.series(vm), _metric_id(1), 5)
+        self.assertFalse(change_filter.is_changed(change_filter.series(vms[0]), _metric_id(1), 5))
+        # A replaced inventory object may have other dimensions, its series are sent again
+        vms[0] = FakeInventoryObject('vm-1')
+        self.assertTrue(change_filter.is_changed(change_filter.series(vms[0]), _metric_id(1), 5))
+        change_filter.prune({'vm': vms[:1]})
+        self.assertEqual(1, len(change_filter))
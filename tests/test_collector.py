@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+
+import sys
+sys.path.append('../')
+import collector
+import errors
+
+
+class FakeEnvironment(object):
+    def __init__(self, name, delay=0.0):
+        self._name = name
+        self._delay = delay
+        self.reads = 0
+
+    def get_instance_id(self):
+        return self._name
+
+    def read_metric_values(self, shed=False, missed_ticks=0, late=False):
+        self.reads += 1
+        time.sleep(self._delay)
+
+
+class CollectorTests(unittest.TestCase):
+
+    def test_slow_environment_does_not_delay_others(self):
+        slow_env = FakeEnvironment('SlowVcenter', delay=0.5)
+        fast_env = FakeEnvironment('FastVcenter')
+        slow_worker = collector.CollectionWorker(slow_env, interval=0.05)
+        fast_worker = collector.CollectionWorker(fast_env, interval=0.05)
+        slow_worker.start()
+        fast_worker.start()
+        time.sleep(0.4)
+        slow_worker.stop()
+        fast_worker.stop()
+        slow_worker.join(timeout=5)
+        fast_worker.join(timeout=5)
+        self.assertEqual(1, slow_env.reads)
+        self.assertGreater(fast_env.reads, 4)
+        self.assertEqual(1, slow_worker.overruns)
+        self.assertEqual(0, fast_worker.overruns)
+
+    def test_failing_environment_keeps_collecting(self):
+        env = FakeEnvironment('FailingVcenter')
+        failures = threading.Event()
+
+        def read_metric_values(shed=False, missed_ticks=0, late=False):
+            env.reads += 1
+            failures.set()
+            raise RuntimeError("vCenter is down")
+        env.read_metric_values = read_metric_values
+        worker = collector.CollectionWorker(env, interval=0.01)
+        worker.start()
+        failures.wait(timeout=5)
+        time.sleep(0.1)
+        worker.stop()
+        worker.join(timeout=5)
+        self.assertGreater(env.reads, 1)
+
+    def test_invalid_settings_are_not_retried(self):
+        attempts = []
+
+        def create_env():
+            attempts.append(time.time())
+            raise errors.ConfigError("Shard index 5 is not within the 2 shards")
+        worker = collector.CollectionWorker(None, 0.05, env_factory=create_env, instance_id='InvalidVcenter',
+                                            startup_retry=0.01)
+        worker.start()
+        worker.join(timeout=5)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(1, len(attempts))
+        self.assertIsNone(worker.env)
+
+    def test_other_value_errors_are_retried(self):
+        attempts = []
+        env = FakeEnvironment('IngestVcenter')
+
+        def create_env():
+            attempts.append(time.time())
+            if len(attempts) == 1:
+                raise ValueError("Unable to create ingest client")
+            return env
+        worker = collector.CollectionWorker(None, 0.05, env_factory=create_env, instance_id='IngestVcenter',
+                                            startup_retry=0.01)
+        worker.start()
+        time.sleep(0.2)
+        worker.stop()
+        worker.join(timeout=5)
+        self.assertEqual(2, len(attempts))
+        self.assertIs(env, worker.env)
+
+    def test_environments_start_concurrently(self):
+        attempts = []
+        env = FakeEnvironment('StartingVcenter')
+
+        def create_env():
+            attempts.append(time.time())
+            if len(attempts) == 1:
+                raise RuntimeError("vCenter is unreachable")
+            return env
+
+        def create_slow_env():
+            time.sleep(1)
+            return FakeEnvironment('SlowVcenter')
+        worker = collector.CollectionWorker(None, 0.05, env_factory=create_env, instance_id='StartingVcenter',
+                                            startup_retry=0.05)
+        slow_worker = collector.CollectionWorker(None, 0.05, env_factory=create_slow_env, instance_id='SlowVcenter')
+        slow_worker.start()
+        worker.start()
+        time.sleep(0.5)
+        self.assertIs(env, worker.env)
+        self.assertEqual(2, len(attempts))
+        self.assertLess(worker.startup_duration, 0.5)
+        self.assertGreater(env.reads, 2)
+        self.assertIsNone(slow_worker.env)
+        for collection_worker in (worker, slow_worker):
+            collection_worker.stop()
+            collection_worker.join(timeout=5)
+        self.assertEqual(0, worker.missed_ticks)
@@ -0,0 +1,61 @@
+import unittest
+
+import sys
+sys.path.append('../')
+import datapoints
+import metric_metadata
+import payload
+
+
+class DatapointsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.usage = metric_metadata.MetricInfo('cpu.usage.average', 1, 'gauge', 'percent')
+        self.ready = metric_metadata.MetricInfo('cpu.ready.summation', 1, 'counter', 'millisecond')
+        self.dimension_set = payload.DimensionSet({'vc_name': 'TestVcenter', 'vm': 'vm-1'})
+
+    def test_normalize_percent(self):
+        batch = datapoints.DatapointBatch(1516696283000)
+        batch.append(self.usage, 2550, self.dimension_set)
+        batch.append(self.ready, 40, self.dimension_set)
+        batch.append(self.usage, 1000.5, self.dimension_set)
+        batch.normalize()
+        batch.normalize()
+        self.assertEqual([25.5, 40, 10.005], [row[1] for row in batch.rows()])
+        self.assertEqual(bytearray([1, 0, 1]), batch.float_rows)
+        self.assertEqual(3, len(batch))
+
+    def test_row_timestamps(self):
+        batch = datapoints.DatapointBatch(1516696283000)
+        batch.append(self.ready, 40, self.dimension_set)
+        self.assertIsNone(batch.timestamps)
+        batch.append(self.ready, 60, self.dimension_set, 1516696263000)
+        batch.append(self.ready, 80, self.dimension_set)
+        self.assertEqual([1516696283000, 1516696263000, 1516696283000],
+                         [row[3] for row in batch.rows()])
+
+    def test_payload_from_batch(self):
+        batch = datapoints.DatapointBatch(1516696283000)
+        batch.append(self.usage, 5000, self.dimension_set)
+        batch.append(self.ready, 40, self.dimension_set)
+        batch.normalize()
+        items = []
+        payload_builder = payload.PayloadBuilder(100, 0, items.extend)
+        payload_builder.add_batch(batch)
+        payload_builder.flush()
+        self.assertEqual([{'metric': 'cpu.usage.average', 'value': 50.0, 'dimensions': self.dimension_set.dimensions,
+                           'timestamp': 1516696283000}], items[0]['gauges'])
+        self.assertEqual('cpu.ready.summation', items[0]['counters'][0]['metric'])
+
+    def test_integer_values(self):
+        batch = datapoints.DatapointBatch(1516696283000)
+        batch.append(self.ready, 2 ** 60 + 1, self.dimension_set)
+        batch.append(self.ready, 1.5, self.dimension_set)
+        batch.normalize()
+        items = []
+        payload_builder = payload.PayloadBuilder(100, 0, items.extend)
+        payload_builder.add_batch(batch)
+        payload_builder.flush()
+        values = [dp['value'] for dp in items[0]['counters']]
+        self.assertEqual([2 ** 60 + 1, 1.5], values)
+        self.assertIsInstance(values[0], int)
@@ -0,0 +1,206 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import sys
+sys.path.append('../')
+import dispatcher
+import errors
+import spool
+
+
+class FakeIngest(object):
+    def __init__(self, failures=0, release=None):
+        self._failures = failures
+        self._release = release
+        self._errors = {}
+        self.sent = []
+
+    def send(self, gauges=None, counters=None):
+        if self._release is not None:
+            self._release.wait(timeout=5)
+        if self._failures > 0:
+            self._failures -= 1
+            self._errors = {'ConnectionError': 1}
+        else:
+            self.sent.extend(gauges + counters)
+
+    def stop(self):
+        pass
+
+    def reset_error_counters(self):
+        errors, self._errors = self._errors, {}
+        return errors
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _ingest_server(status):
+    server = HTTPServer(('127.0.0.1', 0), StatusHandler)
+    server.status = status
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def _dispatcher_conf(**kwargs):
+    conf = {
+        'queue_size': 10,
+        'workers': 1,
+        'policy': 'drop',
+        'retries': 2,
+        'retry_backoff': 0,
+        'replay_rate': 1000,
+    }
+    conf.update(kwargs)
+    return conf
+
+
+def _item(dp_count):
+    return {'gauges': [{'metric': 'cpu.usage.average', 'value': 1}] * dp_count, 'counters': []}
+
+
+class DispatcherTests(unittest.TestCase):
+
+    def test_send_with_retries(self):
+        ingest = FakeIngest(failures=2)
+        ingest_dispatcher = dispatcher.IngestDispatcher(lambda: ingest, 'VCenterInstance', _dispatcher_conf())
+        ingest_dispatcher.start()
+        self.assertTrue(ingest_dispatcher.enqueue(_item(3)))
+        ingest_dispatcher.stop(timeout=5)
+        stats = ingest_dispatcher.get_stats()
+        self.assertEqual(3, len(ingest.sent))
+        self.assertEqual(3, stats['queued'])
+        self.assertEqual(3, stats['sent'])
+        self.assertEqual(2, stats['retried'])
+        self.assertEqual(0, stats['dropped'])
+
+    def test_drop_after_retries(self):
+        ingest = FakeIngest(failures=3)
+        ingest_dispatcher = dispatcher.IngestDispatcher(lambda: ingest, 'VCenterInstance', _dispatcher_conf())
+        ingest_dispatcher.start()
+        ingest_dispatcher.enqueue(_item(2))
+        ingest_dispatcher.stop(timeout=5)
+        stats = ingest_dispatcher.get_stats()
+        self.assertEqual(0, stats['sent'])
+        self.assertEqual(2, stats['dropped'])
+
+    def test_drop_when_queue_is_full(self):
+        release = threading.Event()
+        ingest = FakeIngest(release=release)
+        ingest_dispatcher = dispatcher.IngestDispatcher(lambda: ingest, 'VCenterInstance',
+                                                        _dispatcher_conf(queue_size=1))
+        results = [ingest_dispatcher.enqueue(_item(1)) for x in range(3)]
+        self.assertEqual([True, False, False], results)
+        ingest_dispatcher.start()
+        release.set()
+        ingest_dispatcher.stop(timeout=5)
+        stats = ingest_dispatcher.get_stats()
+        self.assertEqual(1, stats['sent'])
+        self.assertEqual(2, stats['dropped'])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(errors.ConfigError):
+            dispatcher.IngestDispatcher(FakeIngest, 'VCenterInstance', _dispatcher_conf(policy='spill'))
+
+    def test_ingest_client_failure(self):
+        with self.assertRaises(ValueError):
+            dispatcher.IngestDispatcher(lambda: None, 'VCenterInstance', _dispatcher_conf())
+
+    def test_spool_and_replay(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        payload_spool = spool.Spool(directory, 1024 * 1024, 3600, 1024, 'VCenterInstance')
+        ingest = FakeIngest(failures=3)
+        replay_ingest = FakeIngest(failures=1)
+        clients = [ingest, replay_ingest]
+        ingest_dispatcher = dispatcher.IngestDispatcher(lambda: clients.pop(0), 'VCenterInstance',
+                                                        _dispatcher_conf(retry_backoff=0.01), spool=payload_spool)
+        ingest_dispatcher.start()
+        self.assertTrue(ingest_dispatcher.enqueue(_item(3)))
+        self.assertTrue(ingest_dispatcher.enqueue(_item(2)))
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            stats = ingest_dispatcher.get_stats()
+            if stats['replayed'] == 3 and stats['spool_bytes'] == 0:
+                break
+            time.sleep(0.01)
+        ingest_dispatcher.stop(timeout=5)
+        stats = ingest_dispatcher.get_stats()
+        self.assertEqual(2, len(ingest.sent))
+        self.assertEqual(3, len(replay_ingest.sent))
+        self.assertEqual(3, stats['spooled'])
+        self.assertEqual(3, stats['replayed'])
+        self.assertEqual(0, stats['dropped'])
+        self.assertEqual(0, stats['spool_bytes'])
+
+    def test_replay_gives_up_expired_segment(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        payload_spool = spool.Spool(directory, 1024 * 1024, 1.5, 1, 'VCenterInstance')
+        payload_spool.append(_item(2))
+        # Replays are retried every second, the third one fails past the age limit
+        replay_ingest = FakeIngest(failures=3)
+        clients = [FakeIngest(), replay_ingest]
+        ingest_dispatcher = dispatcher.IngestDispatcher(lambda: clients.pop(0), 'VCenterInstance',
+                                                        _dispatcher_conf(), spool=payload_spool)
+        ingest_dispatcher.start()
+        self.addCleanup(ingest_dispatcher.stop, 5)
+        deadline = time.time() + 10
+        while time.time() < deadline and ingest_dispatcher.get_stats()['dropped'] < 2:
+            time.sleep(0.01)
+        stats = ingest_dispatcher.get_stats()
+        self.assertEqual(2, stats['dropped'])
+        self.assertEqual(0, stats['replayed'])
+        self.assertEqual(0, stats['spool_bytes'])
+        # A newer segment is replayed once the expired one is given up
+        payload_spool.append(_item(1))
+        while time.time() < deadline and ingest_dispatcher.get_stats()['replayed'] < 1:
+            time.sleep(0.01)
+        stats = ingest_dispatcher.get_stats()
+        self.assertEqual(1, stats['replayed'])
+        self.assertEqual(1, len(replay_ingest.sent))
+        self.assertEqual(2, stats['dropped'])
+
+    def test_http_error_status(self):
+        server = _ingest_server(503)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        endpoint = 'http://127.0.0.1:{0}'.format(server.server_port)
+        ingest_dispatcher = dispatcher.IngestDispatcher(
+            lambda: dispatcher.JsonIngestClient('token', endpoint=endpoint, timeout=5), 'VCenterInstance',
+            _dispatcher_conf())
+        ingest_dispatcher.start()
+        ingest_dispatcher.enqueue(_item(2))
+        ingest_dispatcher.stop(timeout=5)
+        stats = ingest_dispatcher.get_stats()
+        self.assertEqual(3, server.requests)
+        self.assertEqual(0, stats['sent'])
+        self.assertEqual(2, stats['retried'])
+        self.assertEqual(2, stats['dropped'])
+        server.status = 200
+        ingest_dispatcher = dispatcher.IngestDispatcher(
+            lambda: dispatcher.JsonIngestClient('token', endpoint=endpoint, timeout=5), 'VCenterInstance',
+            _dispatcher_conf())
+        ingest_dispatcher.start()
+        ingest_dispatcher.enqueue(_item(2))
+        ingest_dispatcher.stop(timeout=5)
+        stats = ingest_dispatcher.get_stats()
+        self.assertEqual(4, server.requests)
+        self.assertEqual(2, stats['sent'])
+        self.assertEqual(0, stats['retried'])
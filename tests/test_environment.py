@@ -0,0 +1,285 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import sys
+sys.path.append('../')
+from pyVmomi import vim
+from benchmarks import simulator
+import environment
+import errors
+import inventory
+import metric_metadata
+import queryplan
+import warmstart
+
+
+class FakeInventoryObject(object):
+    INSTANT_INTERVAL = 20
+
+    def __init__(self, mo_id, counter_ids):
+        self.mor = vim.VirtualMachine(mo_id)
+        self.metric_id_map = dict((counter_id, vim.PerformanceManager.MetricId(counterId=counter_id, instance=''))
+                                  for counter_id in counter_ids)
+        self.available_instances = {}
+
+
+def _batching_env(query_batch_size, query_metric_batch_size):
+    # Only the batching settings are used, no vCenter is connected
+    env = environment.Environment.__new__(environment.Environment)
+    env._query_batch_size = query_batch_size
+    env._query_metric_batch_size = query_metric_batch_size
+    env._query_planner = queryplan.QueryPlanner(query_metric_batch_size)
+    env._catch_up = False
+    return env
+
+
+class RecordingEnvironment(simulator.SimulatedEnvironment):
+    def __init__(self, config, sim):
+        self.items = []
+        simulator.SimulatedEnvironment.__init__(self, config, sim)
+
+    def _dispatch_metrics(self, payload):
+        self.items.extend(payload)
+
+    def datapoints(self, metric_name):
+        return [dp for item in self.items for dp in item['gauges'] + item['counters'] if dp['metric'] == metric_name]
+
+
+class EnvironmentTests(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = simulator.Simulator(simulator.Topology(hosts=1, vms=2, instances=0))
+        self.config = {
+            'host': 'simulator', 'username': 'user', 'password': 'password', 'Name': 'TestVcenter',
+            'IngestToken': 'token', 'IngestEndpoint': 'http://localhost', 'IngestTimeout': 10,
+            'MORSyncMode': 'collector', 'SelfMetrics': False,
+        }
+
+    def _env(self, **config):
+        env = RecordingEnvironment(dict(self.config, **config), self.simulator)
+        self.addCleanup(env.stop_managers)
+        return env
+
+    def test_latest_sample(self):
+        env = self._env()
+        env.read_metric_values()
+        dps = env.datapoints('cpu.usage.average')
+        self.assertEqual(2, len(dps))
+        self.assertEqual(0, dps[0]['timestamp'] % 1000)
+
+    def test_tick_self_metrics(self):
+        env = self._env(SelfMetrics=True)
+        env.read_metric_values(missed_ticks=2, late=True)
+        env.read_metric_values()
+        self.assertEqual([2, 0], [dp['value'] for dp in env.datapoints('vsphere.collector.ticks.missed')])
+        self.assertEqual([1, 0], [dp['value'] for dp in env.datapoints('vsphere.collector.ticks.late')])
+
+    def test_instance_policies(self):
+        self.simulator = simulator.Simulator(simulator.Topology(hosts=1, vms=2, instances=4))
+        env = self._env(CollectionIntervals={'host': 0, 'vm': 0}, InstancePolicies={
+            'cpu.usage.average': {'top': 2}, 'cpu.utilization.average': 'aggregate',
+            'net.usage.average': {'exclude': '^vmnic[1-3]$'},
+        })
+        env.read_metric_values()
+        # The aggregated value and the two highest cores of each VM
+        dps = env.datapoints('cpu.usage.average')
+        self.assertEqual(6, len(dps))
+        self.assertEqual(2, len([dp for dp in dps if 'instance' not in dp['dimensions']]))
+        self.assertEqual(1, len(env.datapoints('cpu.utilization.average')))
+        self.assertEqual(set(['vmnic0']), set(dp['dimensions'].get('instance') for dp in env.datapoints(
+            'net.usage.average') if dp['dimensions'].get('instance')))
+
+    def _collected(self, env):
+        return sorted((dp['metric'], sorted(dp['dimensions'].items()), dp['value'])
+                      for item in env.items for dp in item['gauges'] + item['counters'])
+
+    def test_batched_collection(self):
+        self.simulator = simulator.Simulator(simulator.Topology(hosts=2, vms=3, instances=0))
+        self.simulator.clock = lambda: 1000000
+        collected = []
+        calls = []
+        for batch_config in ({'QueryBatchSize': 1}, {'QueryBatchSize': 50},
+                             {'QueryBatchSize': 50, 'QueryMetricBatchSize': 10}):
+            self.simulator.calls.clear()
+            env = self._env(CollectionIntervals={'host': 0, 'vm': 0}, **batch_config)
+            env.read_metric_values()
+            collected.append(self._collected(env))
+            calls.append(self.simulator.calls['QueryPerf'])
+        # Every entity is queried on its own, all in one call, or split by the metric limit
+        self.assertEqual(8, calls[0])
+        self.assertEqual(1, calls[1])
+        self.assertGreater(calls[2], 8)
+        self.assertTrue(collected[0])
+        self.assertEqual(collected[0], collected[1])
+        self.assertEqual(collected[0], collected[2])
+        # An entity without results leaves the others of its batch unchanged
+        self.simulator.no_data.add('vm-1')
+        env = self._env(CollectionIntervals={'host': 0, 'vm': 0}, QueryBatchSize=50)
+        env.read_metric_values()
+        self.assertEqual([dp for dp in collected[0] if ('vm', 'vm1') not in dp[1]], self._collected(env))
+        self.assertLess(len(self._collected(env)), len(collected[0]))
+
+    def test_collection_intervals(self):
+        env = self._env(CollectionIntervals={'host': 0, 'vm': 3600})
+        env.read_metric_values()
+        env.read_metric_values()
+        # The host is collected on both cycles, the two VMs only on the first
+        self.assertEqual(2, len(env.datapoints('cpu.utilization.average')))
+        self.assertEqual(2, len(env.datapoints('cpu.usage.average')))
+
+    def test_parallel_sessions(self):
+        env = self._env(QuerySessions=2, QueryBatchSize=1)
+        self.assertEqual(2, len(env._session_pool))
+        env.read_metric_values()
+        self.assertEqual(2, len(env.datapoints('cpu.usage.average')))
+        self.assertEqual(1, len(env.datapoints('cpu.utilization.average')))
+
+    def test_relogin_expired_session(self):
+        env = self._env(CollectionIntervals={'host': 0, 'vm': 0})
+        env.read_metric_values()
+        self.simulator.expire_sessions()
+        env.items = []
+        env.read_metric_values()
+        self.assertEqual(1, self.simulator.calls['Login'])
+        self.assertEqual(2, len(env.datapoints('cpu.usage.average')))
+
+    def test_failed_setup_releases_resources(self):
+        threads = set(threading.enumerate())
+        # An invalid configuration is found before connecting
+        self.assertRaises(errors.ConfigError, RecordingEnvironment,
+                          dict(self.config, ShardCount=2, ShardIndex=5, QuerySessions=3), self.simulator)
+        self.assertEqual(0, sum(self.simulator.calls.values()))
+        self.assertEqual(set(), set(threading.enumerate()) - threads)
+        # A setup failing after connecting logs its sessions out and stops its threads
+        self.simulator = simulator.Simulator(simulator.Topology(hosts=1, vms=2, instances=0),
+                                             latency={'RetrievePropertiesEx': 0.5})
+        self.assertRaises(RuntimeError, RecordingEnvironment,
+                          dict(self.config, MORSyncTimeout=0.1, QuerySessions=3), self.simulator)
+        self.assertEqual(3, self.simulator.calls['Logout'])
+        self.assertEqual(set(), set(threading.enumerate()) - threads)
+
+    def test_shards(self):
+        self.simulator = simulator.Simulator(simulator.Topology(hosts=4, vms=10, instances=0))
+        shards = []
+        for shard_index in range(3):
+            config = dict(self.config, ShardCount=3, ShardIndex=shard_index)
+            env = self._env(**config)
+            env._inventory_mgr.block_until_inventory(timeout=5)
+            inv_objs = env._inventory_mgr.current_inventory()
+            shards.append(set(inv_obj.mor._GetMoId() for objs in inv_objs.values() for inv_obj in objs))
+        self.assertEqual(set(), shards[0] & shards[1])
+        self.assertEqual(set(), shards[1] & shards[2])
+        self.assertEqual(1 + 1 + 4 + 40, sum(len(shard) for shard in shards))
+
+    def test_warm_start(self):
+        temp_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_directory)
+        directory = os.path.join(temp_directory, 'warmstart')
+        env = self._env(WarmStartCacheDir=directory)
+        env.read_metric_values()
+        env.stop_managers()
+        state = warmstart.WarmStartCache(directory, 'TestVcenter', 'test', 60).load()
+        self.assertEqual(2, len(state['inventory']['vm']))
+        self.assertIn('vm', state['metrics'])
+
+        queries = self.simulator.calls['QueryAvailablePerfMetric']
+        inventory_mgr = inventory.InventoryManager(self.simulator.service_instance(), 300, 'TestVcenter', 'test',
+                                                   inventory_conf={'sync_mode': 'collector'})
+        inventory_mgr.restore(state['inventory'])
+        self.assertEqual(queries, self.simulator.calls['QueryAvailablePerfMetric'])
+        self.assertTrue(inventory_mgr.block_until_inventory(0))
+        restored = inventory_mgr.current_inventory()
+        current = env._inventory_mgr.current_inventory()
+        self.assertEqual([vm.dimension_set.dimensions for vm in current['vm']],
+                         [vm.dimension_set.dimensions for vm in restored['vm']])
+        self.assertEqual(set(current['vm'][0].metric_id_map), set(restored['vm'][0].metric_id_map))
+        # The next sync finds the available metrics in the cache
+        inventory_mgr.sync_inventory()
+        self.assertEqual(queries, self.simulator.calls['QueryAvailablePerfMetric'])
+
+        env = self._env(WarmStartCacheDir=directory)
+        env.read_metric_values()
+        self.assertEqual(2, len(env.datapoints('cpu.usage.average')))
+
+        # The state of a shard is not restored once the number of shards changes
+        env.stop_managers()
+        for shard_count in (2, 3):
+            env = self._env(WarmStartCacheDir=directory, ShardCount=shard_count, ShardIndex=1)
+            env.stop_managers()
+        self.assertEqual(['TestVcenter-1of2.warmstart', 'TestVcenter-1of3.warmstart', 'TestVcenter.warmstart'],
+                         sorted(os.listdir(directory)))
+
+    def test_catch_up_samples(self):
+        now = time.time()
+        self.simulator.clock = lambda: now
+        # Collect on every cycle instead of once per 20 seconds
+        env = self._env(CatchUpSamples=True, CatchUpWindow=120, CollectionIntervals={'host': 0, 'vm': 0})
+        env.read_metric_values()
+        dps = env.datapoints('cpu.usage.average')
+        self.assertEqual(2, len(dps))
+        self.assertEqual(0, dps[0]['timestamp'] % 20000)
+        # No sample was added since the last collected one
+        env.items = []
+        with self.assertLogs(env._logger, 'DEBUG') as logs:
+            env._logger.debug("Collecting without new samples")
+            env.read_metric_values()
+        self.assertEqual([], [record for record in logs.records if record.levelname == 'ERROR'])
+        self.assertEqual([], env.datapoints('cpu.usage.average'))
+        # Three samples were missed since the last collected one
+        for mo_id in list(env._watermarks):
+            env._watermarks[mo_id] -= datetime.timedelta(seconds=60)
+        env.items = []
+        env.read_metric_values()
+        timestamps = sorted(set(dp['timestamp'] for dp in env.datapoints('cpu.usage.average')))
+        self.assertEqual(3, len(timestamps))
+        self.assertEqual([20000, 20000], [timestamps[1] - timestamps[0], timestamps[2] - timestamps[1]])
+        self.assertEqual(6, len(env.datapoints('cpu.usage.average')))
+        # Samples older than the catch up window are not queried
+        for mo_id in list(env._watermarks):
+            env._watermarks[mo_id] -= datetime.timedelta(seconds=600)
+        env.items = []
+        env.read_metric_values()
+        self.assertEqual(12, len(env.datapoints('cpu.usage.average')))
+
+    def _query_specs(self, env, metric_counts):
+        inv_objs = [FakeInventoryObject('vm-{0}'.format(index), range(1, count + 1))
+                    for index, count in enumerate(metric_counts)]
+        metrics = dict((counter_id, metric_metadata.MetricInfo('metric{0}'.format(counter_id), 1, 'gauge', 'number'))
+                       for counter_id in range(1, 11))
+        monitored_metrics = {'vm': metrics}
+        return env._build_query_specs({'vm': inv_objs}, monitored_metrics)
+
+    def test_metric_batches(self):
+        env = _batching_env(50, 4)
+        query_specs = self._query_specs(env, [10, 3, 0])
+        # The metric ids of an entity are split by the metric limit, entities without metrics are not queried
+        self.assertEqual([('vm-0', 4), ('vm-0', 4), ('vm-0', 2), ('vm-1', 3)],
+                         [(query_spec.entity._GetMoId(), len(query_spec.metricId))
+                          for inv_obj, metrics, query_spec in query_specs])
+        self.assertEqual(set(range(1, 11)), set(metric_id.counterId for inv_obj, metrics, query_spec
+                                                in query_specs[:3] for metric_id in query_spec.metricId))
+        self.assertTrue(all(query_spec.entity is inv_obj.mor for inv_obj, metrics, query_spec in query_specs))
+
+    def test_query_batches(self):
+        # One entity per call by default
+        env = _batching_env(1, 0)
+        batches = list(env._batch_query_specs(self._query_specs(env, [10, 3, 5])))
+        self.assertEqual([['vm-0'], ['vm-1'], ['vm-2']],
+                         [[item[2].entity._GetMoId() for item in batch] for batch in batches])
+        # Bounded by the number of entities
+        env = _batching_env(2, 0)
+        batches = list(env._batch_query_specs(self._query_specs(env, [10, 3, 5])))
+        self.assertEqual([['vm-0', 'vm-1'], ['vm-2']],
+                         [[item[2].entity._GetMoId() for item in batch] for batch in batches])
+        # Bounded by the number of metric ids, a spec never exceeds it
+        env = _batching_env(50, 6)
+        batches = list(env._batch_query_specs(self._query_specs(env, [10, 3, 5])))
+        self.assertEqual([[6], [4], [3], [5]], [[len(item[2].metricId) for item in batch] for batch in batches])
+        env = _batching_env(50, 8)
+        batches = list(env._batch_query_specs(self._query_specs(env, [10, 3, 5])))
+        self.assertEqual([[8], [2, 3], [5]], [[len(item[2].metricId) for item in batch] for batch in batches])
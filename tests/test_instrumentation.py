@@ -0,0 +1,40 @@
+import unittest
+
+import sys
+sys.path.append('../')
+import instrumentation
+import payload
+
+
+class InstrumentationTests(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = instrumentation.Histogram()
+        self.assertIsNone(histogram.snapshot())
+        for value in range(1, 101):
+            histogram.update(value)
+        stats = histogram.snapshot()
+        self.assertEqual({'count': 100, 'min': 1, 'mean': 50.5, 'p50': 50, 'p99': 99, 'max': 100}, stats)
+        self.assertIsNone(histogram.snapshot())
+
+    def test_report(self):
+        self_metrics = instrumentation.SelfMetrics({'vc_name': 'TestVcenter'})
+        self_metrics.increment('entities.queried', 2, 'vm')
+        self_metrics.increment('entities.queried', 3, 'vm')
+        self_metrics.set_gauge('cycle.duration', 1.5)
+        self_metrics.histogram('queryperf.latency').update(0.25)
+        items = []
+        payload_builder = payload.PayloadBuilder(100, 0, items.extend)
+        self_metrics.report(payload_builder, 1516696283000)
+        self_metrics.report(payload_builder, 1516696303000)
+        payload_builder.flush()
+        counters = dict((dp['metric'], dp) for dp in items[0]['counters'])
+        gauges = [(dp['metric'], dp['value'], dp['timestamp']) for dp in items[0]['gauges']]
+        self.assertEqual(['vsphere.collector.entities.queried', 'vsphere.collector.queryperf.latency.count'],
+                         sorted(counters))
+        self.assertEqual(5, counters['vsphere.collector.entities.queried']['value'])
+        self.assertEqual({'vc_name': 'TestVcenter', 'object_type': 'vm'},
+                         counters['vsphere.collector.entities.queried']['dimensions'])
+        self.assertIn(('vsphere.collector.queryperf.latency.p99', 0.25, 1516696283000), gauges)
+        self.assertIn(('vsphere.collector.cycle.duration', 1.5, 1516696303000), gauges)
+        self.assertEqual(7, len(gauges))
@@ -3,12 +3,57 @@ from utils import VCRTestBase
 import utils
 
 from pyVim import connect
+from pyVmomi import vim, vmodl
 
 import sys
 sys.path.insert(0, '../')
+from benchmarks import simulator
 import inventory
 
 
+class FakePerfManager(object):
+    def QueryAvailablePerfMetric(self, entity, begin_time, end_time, interval_id):
+        return [vim.PerformanceManager.MetricId(counterId=2, instance='')]
+
+
+class FakeServiceContent(object):
+    def __init__(self):
+        self.perfManager = FakePerfManager()
+
+
+class FakeServiceInstance(object):
+    def RetrieveServiceContent(self):
+        return FakeServiceContent()
+
+
+class FakePropertyCollector(object):
+    def __init__(self):
+        self.update_sets = []
+        self.versions = []
+
+    def WaitForUpdatesEx(self, version, options):
+        self.versions.append(version)
+        if not self.update_sets:
+            return None
+        return self.update_sets.pop(0)
+
+
+def _update_set(version, object_updates, truncated=False):
+    filter_update = vmodl.query.PropertyCollector.FilterUpdate(objectSet=object_updates)
+    return vmodl.query.PropertyCollector.UpdateSet(version=version, filterSet=[filter_update], truncated=truncated)
+
+
+def _object_update(kind, mor, props=None):
+    change_set = [vmodl.query.PropertyCollector.Change(name=name, op='assign', val=value)
+                  for name, value in (props or {}).items()]
+    return vmodl.query.PropertyCollector.ObjectUpdate(kind=kind, obj=mor, changeSet=change_set)
+
+
+def _simulated_inventory_mgr(sim, sync_mode, **inventory_conf):
+    return inventory.InventoryManager(sim.service_instance(), 300, 'TestVcenter', 'VCenterInstance',
+                                      inventory_conf=dict(inventory_conf, sync_mode=sync_mode))
+
+
 class InventoryTests(VCRTestBase):
 
     @VCRTestBase.my_vcr.use_cassette('test_inventory_run.yaml',
@@ -51,3 +96,152 @@ class InventoryTests(VCRTestBase):
         self.assertEqual(1, len(current_inventory['cluster']))
         self.assertEqual(2, len(current_inventory['host']))
         self.assertEqual(2, len(current_inventory['vm']))
+
+    def test_incremental_updates(self):
+        inventory_mgr = inventory.InventoryManager(FakeServiceInstance(), 300, 'TestVcenter', 'VCenterInstance',
+                                                   inventory_conf={'sync_mode': 'incremental'})
+        collector = FakePropertyCollector()
+        inventory_mgr._collector = collector
+        root_folder = vim.Folder('group-d1')
+        datacenter = vim.Datacenter('datacenter-2')
+        host_folder = vim.Folder('group-h4')
+        cluster = vim.ClusterComputeResource('domain-c7')
+        host = vim.HostSystem('host-9')
+        vm_props = {'runtime.host': host, 'runtime.powerState': 'poweredOn', 'config.guestFullName': 'Linux'}
+        # The first updates are the whole inventory, returned in two pages
+        collector.update_sets = [
+            _update_set('1', [_object_update('enter', root_folder),
+                              _object_update('enter', datacenter, {'name': 'Datacenter1', 'parent': root_folder}),
+                              _object_update('enter', host_folder, {'parent': datacenter}),
+                              _object_update('enter', cluster, {'name': 'Cluster1', 'parent': host_folder}),
+                              _object_update('enter', host, {'name': 'host1', 'parent': cluster})], truncated=True),
+            _update_set('2', [_object_update('enter', vim.VirtualMachine('vm-11'), dict(vm_props, name='vm1')),
+                              _object_update('enter', vim.VirtualMachine('vm-12'), dict(vm_props, name='vm2'))]),
+        ]
+        changed = inventory_mgr._wait_for_updates(0)
+        self.assertEqual(['', '1'], collector.versions)
+        self.assertEqual(7, len(changed))
+        inventory_mgr._update_inventory(changed)
+        current_inventory = inventory_mgr.current_inventory()
+        self.assertEqual(1, len(current_inventory['cluster']))
+        self.assertEqual(['vm1', 'vm2'], sorted(vm.dimensions['vm'] for vm in current_inventory['vm']))
+        self.assertEqual('Cluster1', current_inventory['vm'][0].sf_metadata_dims['cluster'])
+        # A renamed VM is rebuilt, a deleted one and a new powered off one are left out, the others are reused
+        collector.update_sets = [
+            _update_set('3', [_object_update('modify', vim.VirtualMachine('vm-11'), {'name': 'vm1-renamed'}),
+                              _object_update('leave', vim.VirtualMachine('vm-12')),
+                              _object_update('enter', vim.VirtualMachine('vm-13'),
+                                             dict(vm_props, name='vm3', **{'runtime.powerState': 'poweredOff'}))]),
+        ]
+        changed = inventory_mgr._wait_for_updates(0)
+        self.assertEqual(set(['vm-11', 'vm-12', 'vm-13']), changed)
+        inventory_mgr._update_inventory(changed)
+        previous_inventory, current_inventory = current_inventory, inventory_mgr.current_inventory()
+        self.assertEqual(['vm1-renamed'], [vm.dimensions['vm'] for vm in current_inventory['vm']])
+        self.assertEqual('Linux', current_inventory['vm'][0].sf_metadata_dims['guest_os'])
+        self.assertIs(previous_inventory['host'][0], current_inventory['host'][0])
+        self.assertIs(previous_inventory['cluster'][0], current_inventory['cluster'][0])
+        # Renaming the host rebuilds its VMs, which inherit its dimensions
+        collector.update_sets = [_update_set('4', [_object_update('modify', host, {'name': 'host1-renamed'})])]
+        vm = current_inventory['vm'][0]
+        inventory_mgr._update_inventory(inventory_mgr._wait_for_updates(0))
+        current_inventory = inventory_mgr.current_inventory()
+        self.assertEqual('host1-renamed', current_inventory['vm'][0].sf_metadata_dims['esx_host'])
+        self.assertIsNot(vm, current_inventory['vm'][0])
+        self.assertEqual(['', '1', '2', '3'], collector.versions)
+
+    def test_available_metrics_cache(self):
+        metric_cache = inventory.AvailableMetricsCache(ttl=300, max_size=2)
+        metric_cache.put('vm-1', {1: 'metric'}, version='1')
+        self.assertEqual({1: 'metric'}, metric_cache.get('vm-1', version='1'))
+        self.assertIsNone(metric_cache.get('vm-1', version='2'))
+        self.assertIsNone(metric_cache.get('vm-1', version='1'))
+        metric_cache.put('vm-1', {}, version='1')
+        metric_cache.put('vm-2', {})
+        metric_cache.put('vm-3', {})
+        self.assertEqual(2, len(metric_cache))
+        self.assertIsNone(metric_cache.get('vm-1', version='1'))
+        self.assertEqual(1, metric_cache.hits)
+        self.assertEqual(3, metric_cache.misses)
+
+    def test_dimension_sets(self):
+        host = inventory.Host(vim.HostSystem('host-21'), FakePerfManager(), 'TestVcenter', {'cluster': 'Cluster1'},
+                              props={'name': '192.168.1.61'}, static_dims={'dimension_key': 'dimension_value'})
+        dimension_set = host.get_dimension_set('')
+        self.assertEqual('192.168.1.61', dimension_set.dimensions['esx_host'])
+        self.assertEqual('Cluster1', dimension_set.dimensions['cluster'])
+        self.assertEqual('dimension_value', dimension_set.dimensions['dimension_key'])
+        self.assertEqual('vsphere', dimension_set.dimensions['metric_source'])
+        instance_set = host.get_dimension_set('vmhba0:C0:T0.L0')
+        self.assertEqual('vmhba0_C0_T0_L0', instance_set.dimensions['instance'])
+        self.assertIs(instance_set, host.get_dimension_set('vmhba0:C0:T0.L0'))
+        self.assertNotIn('instance', dimension_set.dimensions)
+
+    def test_shard_of(self):
+        mo_ids = ['vm-{0}'.format(index) for index in range(1000)]
+        shards = [inventory.shard_of(mo_id, 4) for mo_id in mo_ids]
+        for shard in range(4):
+            self.assertTrue(200 < shards.count(shard) < 300)
+        # Adding a shard only moves objects to the new shard
+        for mo_id, shard in zip(mo_ids, shards):
+            self.assertIn(inventory.shard_of(mo_id, 5), (shard, 4))
+        self.assertEqual([0] * 1000, [inventory.shard_of(mo_id, 1) for mo_id in mo_ids])
+
+    def test_shards_query_their_objects_only(self):
+        sim = simulator.Simulator(simulator.Topology(datacenters=2, clusters=2, hosts=2, vms=3, instances=0))
+        for sync_mode in ('walk', 'collector'):
+            sim.calls.clear()
+            _simulated_inventory_mgr(sim, sync_mode).sync_inventory()
+            total_calls = sim.calls['QueryAvailablePerfMetric']
+            mo_ids = set()
+            for shard_index in range(3):
+                sim.calls.clear()
+                inventory_mgr = _simulated_inventory_mgr(sim, sync_mode, shard_count=3, shard_index=shard_index)
+                inventory_mgr.sync_inventory()
+                shard_mo_ids = set(inv_obj.mor._GetMoId() for inv_objs in inventory_mgr.current_inventory().values()
+                                   for inv_obj in inv_objs)
+                # Only the objects of the shard have their available metrics queried
+                self.assertEqual(len(shard_mo_ids), sim.calls['QueryAvailablePerfMetric'])
+                self.assertLess(len(shard_mo_ids), total_calls)
+                mo_ids.update(shard_mo_ids)
+            self.assertEqual(total_calls, len(mo_ids))
+        vm = inventory_mgr.current_inventory()['vm'][0]
+        self.assertIn('cluster', vm.dimension_set.dimensions)
+        self.assertIn('datacenter', vm.dimension_set.dimensions)
+
+    def test_collector_sync_skips_deleted_objects(self):
+        sim = simulator.Simulator(simulator.Topology(hosts=2, vms=3, instances=0))
+        inventory_mgr = _simulated_inventory_mgr(sim, 'collector')
+        retrieve_properties = inventory_mgr._retrieve_properties
+        deleted = sim.ids(vim.VirtualMachine)[0]
+
+        def retrieve_and_delete():
+            objects = retrieve_properties()
+            sim.remove_vm(deleted)
+            return objects
+        inventory_mgr._retrieve_properties = retrieve_and_delete
+        inventory_mgr.sync_inventory()
+        current_inventory = inventory_mgr.current_inventory()
+        self.assertEqual(2, len(current_inventory['host']))
+        self.assertEqual(5, len(current_inventory['vm']))
+        self.assertNotIn(deleted, [vm.mor._GetMoId() for vm in current_inventory['vm']])
+
+    def test_incremental_sync_skips_deleted_objects(self):
+        sim = simulator.Simulator(simulator.Topology(hosts=2, vms=3, instances=0))
+        inventory_mgr = _simulated_inventory_mgr(sim, 'incremental')
+        inventory_mgr._start_updates()
+        self.addCleanup(inventory_mgr._stop_updates)
+        inventory_mgr._update_inventory(inventory_mgr._wait_for_updates(0))
+        vms = inventory_mgr.current_inventory()['vm']
+        self.assertEqual(6, len(vms))
+        added = sim.add_vm(sim.ids(vim.HostSystem)[0])
+        changed = inventory_mgr._wait_for_updates(0)
+        self.assertEqual(set([added]), changed)
+        # The added VM is deleted before it is built, the unchanged ones are reused
+        sim.remove_vm(added)
+        inventory_mgr._update_inventory(changed)
+        current_vms = inventory_mgr.current_inventory()['vm']
+        self.assertEqual([vm.mor._GetMoId() for vm in vms], [vm.mor._GetMoId() for vm in current_vms])
+        self.assertTrue(all(vm is current_vm for vm, current_vm in zip(vms, current_vms)))
+        inventory_mgr._update_inventory(inventory_mgr._wait_for_updates(0))
+        self.assertEqual(6, len(inventory_mgr.current_inventory()['vm']))
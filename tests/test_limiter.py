@@ -0,0 +1,48 @@
+import unittest
+
+import sys
+sys.path.append('../')
+import limiter
+
+
+class LimiterTests(unittest.TestCase):
+
+    def test_additive_increase(self):
+        query_limiter = limiter.AdaptiveLimiter(4, 1.0)
+        self.assertEqual(1, query_limiter.limit)
+        query_limiter.record(0.1)
+        self.assertEqual(2, query_limiter.limit)
+        query_limiter.record(0.1)
+        self.assertEqual(2, query_limiter.limit)
+        query_limiter.record(0.1)
+        self.assertEqual(3, query_limiter.limit)
+        for x in range(10):
+            query_limiter.record(0.1)
+        self.assertEqual(4, query_limiter.limit)
+        self.assertAlmostEqual(0.1, query_limiter.latency)
+
+    def test_multiplicative_decrease_on_failure(self):
+        query_limiter = limiter.AdaptiveLimiter(4, 1.0)
+        for x in range(10):
+            query_limiter.record(0.1)
+        query_limiter.record(None, failed=True)
+        self.assertEqual(2, query_limiter.limit)
+        # The queries already in flight do not decrease the limit again
+        query_limiter.record(None, failed=True)
+        self.assertEqual(2, query_limiter.limit)
+        query_limiter.record(None, failed=True)
+        self.assertEqual(1, query_limiter.limit)
+        query_limiter.record(None, failed=True)
+        self.assertEqual(1, query_limiter.limit)
+        self.assertEqual(3, query_limiter.decreases)
+
+    def test_decrease_on_latency(self):
+        query_limiter = limiter.AdaptiveLimiter(4, 1.0)
+        for x in range(10):
+            query_limiter.record(0.5)
+        self.assertEqual(4, query_limiter.limit)
+        query_limiter.record(2.0)
+        # The smoothed latency is still under the target
+        self.assertEqual(4, query_limiter.limit)
+        query_limiter.record(3.0)
+        self.assertEqual(2, query_limiter.limit)
@@ -49,3 +49,25 @@ class MetricMetadataTests(VCRTestBase):
         self.assertIsNotNone(current_metrics)
         self.assertIsNotNone(current_metrics['host'])
         self.assertIsNotNone(current_metrics['vm'])
+
+    def test_counter_catalog(self):
+        builds = []
+
+        def build_catalog():
+            builds.append(1)
+            return metric_metadata.CounterCatalog([
+                (2, metric_metadata.MetricInfo('cpu.usage.average', 1, 'gauge', 'percent')),
+                (6, metric_metadata.MetricInfo('cpu.usagemhz.average', 1, 'gauge', 'megaHertz')),
+            ])
+        catalog = metric_metadata.CounterCatalog.shared(('6.7.3', 'test-catalog'), build_catalog)
+        self.assertIs(catalog, metric_metadata.CounterCatalog.shared(('6.7.3', 'test-catalog'), build_catalog))
+        self.assertEqual(1, len(builds))
+        self.assertEqual(2, catalog.key('cpu.usage.average'))
+        self.assertEqual('cpu.usagemhz.average', catalog.name(6))
+        self.assertIsNone(catalog.key('mem.usage.average'))
+        table = catalog.metric_table(['cpu.usage.average', 'mem.usage.average'])
+        self.assertEqual([2], list(table))
+        self.assertEqual('percent', table[2].units)
+        # An expired catalog is built again
+        metric_metadata.CounterCatalog.shared(('6.7.3', 'test-catalog'), build_catalog, ttl=-1)
+        self.assertEqual(2, len(builds))
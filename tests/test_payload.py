@@ -0,0 +1,43 @@
+import unittest
+
+import sys
+sys.path.append('../')
+import payload
+
+
+def _add(payload_builder, metric_type='gauge'):
+    dimension_set = payload.DimensionSet({'vc_name': 'TestVcenter', 'vm': 'vm-1'})
+    payload_builder.add('cpu.usage.average', metric_type, 1.0, dimension_set, 1516696283000)
+
+
+class PayloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.items = []
+
+    def test_batch_by_datapoint_count(self):
+        payload_builder = payload.PayloadBuilder(3, 0, self.items.extend)
+        for x in range(7):
+            _add(payload_builder, 'gauge' if x % 2 else 'counter')
+        self.assertEqual(2, len(self.items))
+        payload_builder.flush()
+        payload_builder.flush()
+        self.assertEqual([3, 3, 1], [len(item['gauges']) + len(item['counters']) for item in self.items])
+
+    def test_batch_by_size(self):
+        dimension_set = payload.DimensionSet({'vc_name': 'TestVcenter', 'vm': 'vm-1'})
+        dp_size = payload.DATAPOINT_OVERHEAD + len('cpu.usage.average') + dimension_set.encoded_size
+        payload_builder = payload.PayloadBuilder(100, dp_size * 2, self.items.extend)
+        for x in range(5):
+            _add(payload_builder)
+        payload_builder.flush()
+        self.assertEqual([2, 2, 1], [len(item['gauges']) for item in self.items])
+
+    def test_shared_dimension_set(self):
+        payload_builder = payload.PayloadBuilder(100, 0, self.items.extend)
+        dimension_set = payload.DimensionSet({'vc_name': 'TestVcenter'})
+        payload_builder.add('cpu.usage.average', 'gauge', 1.0, dimension_set, 1516696283000)
+        payload_builder.add('mem.usage.average', 'gauge', 2.0, dimension_set, 1516696283000)
+        payload_builder.flush()
+        gauges = self.items[0]['gauges']
+        self.assertIs(gauges[0]['dimensions'], gauges[1]['dimensions'])
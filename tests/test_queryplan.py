@@ -0,0 +1,68 @@
+import unittest
+
+import sys
+sys.path.append('../')
+from pyVmomi import vim
+import errors
+import metric_metadata
+import queryplan
+
+
+class FakeInventoryObject(object):
+    INSTANT_INTERVAL = 20
+
+    def __init__(self, mo_id, counter_ids, available_instances=None):
+        self.mor = vim.VirtualMachine(mo_id)
+        self.metric_id_map = dict((counter_id, vim.PerformanceManager.MetricId(counterId=counter_id, instance=''))
+                                  for counter_id in counter_ids)
+        self.available_instances = available_instances or {}
+
+
+def _metrics(*counter_ids):
+    return dict((counter_id, metric_metadata.MetricInfo('metric{0}'.format(counter_id), 1, 'gauge', 'number'))
+                for counter_id in counter_ids)
+
+
+def _series(counter_id, instance, value):
+    return vim.PerformanceManager.IntSeries(id=vim.PerformanceManager.MetricId(counterId=counter_id,
+                                                                               instance=instance), value=[value])
+
+
+class QueryPlanTests(unittest.TestCase):
+
+    def test_plans_reused_until_changed(self):
+        planner = queryplan.QueryPlanner(metric_batch_size=2)
+        vms = [FakeInventoryObject('vm-1', [1, 2, 3]), FakeInventoryObject('vm-2', [1, 4])]
+        metrics = _metrics(1, 2, 3)
+        query_specs = planner.plan('vm', vms, metrics)
+        self.assertEqual(3, len(query_specs))
+        self.assertEqual([[1, 2], [3], [1]], [[metric_id.counterId for metric_id in spec.metricId]
+                                              for inv_obj, mor_metrics, spec in query_specs])
+        self.assertEqual(1, query_specs[0][2].maxSample)
+        self.assertEqual(2, planner.compiled)
+        self.assertIs(query_specs, planner.plan('vm', vms, metrics))
+        # Only the replaced inventory object is compiled again
+        vms = [vms[0], FakeInventoryObject('vm-2', [1, 2])]
+        query_specs = planner.plan('vm', vms, metrics)
+        self.assertEqual(3, planner.compiled)
+        self.assertEqual([1, 2], [metric_id.counterId for metric_id in query_specs[2][2].metricId])
+        # New monitored metrics compile all the plans of the type
+        planner.plan('vm', vms, _metrics(1))
+        self.assertEqual(5, planner.compiled)
+        planner.prune({'vm': vms[:1]})
+        self.assertEqual(1, len(planner))
+
+    def test_instance_policies(self):
+        policies = queryplan.parse_instance_policies({
+            'metric1': 'aggregate', 'metric2': {'include': '^vmnic', 'exclude': '1$'}, 'metric3': {'top': 1},
+        })
+        planner = queryplan.QueryPlanner(metric_batch_size=0, instance_policies=policies)
+        instances = ['', 'vmnic0', 'vmnic1', 'vmk0']
+        vm = FakeInventoryObject('vm-1', [1, 2, 3, 4], dict((counter_id, instances) for counter_id in (1, 2, 3, 4)))
+        query_specs = planner.plan('vm', [vm], _metrics(1, 2, 3, 4))
+        self.assertEqual([(1, ''), (2, ''), (2, 'vmnic0'), (3, '*'), (4, '')],
+                         sorted((metric_id.counterId, metric_id.instance) for metric_id in query_specs[0][2].metricId))
+        series = [_series(3, '', 5), _series(3, 'vmnic0', 1), _series(3, 'vmnic1', 3), _series(4, 'vmnic0', 1)]
+        self.assertEqual([series[0], series[2], series[3]], planner.select_top_instances(series, _metrics(3, 4)))
+        for conf in ({'metric1': 'all'}, {'metric1': {'top': 0}}, {'metric1': {'include': '('}}):
+            self.assertRaises(errors.ConfigError, queryplan.parse_instance_policies, conf)
@@ -0,0 +1,69 @@
+import unittest
+
+import sys
+sys.path.append('../')
+import scheduler
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTests(unittest.TestCase):
+
+    def _scheduler(self, overrun_policy):
+        self.clock = FakeClock(1000.0)
+        # The wall clock is 7 seconds past a 20 second boundary
+        return scheduler.TickScheduler(20, offset=5, overrun_policy=overrun_policy, clock=self.clock,
+                                       wall_clock=lambda: 1516696287.0)
+
+    def test_aligned_ticks(self):
+        tick_scheduler = self._scheduler('skip')
+        tick, delay = tick_scheduler.next_tick()
+        self.assertEqual((1018.0, 18.0), (tick.scheduled, delay))
+        self.clock.now = 1018.4
+        tick, delay = tick_scheduler.next_tick()
+        self.assertEqual(1038.0, tick.scheduled)
+        self.assertAlmostEqual(19.6, delay)
+        self.assertEqual((0, 0), (tick_scheduler.missed_ticks, tick_scheduler.late_ticks))
+
+    def test_skip_overrun(self):
+        tick_scheduler = self._scheduler('skip')
+        tick_scheduler.next_tick()
+        self.clock.now = 1061.0
+        tick, delay = tick_scheduler.next_tick()
+        self.assertEqual((1078.0, 17.0, False, 2), (tick.scheduled, delay, tick.late, tick.missed))
+        self.assertEqual((2, 0), (tick_scheduler.missed_ticks, tick_scheduler.late_ticks))
+
+    def test_immediate_overrun(self):
+        tick_scheduler = self._scheduler('immediate')
+        tick_scheduler.next_tick()
+        self.clock.now = 1061.0
+        tick, delay = tick_scheduler.next_tick()
+        self.assertEqual((1058.0, 0, True, False, 1), (tick.scheduled, delay, tick.late, tick.shed, tick.missed))
+        self.assertEqual((1, 1), (tick_scheduler.missed_ticks, tick_scheduler.late_ticks))
+        tick, delay = tick_scheduler.next_tick()
+        self.assertEqual((1078.0, 17.0, 0), (tick.scheduled, delay, tick.missed))
+
+    def test_type_cadence(self):
+        cadence = scheduler.TypeCadence({'cluster': 300, 'vm': 20})
+        inventory_types = ['cluster', 'host', 'vm']
+        self.assertEqual(inventory_types, cadence.due(inventory_types, 1516696205.0))
+        cadence.collected(['cluster', 'vm'], 1516696205.0)
+        self.assertEqual(['host'], cadence.due(inventory_types, 1516696219.0))
+        self.assertEqual(['host', 'vm'], cadence.due(inventory_types, 1516696225.0))
+        cadence.collected(['host', 'vm'], 1516696225.0)
+        self.assertEqual(['cluster', 'host', 'vm'], cadence.due(inventory_types, 1516696505.0))
+
+    def test_shed_overrun(self):
+        tick_scheduler = self._scheduler('shed')
+        tick_scheduler.next_tick()
+        self.clock.now = 1040.0
+        tick, delay = tick_scheduler.next_tick()
+        self.assertTrue(tick.shed)
+        self.assertEqual((1038.0, 0), (tick.scheduled, delay))
+        self.assertEqual((0, 1), (tick_scheduler.missed_ticks, tick_scheduler.late_ticks))
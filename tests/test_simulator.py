@@ -0,0 +1,60 @@
+import unittest
+
+import sys
+sys.path.append('../')
+from pyVmomi import vim
+from benchmarks import simulator
+import inventory
+
+
+def _counts(inventory_mgr):
+    return dict((key, len(value)) for key, value in inventory_mgr.current_inventory().items())
+
+
+class SimulatorTests(unittest.TestCase):
+
+    def setUp(self):
+        topology = simulator.Topology(datacenters=2, clusters=2, hosts=2, standalone_hosts=1, vms=3,
+                                      powered_off_ratio=0.34)
+        self.simulator = simulator.Simulator(topology)
+        self.si = self.simulator.service_instance()
+
+    def _inventory_mgr(self, sync_mode):
+        return inventory.InventoryManager(self.si, 60, 'TestVcenter', 'TestVcenter-sim',
+                                          inventory_conf={'sync_mode': sync_mode, 'page_size': 4})
+
+    def test_inventory_sync_modes(self):
+        expected = {'datacenter': 2, 'cluster': 4, 'host': 10, 'vm': 20}
+        for sync_mode in ('walk', 'collector'):
+            inventory_mgr = self._inventory_mgr(sync_mode)
+            inventory_mgr.sync_inventory()
+            self.assertEqual(expected, _counts(inventory_mgr))
+        vm = inventory_mgr.current_inventory()['vm'][0]
+        self.assertEqual('Cluster0-0', vm.dimension_set.dimensions['cluster'])
+        self.assertEqual(1, self.simulator.calls['RetrievePropertiesEx'])
+        self.assertEqual(12, self.simulator.calls['ContinueRetrievePropertiesEx'])
+
+    def test_incremental_updates(self):
+        inventory_mgr = self._inventory_mgr('incremental')
+        inventory_mgr._start_updates()
+        inventory_mgr._update_inventory(inventory_mgr._wait_for_updates(0))
+        self.assertEqual(20, _counts(inventory_mgr)['vm'])
+        self.simulator.add_vm(self.simulator.ids(vim.HostSystem)[0])
+        self.simulator.add_vm(self.simulator.ids(vim.HostSystem)[1])
+        self.simulator.remove_vm(inventory_mgr.current_inventory()['vm'][0].mor._GetMoId())
+        changed = inventory_mgr._wait_for_updates(0)
+        self.assertEqual(3, len(changed))
+        inventory_mgr._update_inventory(changed)
+        self.assertEqual(21, _counts(inventory_mgr)['vm'])
+        inventory_mgr._stop_updates()
+
+    def test_query_perf(self):
+        perf_manager = self.si.RetrieveServiceContent().perfManager
+        vm = vim.VirtualMachine(self.simulator.ids(vim.VirtualMachine)[0], self.simulator)
+        metric_ids = perf_manager.QueryAvailablePerfMetric(vm, None, None, 20)
+        query_spec = vim.PerformanceManager.QuerySpec(entity=vm, metricId=metric_ids, intervalId=20, maxSample=3)
+        result = perf_manager.QueryPerf(querySpec=[query_spec])
+        self.assertEqual(1, len(result))
+        self.assertEqual(3, len(result[0].sampleInfo))
+        self.assertEqual(len(metric_ids), len(result[0].value))
+        self.assertEqual(3, len(result[0].value[0].value))
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import sys
+sys.path.append('../')
+import spool
+
+
+def _item(dp_count, value=1):
+    return {'gauges': [{'metric': 'cpu.usage.average', 'value': value}] * dp_count, 'counters': []}
+
+
+class SpoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _spool(self, max_bytes=1024 * 1024, max_age=3600, segment_bytes=200):
+        payload_spool = spool.Spool(self.directory, max_bytes, max_age, segment_bytes, 'VCenterInstance')
+        self.addCleanup(payload_spool.close)
+        return payload_spool
+
+    def test_segments_in_order(self):
+        payload_spool = self._spool()
+        for value in range(6):
+            payload_spool.append(_item(2, value))
+        self.assertEqual(12, len(payload_spool))
+        self.assertGreater(len(os.listdir(self.directory)), 1)
+        values = []
+        while True:
+            oldest = payload_spool.oldest()
+            if oldest is None:
+                break
+            segment, items = oldest
+            values.extend(item['gauges'][0]['value'] for item in items)
+            payload_spool.remove(segment)
+        self.assertEqual(list(range(6)), values)
+        self.assertEqual(0, payload_spool.bytes)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_reopen(self):
+        payload_spool = self._spool()
+        payload_spool.append(_item(3))
+        payload_spool.close()
+        payload_spool = self._spool()
+        self.assertEqual(3, len(payload_spool))
+        segment, items = payload_spool.oldest()
+        self.assertEqual([_item(3)], items)
+
+    def test_size_limit(self):
+        payload_spool = self._spool(max_bytes=300, segment_bytes=100)
+        for value in range(10):
+            payload_spool.append(_item(1, value))
+        self.assertLessEqual(payload_spool.bytes, 300)
+        self.assertGreater(payload_spool.dropped, 0)
+        self.assertEqual(10, payload_spool.dropped + len(payload_spool))
+        segment, items = payload_spool.oldest()
+        self.assertGreater(items[0]['gauges'][0]['value'], 0)
+
+    def test_age_limit(self):
+        payload_spool = self._spool(max_age=-1)
+        payload_spool.append(_item(1))
+        self.assertIsNone(payload_spool.oldest())
+        self.assertEqual(1, payload_spool.dropped)
+
+    def test_limits_keep_replayed_segment(self):
+        payload_spool = self._spool(max_bytes=300, segment_bytes=100)
+        payload_spool.append(_item(1, 0))
+        segment, items = payload_spool.oldest()
+        segment.created = 0
+        # The limits drop the other segments while the oldest one is replayed
+        for value in range(1, 10):
+            payload_spool.append(_item(1, value))
+        self.assertTrue(os.path.exists(segment.path))
+        self.assertLessEqual(payload_spool.bytes, 300)
+        self.assertEqual(9, payload_spool.dropped + len(payload_spool) - 1)
+        payload_spool.remove(segment)
+        self.assertFalse(os.path.exists(segment.path))
+        self.assertEqual(9, payload_spool.dropped + len(payload_spool))
+        # The oldest payloads after the replayed segment were dropped
+        segment, items = payload_spool.oldest()
+        self.assertGreater(items[0]['gauges'][0]['value'], 1)
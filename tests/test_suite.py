@@ -1,12 +1,28 @@
 import unittest
+from test_changefilter import ChangeFilterTests
+from test_collector import CollectorTests
+from test_datapoints import DatapointsTests
+from test_dispatcher import DispatcherTests
+from test_environment import EnvironmentTests
+from test_instrumentation import InstrumentationTests
 from test_inventory import InventoryTests
+from test_limiter import LimiterTests
 from test_metric_metadata import MetricMetadataTests
+from test_payload import PayloadTests
+from test_queryplan import QueryPlanTests
+from test_scheduler import SchedulerTests
+from test_simulator import SimulatorTests
+from test_spool import SpoolTests
 from test_vsphere_metrics import VSPhereMetricsTests
+from test_warmstart import WarmStartTests
 
 
 def suite():
     suite = unittest.TestSuite()
-    suite.addTests([InventoryTests(), MetricMetadataTests(), VSPhereMetricsTests()])
+    suite.addTests([ChangeFilterTests(), CollectorTests(), DatapointsTests(), DispatcherTests(), EnvironmentTests(),
+                    InstrumentationTests(), InventoryTests(), LimiterTests(), MetricMetadataTests(), PayloadTests(),
+                    QueryPlanTests(), SchedulerTests(), SimulatorTests(), SpoolTests(), VSPhereMetricsTests(),
+                    WarmStartTests()])
     return suite
 
 
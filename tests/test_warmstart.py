@@ -0,0 +1,40 @@
+import datetime
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import sys
+sys.path.append('../')
+import warmstart
+
+
+class WarmStartTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_save_and_load(self):
+        directory = os.path.join(self.directory, 'missing', 'warmstart')
+        cache = warmstart.WarmStartCache(directory, 'TestVcenter', 'test', 60)
+        boot_time = datetime.datetime(2026, 10, 1, 12, 30, tzinfo=datetime.timezone.utc)
+        local_time = datetime.datetime(2026, 10, 1, 14, 30, 5, 250, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+        naive_time = datetime.datetime(2026, 10, 1, 12, 30)
+        state = {'inventory': {'host': [{'mo_id': 'host-1', 'version': boot_time, 'metric_ids': [[2, '']]},
+                                        {'mo_id': 'host-2', 'version': local_time, 'metric_ids': []},
+                                        {'mo_id': 'host-3', 'version': naive_time, 'metric_ids': []}]}}
+        cache.save(state)
+        loaded = cache.load()
+        self.assertEqual(state, loaded)
+        self.assertEqual(local_time.utcoffset(), loaded['inventory']['host'][1]['version'].utcoffset())
+        self.assertIsNone(loaded['inventory']['host'][2]['version'].tzinfo)
+        self.assertIsNone(warmstart.WarmStartCache(directory, 'OtherVcenter', 'test', 60).load())
+        self.assertEqual(['TestVcenter.warmstart'], os.listdir(directory))
+
+    def test_load_ignores_other_formats(self):
+        cache = warmstart.WarmStartCache(self.directory, 'TestVcenter', 'test', 60)
+        with open(cache.path, 'wb') as f:
+            pickle.dump({'format': warmstart.FORMAT_VERSION, 'name': 'TestVcenter', 'saved': 0, 'state': {}}, f)
+        self.assertIsNone(cache.load())
@@ -8,5 +8,9 @@ if [ "$?" -ne 0 ]; then
     exit 1;
 fi
 
+if [ "$1" = "--bench" ]; then
+    python3 benchmarks/bench_collection.py --sizes 100,1000,10000 --budgets benchmarks/budgets.json
+fi
+
 cd tests/
 python3 -m unittest test_suite.py
\ No newline at end of file
@@ -1,4 +1,6 @@
 from environment import Environment
+from collector import CollectionWorker
+import functools
 import time
 import logging
 import utils
@@ -6,12 +8,11 @@ import constants
 import signal
 import sys
 import yaml
-import datetime
 
 
 logging.setLoggerClass(utils.VSphereLogger)
 logger = logging.getLogger('VSphere')
-envs = []
+workers = []
 
 
 def _handle_exit_signal(signum, stack):
@@ -23,19 +24,23 @@ def _handle_exit_signal(signum, stack):
     """
     if signum == signal.SIGUSR1:
         logger.info("Signal received. Exiting gracefully")
-        _stop_envs(envs)
+        _stop_envs()
         sys.exit(0)
 
 
-def _stop_envs(envs):
+def _stop_envs():
     """
-    Stops all the Environments.
-    :param envs: List of environments.
+    Stops the collection workers and all the Environments they created.
     :return: null
 
     """
-    for env in envs:
-        env.stop_managers()
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.join(timeout=constants.DEFAULT_TIMEOUT)
+    for worker in workers:
+        if worker.env is not None:
+            worker.env.stop_managers()
 
 
 def _get_config():
@@ -63,6 +68,18 @@ def _get_config():
             plugin_config['IngestToken'] = conf['IngestToken']
             plugin_config['IngestEndpoint'] = conf.get('IngestEndpoint', constants.DEFAULT_INGEST_ENDPOINT)
             plugin_config['IngestTimeout'] = conf.get('IngestTimeout', constants.DEFAULT_INGEST_TIMEOUT)
+            if 'IngestBatchSize' in conf:
+                plugin_config['IngestBatchSize'] = conf['IngestBatchSize']
+            if 'IngestBatchBytes' in conf:
+                plugin_config['IngestBatchBytes'] = conf['IngestBatchBytes']
+            if 'IngestQueueSize' in conf:
+                plugin_config['IngestQueueSize'] = conf['IngestQueueSize']
+            if 'IngestWorkers' in conf:
+                plugin_config['IngestWorkers'] = conf['IngestWorkers']
+            if 'IngestQueuePolicy' in conf:
+                plugin_config['IngestQueuePolicy'] = conf['IngestQueuePolicy']
+            if 'IngestRetries' in conf:
+                plugin_config['IngestRetries'] = conf['IngestRetries']
             if 'MORSyncInterval' in conf:
                 plugin_config['MORSyncInterval'] = conf['MORSyncInterval']
             if 'MetricSyncInterval' in conf:
@@ -71,6 +88,64 @@ def _get_config():
                 plugin_config['MORSyncTimeout'] = conf['MORSyncTimeout']
             if 'MetricSyncTimeout' in conf:
                 plugin_config['MetricSyncTimeout'] = conf['MetricSyncTimeout']
+            if 'AvailableMetricsCacheTTL' in conf:
+                plugin_config['AvailableMetricsCacheTTL'] = conf['AvailableMetricsCacheTTL']
+            if 'AvailableMetricsCacheSize' in conf:
+                plugin_config['AvailableMetricsCacheSize'] = conf['AvailableMetricsCacheSize']
+            if 'MORSyncMode' in conf:
+                plugin_config['MORSyncMode'] = conf['MORSyncMode']
+            if 'MORSyncPageSize' in conf:
+                plugin_config['MORSyncPageSize'] = conf['MORSyncPageSize']
+            if 'MORFullSyncInterval' in conf:
+                plugin_config['MORFullSyncInterval'] = conf['MORFullSyncInterval']
+            if 'SpoolDir' in conf:
+                plugin_config['SpoolDir'] = conf['SpoolDir']
+            if 'SpoolMaxBytes' in conf:
+                plugin_config['SpoolMaxBytes'] = conf['SpoolMaxBytes']
+            if 'SpoolMaxAge' in conf:
+                plugin_config['SpoolMaxAge'] = conf['SpoolMaxAge']
+            if 'SpoolReplayRate' in conf:
+                plugin_config['SpoolReplayRate'] = conf['SpoolReplayRate']
+            if 'WarmStartCacheDir' in conf:
+                plugin_config['WarmStartCacheDir'] = conf['WarmStartCacheDir']
+            if 'ShardCount' in conf:
+                plugin_config['ShardCount'] = conf['ShardCount']
+            if 'ShardIndex' in conf:
+                plugin_config['ShardIndex'] = conf['ShardIndex']
+            if 'QuerySessions' in conf:
+                plugin_config['QuerySessions'] = conf['QuerySessions']
+            if 'SessionCheckIdle' in conf:
+                plugin_config['SessionCheckIdle'] = conf['SessionCheckIdle']
+            if 'QueryLatencyTarget' in conf:
+                plugin_config['QueryLatencyTarget'] = conf['QueryLatencyTarget']
+            if 'QueryLimitDecrease' in conf:
+                plugin_config['QueryLimitDecrease'] = conf['QueryLimitDecrease']
+            if 'InstancePolicies' in conf:
+                plugin_config['InstancePolicies'] = conf['InstancePolicies']
+            if 'QueryBatchSize' in conf:
+                plugin_config['QueryBatchSize'] = conf['QueryBatchSize']
+            if 'QueryMetricBatchSize' in conf:
+                plugin_config['QueryMetricBatchSize'] = conf['QueryMetricBatchSize']
+            if 'CatchUpSamples' in conf:
+                plugin_config['CatchUpSamples'] = conf['CatchUpSamples']
+            if 'CatchUpWindow' in conf:
+                plugin_config['CatchUpWindow'] = conf['CatchUpWindow']
+            if 'CollectionInterval' in conf:
+                plugin_config['CollectionInterval'] = conf['CollectionInterval']
+            if 'CollectionDeadline' in conf:
+                plugin_config['CollectionDeadline'] = conf['CollectionDeadline']
+            if 'CollectionIntervals' in conf:
+                plugin_config['CollectionIntervals'] = conf['CollectionIntervals']
+            if 'CollectionOffset' in conf:
+                plugin_config['CollectionOffset'] = conf['CollectionOffset']
+            if 'CollectionOverrunPolicy' in conf:
+                plugin_config['CollectionOverrunPolicy'] = conf['CollectionOverrunPolicy']
+            if 'SuppressUnchanged' in conf:
+                plugin_config['SuppressUnchanged'] = conf['SuppressUnchanged']
+            if 'HeartbeatCycles' in conf:
+                plugin_config['HeartbeatCycles'] = conf['HeartbeatCycles']
+            if 'SelfMetrics' in conf:
+                plugin_config['SelfMetrics'] = conf['SelfMetrics']
             if 'verbosity_level' in conf:
                 plugin_config['verbosity_level'] = conf['verbosity_level']
             if 'IncludeMetrics' in conf:
@@ -89,7 +164,8 @@ def _get_config():
 def _run(config_list):
     """
     Creates environments(for each vCenter) from config list and runs the metric collection for all envs
-    until exit signal is received.
+    until exit signal is received. Each environment is created concurrently on the thread of its collection
+    worker, and starts collecting as soon as it is ready.
     :param config_list:  List of plugin configuration for different environments.
     :return: null
 
@@ -98,42 +174,40 @@ def _run(config_list):
     if len(config_list) == 0:
         logger.warning("No config to handle. Shutting down the client.")
         return
+    logger.info("Creating environments")
     for plugin_config in config_list:
-        logger.info("Creating environments")
+        instance_id = "{0}-{1}".format(plugin_config['Name'], plugin_config['host'])
+        interval = plugin_config.get('CollectionInterval', constants.DEFAULT_COLLECTION_INTERVAL)
         try:
-            env = Environment(plugin_config)
-            envs.append(env)
-        except Exception as e:
-            logger.error("An error occured while setting up an environment: {0}".format(e))
+            workers.append(CollectionWorker(None, interval, plugin_config.get('CollectionDeadline', interval),
+                                            plugin_config.get('CollectionOffset', constants.DEFAULT_COLLECTION_OFFSET),
+                                            plugin_config.get('CollectionOverrunPolicy',
+                                                              constants.DEFAULT_COLLECTION_OVERRUN_POLICY),
+                                            env_factory=functools.partial(Environment, plugin_config),
+                                            instance_id=instance_id))
+        except ValueError as e:
+            logger.error("Invalid collection settings for {0}: {1}".format(instance_id, e))
 
-    if len(envs) == 0:
+    if len(workers) == 0:
         logger.warning("No environments were created. Shutting down the client")
         return
+    for worker in workers:
+        worker.start()
     while True:
         try:
-            start_time = datetime.datetime.now()
-            for env in envs:
-                try:
-                    """ Executes reading and sending of metrics."""
-                    env.read_metric_values()
-                    logger.info("Sent metrics for env : {0}".format(env.get_instance_id()))
-                except Exception:
-                    logger.exception("Failed to send metrics for env {0}".format(env.get_instance_id()))
-                    continue
-            end_time = datetime.datetime.now()
-            exec_time = (end_time - start_time).seconds
-            wait_time = constants.DEFAULT_COLLECTION_INTERVAL - exec_time
-            if wait_time < 0:
-                logger.warning("Execution took a lot of time : {0} seconds".format(exec_time))
-            else:
-                time.sleep(wait_time)
+            time.sleep(1)
+            # The workers only exit on their own when their settings are invalid
+            if not any(worker.is_alive() for worker in workers):
+                logger.warning("No environments were created. Shutting down the client")
+                _stop_envs()
+                break
         except KeyboardInterrupt:
             logger.info("Exiting because of KeyBoardInterrupt")
-            _stop_envs(envs)
+            _stop_envs()
             break
         except Exception as e:
             logger.error("Error occured : {0}".format(e))
-            _stop_envs(envs)
+            _stop_envs()
             break
 
 
@@ -0,0 +1,104 @@
+"""
+Module containing a class for persisting the synced inventory and metric metadata of a vCenter
+to a local file, so that a restarted collector can collect before its first sync completes.
+"""
+
+import datetime
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+# Incremented when the layout of the saved state changes, files of other versions are ignored
+FORMAT_VERSION = 2
+# Format of the saved datetimes, with their UTC offset when they have one
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _encode(value):
+    """
+    Encodes the values JSON has no type for, eg: the boot time of a host used as its version.
+    :param value: Value to encode
+    :return: dict
+
+    """
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.strftime(DATETIME_FORMAT + '%z')}
+    raise TypeError("Unable to save a {0} in the warm start cache".format(type(value).__name__))
+
+
+def _decode(obj):
+    if '__datetime__' in obj:
+        value = obj['__datetime__']
+        if value[-5:-4] in ('+', '-'):
+            return datetime.datetime.strptime(value, DATETIME_FORMAT + '%z')
+        return datetime.datetime.strptime(value, DATETIME_FORMAT)
+    return obj
+
+
+class WarmStartCache(object):
+    """
+
+    Saved state of a vCenter, as a JSON file. Loading it only creates plain data, so a file placed in
+    the cache directory cannot run code in the collector.
+
+    """
+    def __init__(self, directory, name, instance_id, max_age):
+        """
+        :param directory: Directory of the cache files
+        :param name: Name of the state, unique per vCenter and shard, eg: the vCenter name
+        :param instance_id: Instance id for logging
+        :param max_age: Age in seconds after which a saved state is ignored
+
+        """
+        self.path = os.path.join(directory, "{0}.warmstart".format(re.sub(r'[^\w.-]', '_', name)))
+        self._name = name
+        self._max_age = max_age
+        self._logger = logging.getLogger("{0}-WS".format(instance_id))
+
+    def load(self):
+        """
+        Loads the saved state.
+        :return: dict, None when there is no usable saved state
+
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f, object_hook=_decode)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self._logger.warning("Unable to load warm start cache {0} : {1}".format(self.path, e))
+            return None
+        if not isinstance(saved, dict) or saved.get('format') != FORMAT_VERSION or saved.get('name') != self._name:
+            self._logger.info("Ignoring warm start cache {0} of another version or vCenter".format(self.path))
+            return None
+        age = time.time() - saved['saved']
+        if age > self._max_age:
+            self._logger.info("Ignoring warm start cache {0} saved {1} seconds ago".format(self.path, int(age)))
+            return None
+        return saved['state']
+
+    def save(self, state):
+        """
+        Saves the state, replacing the previous one atomically so that a crash never leaves a partial file.
+        The cache directory is created when missing.
+        :param state: dict of plain data with string keys, datetimes are encoded explicitly
+        :return: null
+
+        """
+        saved = {'format': FORMAT_VERSION, 'name': self._name, 'saved': time.time(), 'state': state}
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.warmstart-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, default=_encode, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.unlink(temp_path)
+            raise